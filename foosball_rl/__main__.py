@@ -12,7 +12,8 @@ with open(Path(__file__).parent / 'logging' / 'logging_config.yml') as f:
 
 import foosball_rl.environments  # noqa: F401
 from foosball_rl.modes.train import train_loop
-from foosball_rl.modes.eval import evaluate_model
+from foosball_rl.modes.eval import evaluate_model, run_tournament
+from foosball_rl.modes.render import render_trajectories
 
 logger = logging.getLogger(__name__)
 
@@ -28,11 +29,26 @@ def main():
         if training_path.exists():
             training_path = rewrite_path_if_exists(training_path)
         train_loop(env_id=ENV_ID, algo=RL_ALGORITHM, training_path=training_path)
+    elif EXECUTION_MODE == 'resume':
+        training_path = base_dir / 'training'
+        if not training_path.exists():
+            raise ValueError(f"No training to resume in {training_path}")
+        train_loop(env_id=ENV_ID, algo=RL_ALGORITHM, training_path=training_path, resume=True)
     elif EXECUTION_MODE == 'eval':
         evaluation_path = base_dir / 'evaluation'
         if evaluation_path.exists():
             evaluation_path = rewrite_path_if_exists(evaluation_path)
         evaluate_model(env_id=ENV_ID, algo=RL_ALGORITHM, eval_path=evaluation_path)
+    elif EXECUTION_MODE == 'tournament':
+        tournament_path = base_dir / 'tournament'
+        if tournament_path.exists():
+            tournament_path = rewrite_path_if_exists(tournament_path)
+        run_tournament(env_id=ENV_ID, algo=RL_ALGORITHM, tournament_path=tournament_path)
+    elif EXECUTION_MODE == 'render':
+        render_path = base_dir / 'render'
+        if render_path.exists():
+            render_path = rewrite_path_if_exists(render_path)
+        render_trajectories(env_id=ENV_ID, render_path=render_path)
     else:
         raise ValueError(f"Unknown execution mode: {EXECUTION_MODE}")
 
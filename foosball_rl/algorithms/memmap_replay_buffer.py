@@ -0,0 +1,102 @@
+import logging
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+import torch as th
+from gymnasium import spaces
+from stable_baselines3.common.buffers import BaseBuffer, ReplayBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class MemmapReplayBuffer(ReplayBuffer):
+    """
+    Replay buffer whose transitions are stored in memory-mapped ``.npy`` files in ``buffer_path`` instead of RAM, so
+    that the buffer can be larger than the available memory. It is used exactly like SB3's ``ReplayBuffer``, e.g. with
+    ``replay_buffer_class: MemmapReplayBuffer`` in ``hyperparameter.yml``.
+
+    Pickling the buffer (``model.save_replay_buffer``, the ``CheckpointCallback``) only flushes the files and writes
+    the position and the layout of the buffer, the transitions are not copied. Loading it (``model.load_replay_buffer``)
+    maps the files again, so the pickle is only valid together with the files in ``buffer_path``, which always hold
+    the latest transitions: restoring an older pickle restores its position, but not the transitions written since.
+
+    Files of a previous buffer with the same layout in ``buffer_path`` are reused instead of being truncated, so that a
+    model created for resuming the training does not destroy the buffer before it is loaded.
+
+    :param buffer_size: Max number of elements in the buffer
+    :param observation_space: Observation space
+    :param action_space: Action space
+    :param device: PyTorch device
+    :param n_envs: Number of parallel environments
+    :param optimize_memory_usage: Enable a memory efficient variant of the replay buffer, see ``ReplayBuffer``
+    :param handle_timeout_termination: Handle timeout termination (due to timelimit) separately and treat the task as
+        infinite horizon task, see ``ReplayBuffer``
+    :param buffer_path: Directory of the memory-mapped files, defaults to a new temporary directory
+    """
+
+    def __init__(self,
+                 buffer_size: int,
+                 observation_space: spaces.Space,
+                 action_space: spaces.Space,
+                 device: Union[th.device, str] = "auto",
+                 n_envs: int = 1,
+                 optimize_memory_usage: bool = False,
+                 handle_timeout_termination: bool = True,
+                 buffer_path: Optional[str] = None):
+        # The in-memory arrays of the ReplayBuffer are replaced by memory maps, so its constructor is skipped
+        BaseBuffer.__init__(self, buffer_size, observation_space, action_space, device, n_envs=n_envs)
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        if optimize_memory_usage and handle_timeout_termination:
+            raise ValueError("ReplayBuffer does not support optimize_memory_usage = True "
+                             "and handle_timeout_termination = True simultaneously.")
+        self.optimize_memory_usage = optimize_memory_usage
+        self.handle_timeout_termination = handle_timeout_termination
+
+        if buffer_path is None:
+            buffer_path = tempfile.mkdtemp(prefix='foosball_rl_replay_buffer_')
+        self.buffer_path = Path(buffer_path)
+        self.buffer_path.mkdir(parents=True, exist_ok=True)
+
+        # name -> (shape, dtype) of the memory-mapped arrays
+        self._array_layout: Dict[str, Tuple[Tuple[int, ...], str]] = {
+            'observations': ((self.buffer_size, self.n_envs, *self.obs_shape), np.dtype(observation_space.dtype).str)}
+        if not optimize_memory_usage:
+            # When optimizing memory, `observations` contains also the next observation
+            self._array_layout['next_observations'] = self._array_layout['observations']
+        self._array_layout['actions'] = ((self.buffer_size, self.n_envs, self.action_dim),
+                                         np.dtype(self._maybe_cast_dtype(action_space.dtype)).str)
+        for name in ('rewards', 'dones', 'timeouts'):
+            self._array_layout[name] = ((self.buffer_size, self.n_envs), np.dtype(np.float32).str)
+        self._open_arrays(create=True)
+
+        logger.info("Memory-mapped replay buffer of %.2f GB in %s", sum(
+            np.prod(shape) * np.dtype(dtype).itemsize for shape, dtype in self._array_layout.values()) / 1e9,
+                    self.buffer_path)
+
+    def flush(self) -> None:
+        """Writes the transitions that are still only in the page cache to the files."""
+        for name in self._array_layout:
+            getattr(self, name).flush()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        self.flush()
+        state = self.__dict__.copy()
+        for name in self._array_layout:
+            del state[name]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._open_arrays(create=False)
+
+    def _open_arrays(self, create: bool) -> None:
+        for name, (shape, dtype) in self._array_layout.items():
+            path = self.buffer_path / f'{name}.npy'
+            array = np.load(path, mmap_mode='r+') if path.is_file() else None
+            if array is None or array.shape != shape or array.dtype != np.dtype(dtype):
+                if not create:
+                    raise ValueError(f"The replay buffer file {path} is missing or does not match the buffer layout")
+                array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+            setattr(self, name, array)
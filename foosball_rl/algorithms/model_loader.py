@@ -1,32 +1,52 @@
+import importlib
 import logging
 from pathlib import Path
-from typing import Dict, Any, Type
+from typing import Dict, Any, Iterator, Mapping, Type
 
 import yaml
-from sb3_contrib import ARS, QRDQN, TQC, TRPO, RecurrentPPO
-from stable_baselines3 import A2C, DDPG, DQN, PPO, SAC, TD3
 from stable_baselines3.common.base_class import BaseAlgorithm
 from stable_baselines3.common.vec_env import unwrap_vec_wrapper, VecEnv, VecNormalize
 
+from foosball_rl.algorithms.memmap_replay_buffer import MemmapReplayBuffer
 from foosball_rl.environments.common.wrappers.custom_vec_wrappers import VecPBRSWrapper
 
 logger = logging.getLogger(__name__)
 
 
-ALGOS: Dict[str, Type[BaseAlgorithm]] = {
-    "a2c": A2C,
-    "ddpg": DDPG,
-    "dqn": DQN,
-    "ppo": PPO,
-    "sac": SAC,
-    "td3": TD3,
+class AlgorithmRegistry(Mapping[str, Type[BaseAlgorithm]]):
+    """
+    Maps the algorithm names to their classes, given as ``'<module>.<class>'``. An algorithm is only imported when it
+    is looked up, so e.g. sb3_contrib is not imported when training with an SB3 algorithm.
+    """
+
+    def __init__(self, algorithm_paths: Dict[str, str]):
+        self._algorithm_paths = algorithm_paths
+
+    def __getitem__(self, algo: str) -> Type[BaseAlgorithm]:
+        module_name, class_name = self._algorithm_paths[algo].rsplit('.', 1)
+        return getattr(importlib.import_module(module_name), class_name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._algorithm_paths)
+
+    def __len__(self) -> int:
+        return len(self._algorithm_paths)
+
+
+ALGOS = AlgorithmRegistry({
+    "a2c": "stable_baselines3.A2C",
+    "ddpg": "stable_baselines3.DDPG",
+    "dqn": "stable_baselines3.DQN",
+    "ppo": "stable_baselines3.PPO",
+    "sac": "stable_baselines3.SAC",
+    "td3": "stable_baselines3.TD3",
     # SB3 Contrib,
-    "ars": ARS,
-    "qrdqn": QRDQN,
-    "tqc": TQC,
-    "trpo": TRPO,
-    "ppo_lstm": RecurrentPPO,
-}
+    "ars": "sb3_contrib.ARS",
+    "qrdqn": "sb3_contrib.QRDQN",
+    "tqc": "sb3_contrib.TQC",
+    "trpo": "sb3_contrib.TRPO",
+    "ppo_lstm": "sb3_contrib.RecurrentPPO",
+})
 
 
 def get_model(algo: str, env, seed: int, experiment_path: Path) -> tuple[BaseAlgorithm, Dict[str, Any]]:
@@ -37,10 +57,22 @@ def get_model(algo: str, env, seed: int, experiment_path: Path) -> tuple[BaseAlg
     # Update discount-factor in relevant wrappers
     update_discount_factor(env, float(hyperparameter['gamma']))
 
+    if hyperparameter.get('replay_buffer_class') is MemmapReplayBuffer:
+        # Every seed gets its own buffer files, next to its checkpoints
+        replay_buffer_kwargs = hyperparameter.setdefault('replay_buffer_kwargs', {})
+        replay_buffer_kwargs.setdefault('buffer_path', str(experiment_path / f'seed-{seed}' / 'replay_buffer'))
+
     return (ALGOS[algo](env=env, seed=seed, tensorboard_log=(experiment_path / 'tensorboard').__str__(), **hyperparameter),
             hyperparameter)
 
 
+def load_model(algo: str, env, model_path: Path, experiment_path: Path) -> BaseAlgorithm:
+    """Loads a saved model, e.g. of a checkpoint, to continue its training on ``env``."""
+    model = ALGOS[algo].load(model_path, env=env, tensorboard_log=(experiment_path / 'tensorboard').__str__())
+    update_discount_factor(env, model.gamma)
+    return model
+
+
 def get_hyperparameter(algo):
     with open(Path(__file__).parent / 'hyperparameter.yml') as f:
         hyperparameter_dict = yaml.safe_load(f)
@@ -0,0 +1,4 @@
+from foosball_rl.bench.throughput import main
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Microbenchmark of the action repeat modes of ``ActionRepeatSimulator``.
+
+Usage: python -m foosball_rl.bench.action_repeat [--model goalkeeper|foosball] [--steps N] [--step-frequency K]
+"""
+import argparse
+import time
+from pathlib import Path
+
+import mujoco
+import numpy as np
+
+from foosball_rl.environments.common.action_repeat import ActionRepeatSimulator, ACTION_REPEAT_MODES
+
+MODEL_PATHS = {
+    'goalkeeper': Path(__file__).parent.parent / 'environments' / 'goalkeeper' / 'goalkeeper.xml',
+    'foosball': Path(__file__).parent.parent / 'environments' / 'foosball' / 'foosball.xml',
+}
+
+
+def benchmark_action_repeat(model: str, n_steps: int, step_frequency: int, seed: int = 0) -> dict[str, float]:
+    """
+    Times ``n_steps`` agent steps of each action repeat mode on identical random controls.
+
+    :return: Agent steps per second for each mode
+    """
+    mj_model = mujoco.MjModel.from_xml_path(MODEL_PATHS[model].as_posix())
+    controls = np.random.default_rng(seed).uniform(low=mj_model.actuator_ctrlrange[:, 0],
+                                                   high=mj_model.actuator_ctrlrange[:, 1],
+                                                   size=(n_steps, mj_model.nu))
+    steps_per_second = {}
+    for mode in ACTION_REPEAT_MODES:
+        mj_data = mujoco.MjData(mj_model)
+        simulator = ActionRepeatSimulator(mj_model, mj_data, nr_steps=step_frequency, mode=mode)
+        start = time.perf_counter()
+        for ctrl in controls:
+            simulator.step(ctrl)
+        steps_per_second[mode] = n_steps / (time.perf_counter() - start)
+        simulator.close()
+    return steps_per_second
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=MODEL_PATHS.keys(), default='goalkeeper')
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--step-frequency', type=int, default=16)
+    args = parser.parse_args()
+
+    results = benchmark_action_repeat(args.model, args.steps, args.step_frequency)
+    baseline = results['loop']
+    for mode, steps_per_second in results.items():
+        print(f"{mode:>8}: {steps_per_second:10.1f} steps/s ({steps_per_second / baseline:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Measures the memory allocated per ``RawEnv.step`` with tracemalloc, with and without ``reuse_step_buffers``.
+
+The allocation-free step path (``reuse_step_buffers=True``) must stay below the thresholds: the mean tracemalloc peak
+per step (the Python objects of the step's return values, but no new observation arrays or info dicts) and the memory
+retained after all steps (no per-step growth). The default peak threshold lies well below the allocating path (about
+470 B per step for Goalkeeper-v0 and 570 B for Foosball-v0), the reuse path stays at about 100 B. The exit code is 1
+if a threshold is exceeded, so the check can guard against allocation regressions, see also
+tests/test_step_allocations.py.
+
+Usage: python -m foosball_rl.bench.allocations [--env Goalkeeper-v0|Foosball-v0] [--steps N]
+    [--max-mean-peak-bytes B] [--max-retained-bytes B]
+"""
+import argparse
+import logging
+import sys
+import tracemalloc
+
+import gymnasium as gym
+import numpy as np
+
+import foosball_rl.environments  # noqa: F401, registers the environments
+
+
+def measure_step_allocations(env_id: str, n_steps: int, reuse_step_buffers: bool, seed: int = 0) -> dict[str, float]:
+    """
+    Steps the unwrapped environment with a fixed action and records the tracemalloc peak of every step, i.e. the
+    largest amount of memory allocated on top of the memory that was in use before the step.
+
+    :return: Mean and max peak bytes per step, and the bytes still allocated after all steps
+    """
+    env = gym.make(env_id, render_mode=None, reuse_step_buffers=reuse_step_buffers).unwrapped
+    env.reset(seed=seed)
+    action = np.zeros(env.action_space.shape, dtype=env.action_space.dtype)
+    for _ in range(10):
+        # Warm up lazily initialized caches
+        env.step(action)
+
+    peaks = np.zeros(n_steps)
+    tracemalloc.start()
+    start_size, _ = tracemalloc.get_traced_memory()
+    for step in range(n_steps):
+        tracemalloc.reset_peak()
+        size, _ = tracemalloc.get_traced_memory()
+        _, _, terminated, truncated, _ = env.step(action)
+        peaks[step] = tracemalloc.get_traced_memory()[1] - size
+        if terminated or truncated:
+            env.reset()
+    end_size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    env.close()
+    return {'mean_peak_bytes': float(peaks.mean()),
+            'max_peak_bytes': float(peaks.max()),
+            'retained_bytes': float(end_size - start_size)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--env', default='Goalkeeper-v0')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--max-mean-peak-bytes', type=float, default=256,
+                        help="Threshold of the mean peak bytes per step with reuse_step_buffers")
+    parser.add_argument('--max-retained-bytes', type=float, default=1024,
+                        help="Threshold of the bytes retained after all steps with reuse_step_buffers")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    failed = False
+    for reuse_step_buffers in (False, True):
+        results = measure_step_allocations(args.env, args.steps, reuse_step_buffers)
+        exceeded = []
+        if reuse_step_buffers:
+            if results['mean_peak_bytes'] > args.max_mean_peak_bytes:
+                exceeded.append(f"mean_peak_bytes > {args.max_mean_peak_bytes:.0f}")
+            if results['retained_bytes'] > args.max_retained_bytes:
+                exceeded.append(f"retained_bytes > {args.max_retained_bytes:.0f}")
+        failed |= bool(exceeded)
+        print(f"reuse_step_buffers={reuse_step_buffers!s:>5}: "
+              + ", ".join(f"{name}={value:.0f}" for name, value in results.items())
+              + (f" -> FAILED ({', '.join(exceeded)})" if exceeded else " -> OK" if reuse_step_buffers else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
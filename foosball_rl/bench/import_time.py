@@ -0,0 +1,113 @@
+"""
+Measures the import time of the entry points of the package with ``python -X importtime`` and enforces a budget.
+
+Every scenario is imported in a fresh interpreter, the fastest of ``--repeat`` runs counts. A scenario fails if it
+exceeds its budget (scaled with ``--budget-scale`` for slower machines) or imports one of its forbidden modules, e.g.
+the environments must be usable without importing torch and stable-baselines3. The exit code is 1 if any scenario
+fails, so the benchmark can guard against import time regressions. The test suite enforces the budgets of the
+scenarios without torch, see tests/test_import_time.py.
+
+Usage: python -m foosball_rl.bench.import_time [--scenarios package environments env_worker training] [--repeat N]
+    [--budget-scale F] [--top N]
+"""
+import argparse
+import re
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+_IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+
+@dataclass
+class ImportScenario:
+    code: str
+    budget_ms: float
+    forbidden_modules: Tuple[str, ...] = ()
+
+
+_ENV_FORBIDDEN_MODULES = ('torch', 'stable_baselines3', 'sb3_contrib', 'tensorboard')
+
+SCENARIOS: Dict[str, ImportScenario] = {
+    # The package itself, which only reads the run config
+    'package': ImportScenario("import foosball_rl", budget_ms=250,
+                              forbidden_modules=('gymnasium', 'mujoco', *_ENV_FORBIDDEN_MODULES)),
+    # Registering the environments
+    'environments': ImportScenario("import foosball_rl.environments", budget_ms=1000,
+                                   forbidden_modules=_ENV_FORBIDDEN_MODULES),
+    # Everything needed to create and step the raw environments and the gym wrappers
+    'env_worker': ImportScenario("import gymnasium as gym\n"
+                                 "import foosball_rl.environments\n"
+                                 "import foosball_rl.environments.common.wrappers.custom_wrappers\n"
+                                 "import foosball_rl.environments.common.wrappers.observation_space_wrappers\n"
+                                 "gym.make('Goalkeeper-v0').close()\n"
+                                 "gym.make('Foosball-v0').close()", budget_ms=1500,
+                                 forbidden_modules=_ENV_FORBIDDEN_MODULES),
+    # The training mode, the algorithms are only imported when they are used
+    'training': ImportScenario("import foosball_rl.modes.train", budget_ms=8000, forbidden_modules=('sb3_contrib',)),
+}
+
+
+ModuleImportTime = Tuple[str, int, int, int]
+
+
+def measure_import_time(code: str) -> List[ModuleImportTime]:
+    """
+    Runs ``code`` in a fresh interpreter with ``-X importtime``.
+
+    :return: (module, self microseconds, cumulative microseconds, nesting level) per imported module
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            cwd=Path(__file__).parent.parent.parent)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing failed:\n{result.stderr}")
+    imports = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match is not None:
+            imports.append((match[4], int(match[1]), int(match[2]), len(match[3]) // 2))
+    return imports
+
+
+def check_scenario(scenario: ImportScenario, repeat: int = 3) -> Tuple[float, List[ModuleImportTime], List[str]]:
+    """
+    Measures ``scenario`` ``repeat`` times, the scenario passes if the fastest import time is within its budget and no
+    forbidden module is imported.
+
+    :return: The fastest import time in milliseconds, the imported modules of the fastest run and the imported
+        forbidden modules
+    """
+    runs = [measure_import_time(scenario.code) for _ in range(repeat)]
+    totals_ms = [sum(cumulative for _, _, cumulative, level in imports if level == 0) / 1000 for imports in runs]
+    fastest = runs[totals_ms.index(min(totals_ms))]
+    imported = {module.split('.')[0] for module, _, _, _ in fastest}
+    return min(totals_ms), fastest, sorted(imported.intersection(scenario.forbidden_modules))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--budget-scale', type=float, default=1.)
+    parser.add_argument('--top', type=int, default=5, help="Number of slowest top-level imports to print")
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.scenarios:
+        scenario = SCENARIOS[name]
+        total_ms, fastest, forbidden = check_scenario(scenario, args.repeat)
+        budget_ms = scenario.budget_ms * args.budget_scale
+        passed = total_ms <= budget_ms and not forbidden
+        failed |= not passed
+        print(f"{name}: {total_ms:.0f} ms (budget {budget_ms:.0f} ms), {len(fastest)} modules"
+              f"{', imports forbidden ' + ', '.join(forbidden) if forbidden else ''} -> {'OK' if passed else 'FAILED'}")
+        top_level = sorted((imports for imports in fastest if imports[3] == 0), key=lambda imports: -imports[2])
+        for module, _, cumulative, _ in top_level[:args.top]:
+            print(f"    {cumulative / 1000:8.1f} ms  {module}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
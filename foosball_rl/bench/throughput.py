@@ -0,0 +1,198 @@
+"""
+Environment throughput benchmark, sweeping environments, vec env backends, numbers of environments, step frequencies,
+observation types and wrappers. Every combination is timed separately, combinations that are not supported (e.g.
+image observations with the batched backend) are recorded with their error.
+
+Usage: python -m foosball_rl.bench [--envs Goalkeeper-v0 Foosball-v0] [--backends dummy batched] [--n-envs 1 8]
+                                   [--step-frequencies 16] [--obs features image] [--wrappers none vec_normalize]
+                                   [--steps N] [--json results.json] [--csv results.csv]
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import time
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import gymnasium as gym
+import mujoco
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv, VecNormalize, VecCheckNan, SubprocVecEnv, VecMonitor
+
+import foosball_rl.environments  # noqa: F401, registers the environments
+from foosball_rl.environments.common.batched_vec_env import make_batched_vec_env
+from foosball_rl.environments.common.register_env import make_vec_env
+from foosball_rl.environments.common.shared_memory_vec_env import SharedMemoryVecEnv
+from foosball_rl.environments.common.wrappers.custom_vec_wrappers import VecPBRSWrapper, \
+    VecAddActionToObservationsWrapper, get_vec_action_space_wrapper
+from foosball_rl.environments.common.wrappers.custom_wrappers import GoalEnvWrapper
+from foosball_rl.environments.common.wrappers.observation_space_wrappers import AddActionToObservationsWrapper
+from foosball_rl.wrappers.wrapper_configuration import ENV_WRAPPERS, VEC_ENV_WRAPPERS
+
+ENV_IDS = ('Goalkeeper-v0', 'Foosball-v0')
+BACKENDS = ('dummy', 'subproc', 'shared_memory', 'batched')
+OBSERVATION_TYPES = ('features', 'image')
+
+# Gym wrappers, applied to every sub-environment
+ENV_WRAPPER_FACTORIES: Dict[str, Callable[[gym.Env], gym.Env]] = {
+    'add_action_to_observation': AddActionToObservationsWrapper,
+    'goal_env': GoalEnvWrapper,
+}
+# VecEnv wrappers, applied to the vectorized environment
+VEC_ENV_WRAPPER_FACTORIES: Dict[str, Callable[[VecEnv], VecEnv]] = {
+    'vec_pbrs': VecPBRSWrapper,
+    'vec_normalize': partial(VecNormalize, **VEC_ENV_WRAPPERS['VecNormalizeWrapper']),
+    'vec_check_nan': partial(VecCheckNan, raise_exception=True, warn_once=False),
+    'vec_action_space': partial(get_vec_action_space_wrapper,
+                                action_space_wrapper_conf=ENV_WRAPPERS['ActionSpaceWrapper']),
+}
+WRAPPERS = ('none', *ENV_WRAPPER_FACTORIES, *VEC_ENV_WRAPPER_FACTORIES)
+
+RESULT_FIELDS = ('env_id', 'backend', 'n_envs', 'step_frequency', 'obs', 'wrapper', 'status', 'error',
+                 'make_s', 'reset_ms', 'step_ms', 'env_steps_per_s')
+
+
+def make_benchmark_venv(env_id: str, backend: str, n_envs: int, step_frequency: int, obs: str, wrapper: str,
+                        seed: int = 0) -> VecEnv:
+    """
+    Creates the vectorized environment of one benchmark case, analogously to ``create_envs`` but with a single
+    wrapper instead of the configured ones.
+    """
+    env_kwargs = {
+        'step_frequency': step_frequency,
+        'render_mode': None,
+        'use_image_obs': obs == 'image',
+    }
+    if backend == 'batched':
+        if wrapper in ENV_WRAPPER_FACTORIES and wrapper != 'add_action_to_observation':
+            raise ValueError(f"The {wrapper} wrapper is not supported by the batched backend")
+        venv = VecMonitor(make_batched_vec_env(env_id, n_envs, seed, env_kwargs=env_kwargs))
+        if wrapper == 'add_action_to_observation':
+            venv = VecAddActionToObservationsWrapper(venv)
+    else:
+        vec_env_cls = {'dummy': None, 'subproc': SubprocVecEnv, 'shared_memory': SharedMemoryVecEnv}[backend]
+        venv = make_vec_env(partial(gym.make, env_id), n_envs, seed,
+                            wrapper_class=ENV_WRAPPER_FACTORIES.get(wrapper),
+                            env_kwargs=env_kwargs,
+                            vec_env_cls=vec_env_cls)
+    if wrapper in VEC_ENV_WRAPPER_FACTORIES:
+        venv = VEC_ENV_WRAPPER_FACTORIES[wrapper](venv)
+    return venv
+
+
+def benchmark_case(env_id: str, backend: str, n_envs: int, step_frequency: int, obs: str, wrapper: str,
+                   n_steps: int, n_warmup_steps: int = 20, seed: int = 0) -> Dict[str, Any]:
+    """
+    Times the creation, one ``reset`` and ``n_steps`` vectorized steps of one benchmark case. The actions are sampled
+    before timing, so that sampling is not included in the step time.
+    """
+    result: Dict[str, Any] = dict(env_id=env_id, backend=backend, n_envs=n_envs, step_frequency=step_frequency,
+                                  obs=obs, wrapper=wrapper, status='ok', error='')
+    venv = None
+    try:
+        start = time.perf_counter()
+        venv = make_benchmark_venv(env_id, backend, n_envs, step_frequency, obs, wrapper, seed)
+        result['make_s'] = time.perf_counter() - start
+
+        venv.action_space.seed(seed)
+        actions = [np.stack([venv.action_space.sample() for _ in range(n_envs)]) for _ in range(64)]
+
+        start = time.perf_counter()
+        venv.reset()
+        result['reset_ms'] = (time.perf_counter() - start) * 1e3
+
+        for step in range(n_warmup_steps):
+            venv.step(actions[step % len(actions)])
+        start = time.perf_counter()
+        for step in range(n_steps):
+            venv.step(actions[step % len(actions)])
+        elapsed = time.perf_counter() - start
+        result['step_ms'] = elapsed / n_steps * 1e3
+        result['env_steps_per_s'] = n_steps * n_envs / elapsed
+    except Exception as e:  # NOSONAR, unsupported combinations are part of the results
+        result['status'] = 'error'
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if venv is not None:
+            venv.close()
+    return result
+
+
+def run_benchmarks(env_ids: List[str], backends: List[str], n_envs: List[int], step_frequencies: List[int],
+                   observation_types: List[str], wrappers: List[str], n_steps: int) -> List[Dict[str, Any]]:
+    results = []
+    for case in itertools.product(env_ids, backends, n_envs, step_frequencies, observation_types, wrappers):
+        result = benchmark_case(*case, n_steps=n_steps)
+        print(format_result(result), flush=True)
+        results.append(result)
+    return results
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    case = (f"{result['env_id']:>13} {result['backend']:>13} n_envs={result['n_envs']:<3} "
+            f"step_frequency={result['step_frequency']:<3} {result['obs']:>8} {result['wrapper']:>25}")
+    if result['status'] != 'ok':
+        return f"{case}: {result['error']}"
+    return f"{case}: {result['env_steps_per_s']:10.1f} env steps/s, reset {result['reset_ms']:.2f} ms"
+
+
+def benchmark_metadata() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'mujoco': mujoco.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def write_results(results: List[Dict[str, Any]], metadata: Dict[str, Any],
+                  json_path: Optional[Path] = None, csv_path: Optional[Path] = None) -> None:
+    if json_path is not None:
+        json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(json_path, 'w') as f:
+            json.dump({'metadata': metadata, 'results': results}, f, indent=2)
+    if csv_path is not None:
+        csv_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=('commit', 'timestamp') + RESULT_FIELDS)
+            writer.writeheader()
+            for result in results:
+                writer.writerow({'commit': metadata['commit'], 'timestamp': metadata['timestamp'], **result})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--envs', nargs='+', default=list(ENV_IDS))
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--n-envs', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--step-frequencies', nargs='+', type=int, default=[16])
+    parser.add_argument('--obs', nargs='+', choices=OBSERVATION_TYPES, default=['features'])
+    parser.add_argument('--wrappers', nargs='+', choices=WRAPPERS, default=['none'])
+    parser.add_argument('--steps', type=int, default=500)
+    parser.add_argument('--json', type=Path, default=None, help="Write the results with metadata to this JSON file")
+    parser.add_argument('--csv', type=Path, default=None, help="Write the results to this CSV file")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    metadata = benchmark_metadata()
+    results = run_benchmarks(args.envs, args.backends, args.n_envs, args.step_frequencies, args.obs, args.wrappers,
+                             args.steps)
+    write_results(results, metadata, args.json, args.csv)
+
+
+if __name__ == '__main__':
+    main()
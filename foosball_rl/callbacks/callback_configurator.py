@@ -1,11 +1,15 @@
+import os
+from functools import partial
 from pathlib import Path
 
+import numpy as np
 import yaml
-from stable_baselines3.common.callbacks import EvalCallback, CheckpointCallback, ProgressBarCallback, CallbackList
+from stable_baselines3.common.callbacks import EvalCallback, CheckpointCallback, ProgressBarCallback, CallbackList, \
+    BaseCallback
 
 from foosball_rl.environments.create_env import create_eval_envs
 from foosball_rl.environments.common.custom_callbacks import TensorboardCallback, \
-    SaveVecNormalizeAndRolloutBufferCallback
+    SaveVecNormalizeAndRolloutBufferCallback, AsyncEvalCallback, AsyncCheckpointCallback
 
 callback_config_path = Path(__file__).parent / 'callback_config.yml'
 
@@ -19,7 +23,7 @@ def get_callbacks(venv, seed: int, experiment_path: Path):
     callbacks = []
 
     if CALLBACK_CONFIG['use_tensorboard_callback']:
-        callbacks.append(TensorboardCallback())
+        callbacks.append(TensorboardCallback(**callback_conf['TensorboardCallback']))
 
     if CALLBACK_CONFIG['use_eval_callback']:
         eval_callback = get_eval_callback(experiment_path, seed, venv)
@@ -37,28 +41,59 @@ def get_callbacks(venv, seed: int, experiment_path: Path):
 
 
 def get_eval_callback(experiment_path, seed, venv):
-    eval_callback_config = CALLBACK_CONFIG['EvalCallback']
+    eval_callback_config = callback_conf['EvalCallback']
     eval_path = experiment_path / f'seed-{seed}' / 'eval'
-    eval_callback = EvalCallback(
-        eval_env=create_eval_envs(env_id=venv.unwrapped.envs[0].spec.id,
-                                  n_eval_envs=eval_callback_config['n_eval_envs'],
-                                  seed=eval_callback_config['eval_seed'],
-                                  video_logging_path=eval_path / 'video'),
+    eval_env_fn = partial(create_eval_envs,
+                          env_id=venv.get_attr('spec', indices=0)[0].id,
+                          n_eval_envs=eval_callback_config['n_eval_envs'],
+                          seed=eval_callback_config['eval_seed'],
+                          video_logging_path=eval_path / 'video')
+    eval_callback_kwargs = dict(
         callback_on_new_best=SaveVecNormalizeAndRolloutBufferCallback(save_freq=1, save_path=eval_path / 'best'),
         best_model_save_path=(eval_path / 'best').__str__(),
         n_eval_episodes=eval_callback_config['n_eval_episodes'],
         log_path=(eval_path / 'log').__str__(),
-        eval_freq=eval_callback_config['eval_freq'],
+        eval_freq=int(eval_callback_config['eval_freq']),
         deterministic=eval_callback_config['eval_deterministic'],
     )
-    return eval_callback
+    if eval_callback_config['asynchronous']:
+        return AsyncEvalCallback(eval_env_fn=eval_env_fn, **eval_callback_kwargs)
+    return EvalCallback(eval_env=eval_env_fn(), **eval_callback_kwargs)
 
 
 def get_checkpoint_callback(callbacks, experiment_path, seed):
-    checkpoint_callback_config = CALLBACK_CONFIG['CheckpointCallback']
-    callbacks.append(CheckpointCallback(
+    checkpoint_callback_config = callback_conf['CheckpointCallback']
+    checkpoint_callback_kwargs = dict(
         name_prefix=checkpoint_callback_config['name_prefix'],
         save_freq=int(checkpoint_callback_config['save_freq']),
         save_path=(experiment_path / f'seed-{seed}' / 'checkpoints').__str__(),
         save_replay_buffer=checkpoint_callback_config['save_replay_buffer'],
-        save_vecnormalize=checkpoint_callback_config['save_vecnormalize']))
+        save_vecnormalize=checkpoint_callback_config['save_vecnormalize'])
+    if checkpoint_callback_config['asynchronous']:
+        callbacks.append(AsyncCheckpointCallback(keep_last=checkpoint_callback_config['keep_last'],
+                                                 **checkpoint_callback_kwargs))
+    else:
+        callbacks.append(CheckpointCallback(**checkpoint_callback_kwargs))
+
+
+def restore_callback_progress(callback: BaseCallback, n_calls: int, num_timesteps: int) -> None:
+    """
+    Continues the schedules of the callbacks of a resumed training, which count their calls, and restores the
+    evaluation history up to ``num_timesteps``, so that a new best model is only saved if it beats the evaluations
+    before the interruption.
+    """
+    callbacks = [callback]
+    while callbacks:
+        callback = callbacks.pop()
+        callback.n_calls = n_calls
+        if isinstance(callback, CallbackList):
+            callbacks.extend(callback.callbacks)
+        evaluations_path = f'{getattr(callback, "log_path", None)}.npz'
+        if hasattr(callback, 'evaluations_timesteps') and os.path.isfile(evaluations_path):
+            with np.load(evaluations_path) as evaluations:
+                kept = evaluations['timesteps'] <= num_timesteps
+                callback.evaluations_timesteps = evaluations['timesteps'][kept].tolist()
+                callback.evaluations_results = evaluations['results'][kept].tolist()
+                callback.evaluations_length = evaluations['ep_lengths'][kept].tolist()
+            if callback.evaluations_results:
+                callback.best_mean_reward = max(float(np.mean(results)) for results in callback.evaluations_results)
@@ -0,0 +1,71 @@
+from typing import Optional
+
+import mujoco
+import numpy as np
+from mujoco import rollout
+
+ACTION_REPEAT_MODES = ('loop', 'native', 'rollout')
+STATE_SPEC = mujoco.mjtState.mjSTATE_FULLPHYSICS
+
+
+class ActionRepeatSimulator:
+    """
+    Repeats one control for ``nr_steps`` simulation steps.
+
+    Modes:
+    - ``loop``: One ``mj_step`` call per simulation step from Python (reference implementation).
+    - ``native``: A single ``mj_step(model, data, nr_steps)`` call, the whole horizon runs inside MuJoCo.
+    - ``rollout``: A single ``mujoco.rollout`` call on ``mj_data``, which additionally records the sensor readings
+      of every simulation step of the horizon, for episode definitions that need the readings in between two agent
+      steps.
+
+    All modes leave ``mj_data`` in the same final state.
+
+    :param mj_model: The MuJoCo model
+    :param mj_data: The MuJoCo data that is advanced
+    :param nr_steps: Number of simulation steps per control
+    :param mode: One of ``ACTION_REPEAT_MODES``
+    """
+
+    def __init__(self, mj_model: mujoco.MjModel, mj_data: mujoco.MjData, nr_steps: int, mode: str = 'native'):
+        if mode not in ACTION_REPEAT_MODES:
+            raise ValueError(f"Unknown action repeat mode {mode}, possible values: {ACTION_REPEAT_MODES}")
+        self.mj_model = mj_model
+        self.mj_data = mj_data
+        self.nr_steps = nr_steps
+        self.mode = mode
+        self.sensor_samples: Optional[np.ndarray] = None
+        if self.mode == 'rollout':
+            nstate = mujoco.mj_stateSize(mj_model, STATE_SPEC)
+            self._rollout = rollout.Rollout(nthread=0)
+            self._initial_state = np.zeros((1, nstate))
+            self._initial_warmstart = np.zeros((1, mj_model.nv))
+            self._control = np.zeros((1, nr_steps, mj_model.nu))
+            self._state_samples = np.zeros((1, nr_steps, nstate))
+            self._sensor_samples = np.zeros((1, nr_steps, mj_model.nsensordata))
+            # Updated in place on every step
+            self.sensor_samples = self._sensor_samples[0]
+
+    def step(self, ctrl: np.ndarray) -> None:
+        if self.mode == 'loop':
+            for _ in range(self.nr_steps):
+                self.mj_data.ctrl = ctrl
+                mujoco.mj_step(self.mj_model, self.mj_data)
+        elif self.mode == 'native':
+            self.mj_data.ctrl = ctrl
+            mujoco.mj_step(self.mj_model, self.mj_data, self.nr_steps)
+        else:
+            mujoco.mj_getState(self.mj_model, self.mj_data, self._initial_state[0], STATE_SPEC)
+            self._initial_warmstart[0] = self.mj_data.qacc_warmstart
+            self._control[0] = ctrl
+            # Rolls out in place on mj_data, so it ends in the final state including the solver warmstart
+            self._rollout.rollout([self.mj_model], [self.mj_data], self._initial_state, self._control,
+                                  skip_checks=True,
+                                  nstep=self.nr_steps,
+                                  initial_warmstart=self._initial_warmstart,
+                                  state=self._state_samples,
+                                  sensordata=self._sensor_samples)
+
+    def close(self) -> None:
+        if self.mode == 'rollout':
+            self._rollout.close()
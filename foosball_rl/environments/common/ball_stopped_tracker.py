@@ -0,0 +1,48 @@
+import math
+from typing import Optional
+
+import numpy as np
+
+
+class BallStoppedTracker:
+    """
+    Tracks for how long the ball of each of ``n_envs`` environments has been stopped, measured in simulation time
+    (``mj_data.time``). Episode lengths therefore do not depend on how fast the host runs the simulation.
+
+    The tracker keeps its state across steps and has to be reset at the start of each episode.
+
+    :param n_envs: Number of tracked environments
+    """
+
+    def __init__(self, n_envs: int = 1):
+        self.stopped_since = np.full(n_envs, np.nan)
+
+    def update(self, stopped: np.ndarray, sim_time: np.ndarray) -> np.ndarray:
+        """
+        :param stopped: Boolean array of shape (n_envs,), whether the ball is currently stopped
+        :param sim_time: Current simulation times of shape (n_envs,)
+        :return: Durations in seconds for which the balls have been stopped, 0 for moving balls
+        """
+        sim_time = np.broadcast_to(sim_time, self.stopped_since.shape)
+        started = stopped & np.isnan(self.stopped_since)
+        self.stopped_since[started] = sim_time[started]
+        self.stopped_since[~stopped] = np.nan
+        return np.where(stopped, sim_time - self.stopped_since, 0.0)
+
+    def update_env(self, env_idx: int, stopped: bool, sim_time: float) -> float:
+        """Scalar form of ``update`` for a single environment."""
+        if not stopped:
+            self.stopped_since[env_idx] = np.nan
+            return 0.0
+        if math.isnan(self.stopped_since[env_idx]):
+            self.stopped_since[env_idx] = sim_time
+        return sim_time - self.stopped_since[env_idx]
+
+    def reset(self, env_mask: Optional[np.ndarray] = None) -> None:
+        """
+        :param env_mask: Boolean array of shape (n_envs,) selecting the environments to reset, all if None
+        """
+        if env_mask is None:
+            self.stopped_since[:] = np.nan
+        else:
+            self.stopped_since[env_mask] = np.nan
@@ -1,11 +1,24 @@
+from typing import NamedTuple, Optional, Union
+
 import numpy as np
 from gymnasium.utils import seeding
 
+from foosball_rl.environments.common.constraints import batch_goals_conceded
+
+
+class BatchStepOutcome(NamedTuple):
+    black_conceded: np.ndarray
+    white_conceded: np.ndarray
+    rewards: np.ndarray
+    terminated: np.ndarray
+    truncated: np.ndarray
+
 
 class EpisodeDefinition:
 
     def __init__(self):
         self.mj_data = None
+        self.sensor_samples = None
         self._np_random = None
 
     def initialize_episode(self):
@@ -17,9 +30,65 @@ class EpisodeDefinition:
     def is_terminated(self) -> bool:
         raise NotImplementedError
 
-    def seed(self, seed=None) -> None:
+    def batch_is_truncated(self, ball_pos: np.ndarray, ball_vel: np.ndarray, sim_time: np.ndarray) -> np.ndarray:
+        """
+        Vectorized form of ``is_truncated`` over a batch of environments sharing this episode definition.
+
+        :param ball_pos: Ball positions of shape (n_envs, 3)
+        :param ball_vel: Ball velocities of shape (n_envs, 3)
+        :param sim_time: Simulation times (``mj_data.time``) of shape (n_envs,)
+        :return: Boolean array of shape (n_envs,)
+        """
+        raise NotImplementedError
+
+    def batch_step_outcome(self,
+                           ball_pos: np.ndarray,
+                           ball_vel: np.ndarray,
+                           goal_sensors: np.ndarray,
+                           sim_time: np.ndarray) -> BatchStepOutcome:
+        """
+        Combined kernel computing goals, rewards, terminations and truncations of a batch of environments in one call.
+
+        :param ball_pos: Ball positions of shape (n_envs, 3)
+        :param ball_vel: Ball velocities of shape (n_envs, 3)
+        :param goal_sensors: Readings of the black and white goal sensors of shape (n_envs, 2)
+        :param sim_time: Simulation times (``mj_data.time``) of shape (n_envs,)
+        """
+        black_conceded, white_conceded = batch_goals_conceded(ball_pos, goal_sensors)
+        rewards = white_conceded.astype(np.float32) - black_conceded.astype(np.float32)
+        return BatchStepOutcome(black_conceded=black_conceded,
+                                white_conceded=white_conceded,
+                                rewards=rewards,
+                                terminated=self.batch_is_terminated(black_conceded, white_conceded),
+                                truncated=self.batch_is_truncated(ball_pos, ball_vel, sim_time))
+
+    def batch_reset(self, env_mask: np.ndarray) -> None:
+        """
+        Resets the per-environment state kept by the batch methods, called for environments starting a new episode.
+
+        :param env_mask: Boolean array of shape (n_envs,) selecting the environments to reset
+        """
+        pass
+
+    def batch_is_terminated(self, black_conceded: np.ndarray, white_conceded: np.ndarray) -> np.ndarray:
+        """
+        Vectorized form of ``is_terminated`` over a batch of environments sharing this episode definition.
+
+        :param black_conceded: Boolean array of shape (n_envs,), whether the black team conceded a goal
+        :param white_conceded: Boolean array of shape (n_envs,), whether the white team conceded a goal
+        :return: Boolean array of shape (n_envs,)
+        """
+        raise NotImplementedError
+
+    def seed(self, seed: Optional[Union[int, np.random.SeedSequence]] = None) -> None:
+        """
+        Seeds the random number generator of the episode definition.
+
+        :param seed: An integer seed or a ``SeedSequence``, e.g. spawned from the seed sequence of the environment
+        """
         if seed is not None:
-            self._np_random, _ = seeding.np_random(seed)
+            seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+            self._np_random = np.random.Generator(np.random.PCG64(seed_sequence))
 
     @property
     def np_random(self) -> np.random.Generator:
@@ -31,6 +100,19 @@ class EpisodeDefinition:
     def np_random(self, value: np.random.Generator):
         self._np_random = value
 
+    @property
+    def sensor_samples(self) -> Optional[np.ndarray]:
+        """
+        The sensor readings of every simulation step of the last control horizon, of shape (nr_steps, nsensordata), if
+        the environment records them (``action_repeat_mode: rollout``), otherwise None. The goal rewards and
+        terminations only read the final state of the horizon, like in the other modes.
+        """
+        return self._sensor_samples
+
+    @sensor_samples.setter
+    def sensor_samples(self, sensor_samples):
+        self._sensor_samples = sensor_samples
+
     @property
     def mj_data(self):
         return self._mj_data
@@ -38,3 +120,8 @@ class EpisodeDefinition:
     @mj_data.setter
     def mj_data(self, mj_data):
         self._mj_data = mj_data
+        # Views into mj_data, cached so that the per-step checks do not create new arrays
+        self.ball_pos = mj_data.qpos[0:3] if mj_data is not None else None
+        self.ball_vel = mj_data.qvel[0:3] if mj_data is not None else None
+        self.ball_planar_vel = mj_data.qvel[0:2] if mj_data is not None else None
+        self.sensordata = mj_data.sensordata if mj_data is not None else None
@@ -0,0 +1,207 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from typing import Any, Dict, List, Optional, Sequence, Type
+
+import gymnasium as gym
+import mujoco
+import numpy as np
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import VecEnvIndices, VecEnvObs, VecEnvStepReturn
+
+from foosball_rl.environments.common.perf_counters import PERF_COUNTERS
+
+logger = logging.getLogger(__name__)
+
+
+class MujocoBatchedVecEnv(VecEnv):
+    """
+    Vectorized environment that steps all environments over one shared ``MjModel``.
+
+    Every environment owns one ``MjData``. A step advances the whole control horizon (``step_frequency`` simulation
+    steps) of all environments at once: the environments are split into contiguous chunks, one per worker thread,
+    and each chunk is stepped with ``mujoco.mj_step``, which releases the GIL. The ball state and sensor readings
+    are gathered into ``(n_envs, ...)`` arrays, on which observations and auto-resets are computed in bulk. Goals,
+    rewards, terminations and truncations come from the ``batch_step_outcome`` kernel of the episode definition.
+
+    The per-environment ``RawEnv`` instances hold the ``MjData``, the episode definitions used for resets, and the
+    renderers, which are created on the first render. They are available in ``envs`` for compatibility with ``DummyVecEnv``.
+
+    Only feature-vector observations are supported, gym wrappers are not applied to the inner environments.
+
+    :param env_id: The registered environment id, e.g. ``Goalkeeper-v0``
+    :param n_envs: Number of environments
+    :param n_threads: Number of worker threads, defaults to the number of available cores
+    :param env_kwargs: Optional keyword arguments passed to ``gym.make``
+    """
+
+    def __init__(self,
+                 env_id: str,
+                 n_envs: int,
+                 n_threads: Optional[int] = None,
+                 env_kwargs: Optional[Dict[str, Any]] = None):
+        env_kwargs = env_kwargs or {}
+        first_env = gym.make(env_id, **env_kwargs).unwrapped
+        self.mj_model: mujoco.MjModel = first_env.mj_model
+        self.envs = [first_env] + [gym.make(env_id, mj_model=self.mj_model, **env_kwargs).unwrapped
+                                   for _ in range(n_envs - 1)]
+        if first_env.use_image_obs:
+            raise ValueError("MujocoBatchedVecEnv only supports feature-vector observations")
+        if first_env.render_mode == "human":
+            raise ValueError("MujocoBatchedVecEnv does not support render_mode='human'")
+        super().__init__(n_envs, first_env.observation_space, first_env.action_space)
+        self.metadata = first_env.metadata
+
+        self.horizon = gym.spec(env_id).max_episode_steps
+        self.nr_intermediate_steps = first_env.nr_intermediate_steps * first_env.nr_substeps
+        n_threads = n_threads if n_threads is not None else os.cpu_count()
+        self.n_threads = max(1, min(n_threads, n_envs))
+        self._pool = ThreadPoolExecutor(max_workers=self.n_threads) if self.n_threads > 1 else None
+        self._chunks = [chunk for chunk in np.array_split(np.arange(n_envs), self.n_threads) if len(chunk) > 0]
+
+        nq, nv, nu = self.mj_model.nq, self.mj_model.nv, self.mj_model.nu
+        self._qpos = np.zeros((n_envs, nq))
+        self._qvel = np.zeros((n_envs, nv))
+        self._sensordata = np.zeros((n_envs, self.mj_model.nsensordata))
+        self._time = np.zeros(n_envs)
+        self._control = np.zeros((n_envs, nu))
+
+        self._episode_steps = np.zeros(n_envs, dtype=np.int64)
+        self._obs_qpos_indices = first_env.observation_qpos_indices
+        self._obs_sensor_indices = first_env.observation_sensor_indices
+        self._n_obs_qpos = len(range(nq)[self._obs_qpos_indices])
+        self._obs = np.zeros((n_envs, *self.observation_space.shape), dtype=self.observation_space.dtype)
+        # All envs are built from the same episode definition factory, the first one provides the batch methods
+        self.episode_definition = first_env.episode_definition
+
+        logger.info("Created MujocoBatchedVecEnv with %s %s envs on %s threads", n_envs, env_id, self.n_threads)
+
+    def reset(self) -> VecEnvObs:
+        for env_idx in range(self.num_envs):
+            maybe_options = {"options": self._options[env_idx]} if self._options[env_idx] else {}
+            _, self.reset_infos[env_idx] = self.envs[env_idx].reset(seed=self._seeds[env_idx], **maybe_options)
+            self._load_state(env_idx)
+        self._reset_seeds()
+        self._reset_options()
+        self._episode_steps[:] = 0
+        self.episode_definition.batch_reset(np.ones(self.num_envs, dtype=bool))
+        return self._observations().copy()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._control[:] = np.asarray(actions).reshape(self.num_envs, -1)
+
+    def step_wait(self) -> VecEnvStepReturn:
+        perf_start = PERF_COUNTERS.start()
+        if self._pool is None:
+            self._step_chunk(self._chunks[0])
+        else:
+            for future in [self._pool.submit(self._step_chunk, chunk) for chunk in self._chunks]:
+                future.result()
+        self._episode_steps += 1
+        PERF_COUNTERS.stop('env/physics', perf_start)
+
+        perf_start = PERF_COUNTERS.start()
+        obs = self._observations().copy()
+        PERF_COUNTERS.stop('env/observation', perf_start)
+
+        perf_start = PERF_COUNTERS.start()
+        outcome = self.episode_definition.batch_step_outcome(self._qpos[:, 0:3], self._qvel[:, 0:3],
+                                                             self._sensordata[:, 0:2], self._time)
+        black_conceded, white_conceded, rewards, terminated, truncated = outcome
+        if self.horizon is not None:
+            truncated |= self._episode_steps >= self.horizon
+        dones = terminated | truncated
+        PERF_COUNTERS.stop('env/reward_and_termination', perf_start)
+
+        infos: List[Dict[str, Any]] = [{
+            "black_conceded": bool(black_conceded[env_idx]),
+            "white_conceded": bool(white_conceded[env_idx]),
+            "TimeLimit.truncated": bool(truncated[env_idx] and not terminated[env_idx]),
+        } for env_idx in range(self.num_envs)]
+
+        for env_idx in np.flatnonzero(dones):
+            infos[env_idx]["terminal_observation"] = obs[env_idx].copy()
+            _, self.reset_infos[env_idx] = self.envs[env_idx].reset()
+            self._load_state(env_idx)
+            self._episode_steps[env_idx] = 0
+        if dones.any():
+            obs[dones] = self._observations()[dones]
+            self.episode_definition.batch_reset(dones)
+
+        return obs, rewards, dones, infos
+
+    def _step_chunk(self, env_indices: np.ndarray) -> None:
+        # mj_step releases the GIL, so the chunks are simulated in parallel
+        for env_idx in env_indices:
+            mj_data = self.envs[env_idx].mj_data
+            mj_data.ctrl[:] = self._control[env_idx]
+            mujoco.mj_step(self.mj_model, mj_data, self.nr_intermediate_steps)
+            self._load_state(env_idx)
+
+    def _load_state(self, env_idx: int) -> None:
+        mj_data = self.envs[env_idx].mj_data
+        self._qpos[env_idx] = mj_data.qpos
+        self._qvel[env_idx] = mj_data.qvel
+        self._sensordata[env_idx] = mj_data.sensordata
+        self._time[env_idx] = mj_data.time
+
+    def _observations(self) -> np.ndarray:
+        self._obs[:, :self._n_obs_qpos] = self._qpos[:, self._obs_qpos_indices]
+        self._obs[:, self._n_obs_qpos:] = self._sensordata[:, self._obs_sensor_indices]
+        return self._obs
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+        for env in self.envs:
+            env.close()
+
+    def get_images(self) -> Sequence[Optional[np.ndarray]]:
+        if self.render_mode != "rgb_array":
+            logger.warning("The render mode is %s, but this method assumes it is `rgb_array` to obtain images.",
+                           self.render_mode)
+            return [None for _ in self.envs]
+        return [env.render() for env in self.envs]
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        target_envs = self._get_target_envs(indices)
+        return [getattr(env_i, attr_name) for env_i in target_envs]
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        target_envs = self._get_target_envs(indices)
+        for env_i in target_envs:
+            setattr(env_i, attr_name, value)
+
+    def env_method(self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs) -> List[Any]:
+        target_envs = self._get_target_envs(indices)
+        return [getattr(env_i, method_name)(*method_args, **method_kwargs) for env_i in target_envs]
+
+    def env_is_wrapped(self, wrapper_class: Type[gym.Wrapper], indices: VecEnvIndices = None) -> List[bool]:
+        return [False for _ in self._get_indices(indices)]
+
+    def _get_target_envs(self, indices: VecEnvIndices) -> List[gym.Env]:
+        return [self.envs[i] for i in self._get_indices(indices)]
+
+
+def make_batched_vec_env(env_id: str,
+                         n_envs: int = 1,
+                         seed: Optional[int] = None,
+                         n_threads: Optional[int] = None,
+                         env_kwargs: Optional[Dict[str, Any]] = None) -> MujocoBatchedVecEnv:
+    """
+    Create a ``MujocoBatchedVecEnv``, analogously to ``make_vec_env``.
+
+    :param env_id: The registered environment id
+    :param n_envs: Number of environments stepped in one batch
+    :param seed: The initial seed for the random number generators
+    :param n_threads: Number of worker threads
+    :param env_kwargs: Optional keyword arguments passed to ``gym.make``
+    :return: The batched environment
+    """
+    vec_env = MujocoBatchedVecEnv(env_id, n_envs=n_envs, n_threads=n_threads, env_kwargs=deepcopy(env_kwargs))
+    for env_idx, env in enumerate(vec_env.envs):
+        if seed is not None:
+            env.action_space.seed(seed + env_idx)
+    vec_env.seed(seed)
+    return vec_env
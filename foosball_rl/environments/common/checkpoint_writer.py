@@ -0,0 +1,273 @@
+"""
+Checkpoints written from a background thread, see the ``AsyncCheckpointCallback``.
+
+A checkpoint is snapshot in memory in the training thread (the serialized model, the pickled ``VecNormalize`` and the
+replay buffer) and written by a single background thread, so the training only waits for the serialization and not
+for the disk. The files are named like the ones of SB3's ``CheckpointCallback``:
+
+- ``<prefix>_<steps>_steps.zip``: the model, loadable with ``<Algorithm>.load``
+- ``<prefix>_vecnormalize_<steps>_steps.pkl``: the ``VecNormalize`` statistics, loadable with ``VecNormalize.load``
+- ``<prefix>_replay_buffer_<steps>_steps.pkl``: the replay buffer, loadable with ``model.load_replay_buffer``
+- ``<prefix>_training_state_<steps>_steps.pkl``: the random number generator states, see ``training_state.py``
+
+The transitions of a plain ``ReplayBuffer`` or ``DictReplayBuffer`` are written incrementally: every checkpoint only
+writes the rows added since the previous one to a segment file in ``replay_buffer_segments``, the ``.pkl`` file holds
+the remaining state of the buffer and the segments it is restored from. Buffers that define their own pickling (e.g.
+``HerReplayBuffer``, whose episode bookkeeping also changes old rows, or ``MemmapReplayBuffer``) are pickled as a
+whole.
+
+The manifest ``<prefix>_checkpoints.json`` lists the complete checkpoints, oldest first, with their files by kind
+(``model``, ``vecnormalize``, ``replay_buffer``, ``training_state``). A checkpoint is added once
+all its files are written, so a checkpoint interrupted by a crash is never listed. Only the latest ``keep_last``
+checkpoints are kept, the files of older ones (and the segments no kept checkpoint refers to) are deleted.
+"""
+import io
+import json
+import logging
+import os
+import pickle
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+from stable_baselines3.common.base_class import BaseAlgorithm
+from stable_baselines3.common.buffers import DictReplayBuffer, ReplayBuffer
+from stable_baselines3.common.vec_env import VecNormalize
+
+logger = logging.getLogger(__name__)
+
+SEGMENTS_DIR = 'replay_buffer_segments'
+
+# name -> (shape, dtype), dict observations are flattened to '<attribute>/<key>'
+ArrayLayout = Dict[str, Tuple[Tuple[int, ...], str]]
+
+
+@dataclass
+class _ReplayBufferChain:
+    """The segments the replay buffer of the last checkpoint is restored from."""
+    timesteps: int
+    pos: int
+    layout: ArrayLayout
+    # (file name, number of rows), oldest first
+    segments: List[Tuple[str, int]] = field(default_factory=list)
+
+    def append(self, segment_name: str, n_rows: int, buffer_size: int) -> None:
+        self.segments.append((segment_name, n_rows))
+        # Segments whose rows have all been overwritten by the later segments are not needed anymore
+        while sum(rows for _, rows in self.segments[1:]) >= buffer_size:
+            self.segments.pop(0)
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints of a model from a background thread and prunes old checkpoints.
+
+    At most one checkpoint is written at a time: ``save`` waits for the previous checkpoint if it is still being
+    written, which bounds the memory of the snapshots and surfaces errors of the background thread.
+
+    :param save_path: The directory of the checkpoints
+    :param name_prefix: The common prefix of the checkpoint files
+    :param keep_last: The number of checkpoints to keep, ``None`` keeps all
+    :param verbose: Verbosity level
+    """
+
+    def __init__(self, save_path: Path, name_prefix: str = 'rl_model', keep_last: Optional[int] = None,
+                 verbose: int = 0):
+        self.save_path = Path(save_path)
+        self.name_prefix = name_prefix
+        self.keep_last = keep_last
+        self.verbose = verbose
+        (self.save_path / SEGMENTS_DIR).mkdir(parents=True, exist_ok=True)
+        self.manifest_path = get_manifest_path(self.save_path, name_prefix)
+        self.checkpoints: List[Dict[str, Any]] = load_manifest(self.manifest_path)
+        self._replay_buffer_chain: Optional[_ReplayBufferChain] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='CheckpointWriter')
+        self._write: Optional[Future] = None
+
+    def save(self, model: BaseAlgorithm, timesteps: int, vec_normalize: Optional[VecNormalize] = None,
+             save_replay_buffer: bool = False, training_state: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Snapshots the model, ``vec_normalize``, the replay buffer and the ``training_state`` and writes them in the
+        background.
+        """
+        self.wait()
+        model_file = io.BytesIO()
+        model.save(model_file)
+        # kind -> (file name, content)
+        files = {'model': (self._file_name(timesteps, suffix='zip'), model_file.getvalue())}
+        if vec_normalize is not None:
+            files['vecnormalize'] = (self._file_name(timesteps, 'vecnormalize'), pickle.dumps(vec_normalize))
+        segment = None
+        replay_buffer = getattr(model, 'replay_buffer', None)
+        if save_replay_buffer and replay_buffer is not None:
+            replay_buffer_bytes, segment = self._snapshot_replay_buffer(replay_buffer, timesteps)
+            files['replay_buffer'] = (self._file_name(timesteps, 'replay_buffer'), replay_buffer_bytes)
+        if training_state is not None:
+            files['training_state'] = (self._file_name(timesteps, 'training_state'), pickle.dumps(training_state))
+        segments = [name for name, _ in self._replay_buffer_chain.segments] if segment is not None else []
+        self._write = self._executor.submit(self._write_checkpoint, timesteps, files, segment, segments)
+
+    def wait(self) -> None:
+        """Waits until the current checkpoint is written and raises the error of the write, if any."""
+        if self._write is not None:
+            write, self._write = self._write, None
+            write.result()
+
+    def close(self) -> None:
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def _file_name(self, timesteps: int, name: Optional[str] = None, suffix: str = 'pkl') -> str:
+        infix = f'_{name}' if name is not None else ''
+        return f'{self.name_prefix}{infix}_{timesteps}_steps.{suffix}'
+
+    def _snapshot_replay_buffer(self, replay_buffer: ReplayBuffer,
+                                timesteps: int) -> Tuple[bytes, Optional[Tuple[str, int, Dict[str, np.ndarray]]]]:
+        if not _supports_incremental_save(replay_buffer):
+            return pickle.dumps(replay_buffer, protocol=pickle.HIGHEST_PROTOCOL), None
+
+        arrays = _buffer_arrays(replay_buffer)
+        layout = {name: (array.shape, array.dtype.str) for name, array in arrays.items()}
+        chain = self._replay_buffer_chain
+        size = replay_buffer.buffer_size
+        if (chain is None or chain.layout != layout
+                or (timesteps - chain.timesteps) // replay_buffer.n_envs >= size):
+            # Everything written before may be overwritten, the chain starts again with all rows of the buffer
+            chain = self._replay_buffer_chain = _ReplayBufferChain(timesteps=timesteps, pos=0, layout=layout)
+            n_rows = size if replay_buffer.full else replay_buffer.pos
+        else:
+            n_rows = (replay_buffer.pos - chain.pos) % size
+        start = chain.pos
+        # Fancy indexing copies the rows, the training can go on writing to the buffer
+        rows = (start + np.arange(n_rows)) % size
+        segment_name = self._file_name(timesteps, suffix='npz')
+        segment = (segment_name, start, {name: array[rows] for name, array in arrays.items()})
+        chain.timesteps, chain.pos = timesteps, replay_buffer.pos
+        chain.append(segment_name, n_rows, size)
+
+        state = vars(replay_buffer).copy()
+        for name in {name.split('/')[0] for name in arrays}:
+            del state[name]
+        segment_paths = [str(self.save_path / SEGMENTS_DIR / name) for name, _ in chain.segments]
+        return pickle.dumps(_ReplayBufferCheckpoint(type(replay_buffer), state, layout, segment_paths)), segment
+
+    def _write_checkpoint(self, timesteps: int, files: Dict[str, Tuple[str, bytes]],
+                          segment: Optional[Tuple[str, int, Dict[str, np.ndarray]]], segments: List[str]) -> None:
+        if segment is not None:
+            segment_name, start, rows = segment
+            segment_path = self.save_path / SEGMENTS_DIR / segment_name
+            with open(segment_path.with_name(segment_name + '.tmp'), 'wb') as f:
+                np.savez(f, start=start, **{_escape(name): array for name, array in rows.items()})
+            os.replace(segment_path.with_name(segment_name + '.tmp'), segment_path)
+        for file_name, data in files.values():
+            _write_atomic(self.save_path / file_name, data)
+        self.checkpoints.append({'timesteps': timesteps,
+                                 'files': {kind: file_name for kind, (file_name, _) in files.items()},
+                                 'segments': segments})
+        self._prune()
+        _write_atomic(self.manifest_path, json.dumps({'checkpoints': self.checkpoints}, indent=2).encode())
+        if self.verbose >= 1:
+            logger.info("Saved checkpoint of %s timesteps to %s", timesteps, self.save_path)
+
+    def _prune(self) -> None:
+        if self.keep_last is None or len(self.checkpoints) <= self.keep_last:
+            return
+        removed, self.checkpoints = self.checkpoints[:-self.keep_last], self.checkpoints[-self.keep_last:]
+        kept_segments = {segment for checkpoint in self.checkpoints for segment in checkpoint['segments']}
+        for checkpoint in removed:
+            for file_name in checkpoint['files'].values():
+                (self.save_path / file_name).unlink(missing_ok=True)
+            for segment in set(checkpoint['segments']) - kept_segments:
+                (self.save_path / SEGMENTS_DIR / segment).unlink(missing_ok=True)
+
+
+class _ReplayBufferCheckpoint:
+    """Pickled in place of an incrementally saved replay buffer, unpickling it restores the buffer."""
+
+    def __init__(self, buffer_class: Type[ReplayBuffer], state: Dict[str, Any], layout: ArrayLayout,
+                 segment_paths: List[str]):
+        self.buffer_class = buffer_class
+        self.state = state
+        self.layout = layout
+        self.segment_paths = segment_paths
+
+    def __reduce__(self):
+        return _restore_replay_buffer, (self.buffer_class, self.state, self.layout, self.segment_paths)
+
+
+def _restore_replay_buffer(buffer_class: Type[ReplayBuffer], state: Dict[str, Any], layout: ArrayLayout,
+                           segment_paths: List[str]) -> ReplayBuffer:
+    replay_buffer = buffer_class.__new__(buffer_class)
+    replay_buffer.__dict__.update(state)
+    arrays = {name: np.zeros(shape, dtype=dtype) for name, (shape, dtype) in layout.items()}
+    for segment_path in segment_paths:
+        with np.load(segment_path) as segment:
+            start = int(segment['start'])
+            for name, array in arrays.items():
+                rows = segment[_escape(name)]
+                array[(start + np.arange(len(rows))) % len(array)] = rows
+    for name, array in arrays.items():
+        attribute, _, key = name.partition('/')
+        if key:
+            replay_buffer.__dict__.setdefault(attribute, {})[key] = array
+        else:
+            setattr(replay_buffer, attribute, array)
+    return replay_buffer
+
+
+def get_manifest_path(save_path: Path, name_prefix: str) -> Path:
+    return Path(save_path) / f'{name_prefix}_checkpoints.json'
+
+
+def find_latest_checkpoint(save_path: Path, name_prefix: str) -> Optional[Tuple[int, Dict[str, Path]]]:
+    """
+    :return: The timesteps and the paths of the files by kind of the latest complete checkpoint in ``save_path``,
+        ``None`` if there is none
+    """
+    checkpoints = load_manifest(get_manifest_path(save_path, name_prefix))
+    if not checkpoints:
+        return None
+    checkpoint = checkpoints[-1]
+    return checkpoint['timesteps'], {kind: Path(save_path) / file_name for kind, file_name in checkpoint['files'].items()}
+
+
+def load_manifest(manifest_path: Path) -> List[Dict[str, Any]]:
+    """Returns the complete checkpoints listed in the manifest, oldest first."""
+    if not manifest_path.is_file():
+        return []
+    with open(manifest_path) as f:
+        return json.load(f)['checkpoints']
+
+
+def _supports_incremental_save(replay_buffer: ReplayBuffer) -> bool:
+    # Buffers with their own pickling keep state outside of the rows written since the last checkpoint
+    return (isinstance(replay_buffer, (ReplayBuffer, DictReplayBuffer))
+            and not any('__getstate__' in vars(cls) for cls in type(replay_buffer).__mro__[:-1]))
+
+
+def _buffer_arrays(replay_buffer: ReplayBuffer) -> Dict[str, np.ndarray]:
+    """The arrays of the buffer with one row per buffer position, dict observations flattened."""
+    arrays = {}
+    for attribute, value in vars(replay_buffer).items():
+        if isinstance(value, dict):
+            arrays.update({f'{attribute}/{key}': array for key, array in value.items()
+                           if isinstance(array, np.ndarray) and array.shape[:1] == (replay_buffer.buffer_size,)})
+        elif isinstance(value, np.ndarray) and value.shape[:1] == (replay_buffer.buffer_size,):
+            arrays[attribute] = value
+    return arrays
+
+
+def _escape(name: str) -> str:
+    # np.savez keys become file names inside the archive
+    return name.replace('/', '__')
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -6,7 +6,11 @@ from foosball_rl.environments.common.constants import BALL_VELOCITY_THRESHOLD, M
 
 
 def ball_stopped(ball_velocities, threshold=BALL_VELOCITY_THRESHOLD) -> bool:
-    return np.linalg.norm(ball_velocities, np.inf) < threshold
+    # Infinity norm, without the temporary arrays of np.linalg.norm or an iterator over the numpy array
+    for axis in range(len(ball_velocities)):
+        if abs(ball_velocities[axis]) >= threshold:
+            return False
+    return True
 
 
 def ball_outside_player_space(ball_data, player: str) -> bool:
@@ -17,12 +21,13 @@ def ball_outside_player_space(ball_data, player: str) -> bool:
 
 
 def ball_outside_table(ball_data) -> bool:
-    return np.abs(ball_data[0]) > ABS_MAX_TABLE_X or np.abs(ball_data[1]) > ABS_MAX_TABLE_Y
+    # Builtin abs, np.abs dispatches a ufunc for every scalar
+    return abs(ball_data[0]) > ABS_MAX_TABLE_X or abs(ball_data[1]) > ABS_MAX_TABLE_Y
 
 
 def ball_in_goal_bounds(ball_pos) -> bool:
     # Ball in y- and z- bounds of any goal
-    return np.abs(ball_pos[1]) < ABS_MAX_GOAL_Y_SYMMETRIC_BOUND and MAX_GOAL_Z_BOUNDS[0] < ball_pos[2] < MAX_GOAL_Z_BOUNDS[1]
+    return abs(ball_pos[1]) < ABS_MAX_GOAL_Y_SYMMETRIC_BOUND and MAX_GOAL_Z_BOUNDS[0] < ball_pos[2] < MAX_GOAL_Z_BOUNDS[1]
 
 
 def ball_in_black_goal_bounds(ball_pos) -> bool:
@@ -31,3 +36,48 @@ def ball_in_black_goal_bounds(ball_pos) -> bool:
 
 def ball_in_white_goal_bounds(ball_pos) -> bool:
     return WHITE_GOAL_X_BOUNDS[0] < ball_pos[0] < WHITE_GOAL_X_BOUNDS[1] and ball_in_goal_bounds(ball_pos)
+
+
+# Vectorized forms of the constraints above over batches of ball states of shape (n_envs, 2) or (n_envs, 3),
+# returning boolean arrays of shape (n_envs,)
+
+def batch_ball_stopped(ball_velocities: np.ndarray, threshold=BALL_VELOCITY_THRESHOLD) -> np.ndarray:
+    return np.max(np.abs(ball_velocities[:, 0:2]), axis=1) < threshold
+
+
+def batch_ball_outside_player_space(ball_data: np.ndarray, player: str) -> np.ndarray:
+    player_x, player_y_reach = PLAYERS_POSITIONS[player]
+    in_x_reach = ((player_x - FIGURE_X_REACH_INCREMENT < ball_data[:, 0]) &
+                  (ball_data[:, 0] < player_x + FIGURE_X_REACH_INCREMENT))
+    in_y_reach = (-player_y_reach < ball_data[:, 1]) & (ball_data[:, 1] < player_y_reach)
+    return ~(in_x_reach & in_y_reach)
+
+
+def batch_ball_outside_table(ball_data: np.ndarray) -> np.ndarray:
+    return (np.abs(ball_data[:, 0]) > ABS_MAX_TABLE_X) | (np.abs(ball_data[:, 1]) > ABS_MAX_TABLE_Y)
+
+
+def batch_ball_in_goal_bounds(ball_pos: np.ndarray) -> np.ndarray:
+    return ((np.abs(ball_pos[:, 1]) < ABS_MAX_GOAL_Y_SYMMETRIC_BOUND) &
+            (MAX_GOAL_Z_BOUNDS[0] < ball_pos[:, 2]) & (ball_pos[:, 2] < MAX_GOAL_Z_BOUNDS[1]))
+
+
+def batch_ball_in_black_goal_bounds(ball_pos: np.ndarray) -> np.ndarray:
+    return ((BLACK_GOAL_X_BOUNDS[1] < ball_pos[:, 0]) & (ball_pos[:, 0] < BLACK_GOAL_X_BOUNDS[0]) &
+            batch_ball_in_goal_bounds(ball_pos))
+
+
+def batch_ball_in_white_goal_bounds(ball_pos: np.ndarray) -> np.ndarray:
+    return ((WHITE_GOAL_X_BOUNDS[0] < ball_pos[:, 0]) & (ball_pos[:, 0] < WHITE_GOAL_X_BOUNDS[1]) &
+            batch_ball_in_goal_bounds(ball_pos))
+
+
+def batch_goals_conceded(ball_pos: np.ndarray, goal_sensors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param ball_pos: Ball positions of shape (n_envs, 3)
+    :param goal_sensors: Readings of the black and white goal sensors of shape (n_envs, 2)
+    :return: Whether the black and the white team conceded a goal, each of shape (n_envs,)
+    """
+    black_conceded = (goal_sensors[:, 0] > 0) | batch_ball_in_black_goal_bounds(ball_pos)
+    white_conceded = (goal_sensors[:, 1] > 0) | batch_ball_in_white_goal_bounds(ball_pos)
+    return black_conceded, white_conceded
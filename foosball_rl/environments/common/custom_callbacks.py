@@ -1,18 +1,81 @@
+import copy
+import logging
 import os
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional
+from time import perf_counter_ns
+from typing import Optional, Callable, Dict, Any, Tuple, List, Iterator
 
-from stable_baselines3.common.callbacks import BaseCallback
+import numpy as np
+import torch as th
+from stable_baselines3.common.callbacks import BaseCallback, EventCallback
+from stable_baselines3.common.evaluation import evaluate_policy
+from stable_baselines3.common.policies import BasePolicy
+from stable_baselines3.common.vec_env import VecEnv, unwrap_vec_normalize
+
+from foosball_rl.environments.common.checkpoint_writer import CheckpointWriter
+from foosball_rl.environments.common.perf_counters import PERF_COUNTERS_ENABLED, collect_perf_counters
+from foosball_rl.environments.common.training_state import capture_training_state
+from foosball_rl.environments.common.worker_context import get_worker_context
+
+logger = logging.getLogger(__name__)
 
 
 class TensorboardCallback(BaseCallback):
     """
     Custom callback for plotting additional values in tensorboard.
     Based on https://stable-baselines3.readthedocs.io/en/v2.3.2/guide/tensorboard.html#logging-more-values
+
+    The perf counters (see ``perf_counters.py``) are recorded every ``perf_record_interval_s`` seconds, at the end of
+    a rollout, as ``perf/<phase>_us`` (mean microseconds per call) and ``perf/<phase>_share`` (share of the wall-clock
+    time since the previous record). Policy inference is the rollout time not spent in the environment step,
+    gradient updates are the time between the end of a rollout and the start of the next one.
     """
 
-    def __init__(self, verbose=0):
+    def __init__(self, verbose=0, perf_record_interval_s: float = 10.0):
         super().__init__(verbose)
+        self.perf_record_interval_s = perf_record_interval_s
+        self._last_perf_record_ns = 0
+        self._rollout_start_ns = 0
+        self._rollout_end_ns: Optional[int] = None
+        self._rollout_ns = 0
+        self._gradient_update_ns = 0
+        self._gradient_updates = 0
+
+    def _on_training_start(self) -> None:
+        if PERF_COUNTERS_ENABLED:
+            # Discards the counters of the steps before training, e.g. of the initial reset
+            collect_perf_counters(self.training_env)
+        self._last_perf_record_ns = perf_counter_ns()
+
+    def _on_rollout_start(self) -> None:
+        now = perf_counter_ns()
+        if self._rollout_end_ns is not None:
+            self._gradient_update_ns += now - self._rollout_end_ns
+            self._gradient_updates += 1
+        self._rollout_start_ns = now
+
+    def _on_rollout_end(self) -> None:
+        now = perf_counter_ns()
+        self._rollout_ns += now - self._rollout_start_ns
+        if PERF_COUNTERS_ENABLED and now - self._last_perf_record_ns >= self.perf_record_interval_s * 1e9:
+            self._record_perf_counters(interval_ns=now - self._last_perf_record_ns)
+            self._last_perf_record_ns = now
+        self._rollout_end_ns = perf_counter_ns()
+
+    def _record_perf_counters(self, interval_ns: int) -> None:
+        counters = collect_perf_counters(self.training_env)
+        _, env_step_ns, n_steps = counters.get('vec_env/step', (0, 0, 0))
+        policy_inference_ns = max(self._rollout_ns - env_step_ns, 0)
+        counters['train/policy_inference'] = [policy_inference_ns, policy_inference_ns, n_steps]
+        counters['train/gradient_update'] = [self._gradient_update_ns, self._gradient_update_ns, self._gradient_updates]
+        for phase, (ns, _, calls) in counters.items():
+            if calls > 0:
+                self.logger.record(f"perf/{phase}_us", ns / calls / 1e3)
+            self.logger.record(f"perf/{phase}_share", ns / interval_ns)
+        self._rollout_ns = 0
+        self._gradient_update_ns = 0
+        self._gradient_updates = 0
 
     def _on_step(self) -> bool:
         ################################
@@ -85,3 +148,284 @@ class SaveVecNormalizeAndRolloutBufferCallback(BaseCallback):
             path = os.path.join(self.save_path, f"{file_name}.pkl")
         return path
 
+
+class AsyncCheckpointCallback(BaseCallback):
+    """
+    Checkpoint callback that, unlike SB3's ``CheckpointCallback``, only snapshots the model, the ``VecNormalize``
+    statistics and the replay buffer in memory and writes them from a background thread (see ``checkpoint_writer.py``).
+    The transitions of the replay buffer are written incrementally and only the latest ``keep_last`` checkpoints are
+    kept. The files are named like the ones of the ``CheckpointCallback``.
+
+    A checkpoint is due every ``save_freq`` calls, but taken at the start of the next rollout, where the model has
+    been updated with the previous rollout and the replay buffer holds all collected transitions. Together with the
+    random number generator states (see ``training_state.py``) and a final checkpoint at the end of the training,
+    the checkpoints allow resuming a training with the ``resume`` execution mode.
+
+    :param save_freq: Save checkpoints every ``save_freq`` calls of the callback
+    :param save_path: Path to the folder where the checkpoints will be saved
+    :param name_prefix: Common prefix to the saved models
+    :param save_replay_buffer: Save the replay buffer of off-policy algorithms
+    :param save_vecnormalize: Save the ``VecNormalize`` statistics
+    :param keep_last: The number of checkpoints to keep, ``None`` keeps all
+    :param verbose: Verbosity level
+    """
+
+    def __init__(self,
+                 save_freq: int,
+                 save_path: str,
+                 name_prefix: str = "rl_model",
+                 save_replay_buffer: bool = False,
+                 save_vecnormalize: bool = False,
+                 keep_last: Optional[int] = None,
+                 verbose: int = 0):
+        super().__init__(verbose)
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.name_prefix = name_prefix
+        self.save_replay_buffer = save_replay_buffer
+        self.save_vecnormalize = save_vecnormalize
+        self.keep_last = keep_last
+        self.writer: Optional[CheckpointWriter] = None
+        self._checkpoint_due = False
+        self._last_checkpoint_timesteps: Optional[int] = None
+
+    def _init_callback(self) -> None:
+        self.writer = CheckpointWriter(Path(self.save_path), self.name_prefix, self.keep_last, verbose=self.verbose)
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.save_freq == 0:
+            self._checkpoint_due = True
+        return True
+
+    def _on_rollout_start(self) -> None:
+        if self._checkpoint_due:
+            self._save_checkpoint()
+
+    def _on_training_end(self) -> None:
+        try:
+            if self._last_checkpoint_timesteps != self.num_timesteps:
+                self._save_checkpoint()
+        finally:
+            self.writer.close()
+
+    def _save_checkpoint(self) -> None:
+        self.writer.save(self.model, self.num_timesteps,
+                         vec_normalize=self.model.get_vec_normalize_env() if self.save_vecnormalize else None,
+                         save_replay_buffer=self.save_replay_buffer,
+                         training_state=capture_training_state(self.model))
+        self._checkpoint_due = False
+        self._last_checkpoint_timesteps = self.num_timesteps
+
+
+# Policy weights as numpy arrays, the observation and return statistics of VecNormalize (if used)
+PolicySnapshot = Tuple[Dict[str, np.ndarray], Optional[Any], Optional[Any]]
+
+
+class AsyncEvalCallback(EventCallback):
+    """
+    Evaluation callback that evaluates in a long-lived worker process with its own eval envs, instead of blocking the
+    training like SB3's ``EvalCallback``.
+
+    Every ``eval_freq`` calls, the policy weights and the ``VecNormalize`` statistics are snapshot and sent to the
+    worker. While the worker is busy, only the latest snapshot is kept and sent once the worker is idle, so that
+    training never waits on evaluation. Results are checked on every step and, when they arrive, logged to
+    TensorBoard at the number of timesteps of their snapshot, written to ``log_path`` (analogously to
+    ``EvalCallback``) and, for a new best mean reward, the snapshot is saved as ``best_model`` (with its
+    ``VecNormalize`` statistics as ``vecnormalize.pkl``) and ``callback_on_new_best`` is triggered. Both see the
+    weights and ``VecNormalize`` statistics of the snapshot instead of the current training ones. At the end of
+    training, the result of a running evaluation is awaited.
+
+    :param eval_env_fn: Creates the eval envs in the worker process, must be picklable
+    :param n_eval_episodes: The number of episodes per evaluation
+    :param eval_freq: Evaluate the agent every ``eval_freq`` calls of the callback
+    :param log_path: Path to a folder where the evaluations (``evaluations.npz``) will be saved
+    :param best_model_save_path: Path to a folder where the best model will be saved
+    :param deterministic: Whether the evaluation should use deterministic actions
+    :param callback_on_new_best: Callback to trigger when there is a new best model according to the mean reward
+    :param start_method: Method used to start the worker process, defaults to 'forkserver' on available platforms,
+        and 'spawn' otherwise
+    :param verbose: Verbosity level
+    """
+
+    def __init__(self,
+                 eval_env_fn: Callable[[], VecEnv],
+                 n_eval_episodes: int = 5,
+                 eval_freq: int = 10000,
+                 log_path: Optional[str] = None,
+                 best_model_save_path: Optional[str] = None,
+                 deterministic: bool = True,
+                 callback_on_new_best: Optional[BaseCallback] = None,
+                 start_method: Optional[str] = None,
+                 verbose: int = 1):
+        super().__init__(callback_on_new_best, verbose=verbose)
+        self.eval_env_fn = eval_env_fn
+        self.n_eval_episodes = n_eval_episodes
+        self.eval_freq = eval_freq
+        self.log_path = os.path.join(log_path, "evaluations") if log_path is not None else None
+        self.best_model_save_path = best_model_save_path
+        self.deterministic = deterministic
+        self.start_method = start_method
+        self.best_mean_reward = -np.inf
+        self.last_mean_reward = -np.inf
+        self.evaluations_timesteps: List[int] = []
+        self.evaluations_results: List[List[float]] = []
+        self.evaluations_length: List[List[int]] = []
+        self._remote = None
+        self._process = None
+        # (timesteps, snapshot) of the running evaluation and of the evaluation waiting for the worker
+        self._running: Optional[Tuple[int, PolicySnapshot]] = None
+        self._pending: Optional[Tuple[int, PolicySnapshot]] = None
+
+    def _init_callback(self) -> None:
+        if self.best_model_save_path is not None:
+            os.makedirs(self.best_model_save_path, exist_ok=True)
+        if self.log_path is not None:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+
+        ctx = get_worker_context(self.start_method)
+        self._remote, work_remote = ctx.Pipe()
+        # The worker gets a CPU copy of the policy once, later only its weights are sent
+        policy = copy.deepcopy(self.model.policy).to('cpu')
+        self._process = ctx.Process(target=_async_eval_worker,
+                                    args=(work_remote, self.eval_env_fn, policy, self.n_eval_episodes,
+                                          self.deterministic),
+                                    daemon=True,
+                                    name='AsyncEvalWorker')
+        self._process.start()
+        work_remote.close()
+
+    def _on_step(self) -> bool:
+        continue_training = self._receive_results()
+        if self.eval_freq > 0 and self.n_calls % self.eval_freq == 0:
+            self._submit((self.num_timesteps, self._snapshot()))
+        return continue_training
+
+    def _on_training_end(self) -> None:
+        if self._process is None:
+            return
+        if self._running is not None:
+            # Training is over, the running evaluation is awaited to report the last result
+            self._pending = None
+            self._receive_results(block=True)
+        self._remote.send(('close', None))
+        self._process.join(timeout=10)
+        self._remote.close()
+        self._process = None
+
+    def _snapshot(self) -> PolicySnapshot:
+        weights = {name: tensor.detach().cpu().numpy().copy() for name, tensor in self.model.policy.state_dict().items()}
+        vec_normalize = unwrap_vec_normalize(self.training_env)
+        if vec_normalize is None:
+            return weights, None, None
+        return weights, copy.deepcopy(vec_normalize.obs_rms), copy.deepcopy(vec_normalize.ret_rms)
+
+    def _submit(self, evaluation: Tuple[int, PolicySnapshot]) -> None:
+        if self._running is not None:
+            if self._pending is not None and self.verbose >= 1:
+                logger.info("Evaluation worker busy, skipping the evaluation at %s timesteps", self._pending[0])
+            self._pending = evaluation
+            return
+        self._remote.send(('evaluate', evaluation[1]))
+        self._running = evaluation
+
+    def _receive_results(self, block: bool = False) -> bool:
+        continue_training = True
+        while self._running is not None and (block or self._remote.poll()):
+            episode_rewards, episode_lengths = self._remote.recv()
+            (timesteps, snapshot), self._running = self._running, None
+            continue_training = self._on_result(timesteps, snapshot, episode_rewards, episode_lengths)
+            if self._pending is not None:
+                pending, self._pending = self._pending, None
+                self._submit(pending)
+            block = False
+        return continue_training
+
+    def _on_result(self, timesteps: int, snapshot: PolicySnapshot, episode_rewards: List[float],
+                   episode_lengths: List[int]) -> bool:
+        if self.log_path is not None:
+            self.evaluations_timesteps.append(timesteps)
+            self.evaluations_results.append(episode_rewards)
+            self.evaluations_length.append(episode_lengths)
+            np.savez(self.log_path,
+                     timesteps=self.evaluations_timesteps,
+                     results=self.evaluations_results,
+                     ep_lengths=self.evaluations_length)
+
+        mean_reward, std_reward = np.mean(episode_rewards), np.std(episode_rewards)
+        mean_ep_length, std_ep_length = np.mean(episode_lengths), np.std(episode_lengths)
+        self.last_mean_reward = float(mean_reward)
+        if self.verbose >= 1:
+            logger.info("Eval num_timesteps=%s, episode_reward=%.2f +/- %.2f, episode length: %.2f +/- %.2f",
+                        timesteps, mean_reward, std_reward, mean_ep_length, std_ep_length)
+        self.logger.record("eval/mean_reward", float(mean_reward))
+        self.logger.record("eval/mean_ep_length", mean_ep_length)
+        self.logger.record("eval/delay_timesteps", self.num_timesteps - timesteps)
+        self.logger.record("time/total_timesteps", timesteps, exclude="tensorboard")
+        self.logger.dump(timesteps)
+
+        if mean_reward > self.best_mean_reward:
+            if self.verbose >= 1:
+                logger.info("New best mean reward %.2f at %s timesteps", mean_reward, timesteps)
+            self.best_mean_reward = float(mean_reward)
+            with self._load_snapshot(snapshot):
+                if self.best_model_save_path is not None:
+                    self._save_snapshot()
+                if self.callback is not None:
+                    return self._on_event()
+        return True
+
+    @contextmanager
+    def _load_snapshot(self, snapshot: PolicySnapshot) -> Iterator[None]:
+        """
+        Loads the weights and the ``VecNormalize`` statistics of ``snapshot`` into the training model, the training
+        weights and statistics are restored afterwards.
+        """
+        weights, obs_rms, ret_rms = snapshot
+        policy = self.model.policy
+        vec_normalize = self.model.get_vec_normalize_env()
+        current_weights = {name: tensor.clone() for name, tensor in policy.state_dict().items()}
+        current_rms = (vec_normalize.obs_rms, vec_normalize.ret_rms) if vec_normalize is not None else None
+        policy.load_state_dict({name: th.as_tensor(array) for name, array in weights.items()})
+        if vec_normalize is not None and obs_rms is not None:
+            vec_normalize.obs_rms, vec_normalize.ret_rms = obs_rms, ret_rms
+        try:
+            yield
+        finally:
+            policy.load_state_dict(current_weights)
+            if current_rms is not None:
+                vec_normalize.obs_rms, vec_normalize.ret_rms = current_rms
+
+    def _save_snapshot(self) -> None:
+        """Saves the loaded snapshot as ``best_model`` and its ``VecNormalize`` statistics as ``vecnormalize.pkl``."""
+        self.model.save(os.path.join(self.best_model_save_path, "best_model"))
+        vec_normalize = self.model.get_vec_normalize_env()
+        if vec_normalize is not None:
+            vec_normalize.save(os.path.join(self.best_model_save_path, "vecnormalize.pkl"))
+
+
+def _async_eval_worker(remote, eval_env_fn: Callable[[], VecEnv], policy: BasePolicy, n_eval_episodes: int,
+                       deterministic: bool) -> None:
+    # The evaluation must not compete with the training process for all cores
+    th.set_num_threads(1)
+    eval_env = eval_env_fn()
+    policy.set_training_mode(False)
+    vec_normalize = unwrap_vec_normalize(eval_env)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'close':
+                break
+            weights, obs_rms, ret_rms = data
+            policy.load_state_dict({name: th.as_tensor(array) for name, array in weights.items()})
+            if vec_normalize is not None and obs_rms is not None:
+                vec_normalize.obs_rms = obs_rms
+                vec_normalize.ret_rms = ret_rms
+            episode_rewards, episode_lengths = evaluate_policy(policy, eval_env, n_eval_episodes=n_eval_episodes,
+                                                               deterministic=deterministic,
+                                                               return_episode_rewards=True, warn=False)
+            remote.send((episode_rewards, episode_lengths))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        eval_env.close()
+        remote.close()
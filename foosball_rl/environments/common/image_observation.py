@@ -0,0 +1,154 @@
+from typing import Optional
+
+import gymnasium as gym
+import mujoco
+import numpy as np
+
+from foosball_rl.environments.common.renderer_pool import acquire_renderer, release_renderer
+
+# ITU-R BT.601 luma weights, scaled to 8 bit fixed point
+_GRAYSCALE_WEIGHTS = (77, 150, 29)
+
+
+class ImageObservation:
+    """
+    Renders image observations into preallocated buffers.
+
+    A frame consists of the RGB or grayscale image of ``camera``, optionally followed by a depth channel (normalized
+    by the extent of the model) and a segmentation channel (the id of the object seen by every pixel, shifted by one
+    so that the background is 0). The observation stacks the last ``frame_stack`` frames along the channel axis,
+    oldest first, with shape ``(height, width, frame_stack * channels)``.
+
+    The frames are kept in a ring buffer holding every frame twice, so that the last ``frame_stack`` frames are
+    always a contiguous window of the buffer and the observation is a view instead of a concatenation. There are two
+    ring buffers, every reset switches the buffer, so that the terminal observation of an episode is not overwritten
+    by the observation of the following reset. The returned observation is only valid until the next step.
+
+    :param mj_model: The model to render, the renderer is shared with the other environments of the process
+    :param camera: Name of the camera to render
+    :param height: Image height in pixels
+    :param width: Image width in pixels
+    :param grayscale: Whether to render a single grayscale channel instead of RGB
+    :param depth: Whether to add a depth channel
+    :param segmentation: Whether to add a segmentation channel
+    :param low_poly: Whether to use a low-poly renderer, see ``acquire_renderer``
+    :param frame_stack: Number of stacked frames
+    """
+
+    def __init__(self,
+                 mj_model: mujoco.MjModel,
+                 camera: str = 'observation_view',
+                 height: int = 64,
+                 width: int = 128,
+                 grayscale: bool = True,
+                 depth: bool = False,
+                 segmentation: bool = False,
+                 low_poly: bool = True,
+                 frame_stack: int = 1):
+        assert frame_stack >= 1, "frame_stack must be at least 1"
+        if mujoco.mj_name2id(mj_model, mujoco.mjtObj.mjOBJ_CAMERA, camera) < 0:
+            raise ValueError(f"Unknown camera: {camera}")
+        self.mj_model = mj_model
+        self.camera = camera
+        self.height = height
+        self.width = width
+        self.grayscale = grayscale
+        self.depth = depth
+        self.segmentation = segmentation
+        self.low_poly = low_poly
+        self.frame_stack = frame_stack
+        self.n_frame_channels = (1 if grayscale else 3) + int(depth) + int(segmentation)
+        self.observation_space = gym.spaces.Box(low=0, high=255,
+                                                shape=(height, width, frame_stack * self.n_frame_channels),
+                                                dtype=np.uint8)
+
+        self._rgb = np.zeros((height, width, 3), dtype=np.uint8)
+        self._gray = np.zeros((height, width), dtype=np.uint16)
+        self._gray_term = np.zeros((height, width), dtype=np.uint16)
+        self._depth = np.zeros((height, width), dtype=np.float32)
+        self._depth_scale = 255. / mj_model.stat.extent
+        self._segmentation_ids = np.zeros((height, width), dtype=np.int32)
+        self._rings = [np.zeros((height, width, 2 * frame_stack * self.n_frame_channels), dtype=np.uint8)
+                       for _ in range(2)]
+        self._active_ring = 0
+        self._position = 0
+        self._renderer: Optional[mujoco.Renderer] = None
+
+    def reset(self, mj_data: mujoco.MjData) -> np.ndarray:
+        """Switches the ring buffer and fills the whole frame stack with the current frame."""
+        self._active_ring ^= 1
+        self._position = 0
+        ring = self._rings[self._active_ring]
+        frame = self._frame_slot(ring, 0)
+        self._render_frame(mj_data, frame)
+        ring.reshape(self.height, self.width, 2 * self.frame_stack, self.n_frame_channels)[:] = frame[:, :, None, :]
+        return self._frame_window(ring)
+
+    def observe(self, mj_data: mujoco.MjData) -> np.ndarray:
+        """Renders the current frame into the ring buffer and returns the stacked frames."""
+        ring = self._rings[self._active_ring]
+        self._position = (self._position + 1) % self.frame_stack
+        frame = self._frame_slot(ring, self._position)
+        self._render_frame(mj_data, frame)
+        self._frame_slot(ring, self._position + self.frame_stack)[:] = frame
+        return self._frame_window(ring)
+
+    def close(self) -> None:
+        if self._renderer is not None:
+            release_renderer(self._renderer)
+            self._renderer = None
+
+    def _frame_slot(self, ring: np.ndarray, slot: int) -> np.ndarray:
+        return ring[:, :, slot * self.n_frame_channels:(slot + 1) * self.n_frame_channels]
+
+    def _frame_window(self, ring: np.ndarray) -> np.ndarray:
+        # Slots position + 1 ... position + frame_stack hold the last frames, oldest first
+        start = (self._position + 1) * self.n_frame_channels
+        return ring[:, :, start:start + self.frame_stack * self.n_frame_channels]
+
+    def _render_frame(self, mj_data: mujoco.MjData, frame: np.ndarray) -> None:
+        renderer = self.renderer
+        renderer.update_scene(mj_data, self.camera)
+        renderer.render(out=self._rgb)
+        if self.grayscale:
+            self._write_grayscale(frame[:, :, 0])
+            channel = 1
+        else:
+            frame[:, :, :3] = self._rgb
+            channel = 3
+        if self.depth:
+            # The renderer is shared, the depth and segmentation modes are only enabled for a single render
+            renderer.enable_depth_rendering()
+            try:
+                renderer.render(out=self._depth)
+            finally:
+                renderer.disable_depth_rendering()
+            np.multiply(self._depth, self._depth_scale, out=self._depth)
+            np.minimum(self._depth, 255., out=self._depth)
+            np.copyto(frame[:, :, channel], self._depth, casting='unsafe')
+            channel += 1
+        if self.segmentation:
+            renderer.enable_segmentation_rendering()
+            try:
+                # Returns a new (object id, object type) array, mujoco does not support rendering it into a buffer
+                segmentation = renderer.render(out=self._rgb)
+            finally:
+                renderer.disable_segmentation_rendering()
+            np.add(segmentation[:, :, 0], 1, out=self._segmentation_ids)
+            np.minimum(self._segmentation_ids, 255, out=self._segmentation_ids)
+            np.copyto(frame[:, :, channel], self._segmentation_ids, casting='unsafe')
+
+    def _write_grayscale(self, out: np.ndarray) -> None:
+        np.multiply(self._rgb[:, :, 0], _GRAYSCALE_WEIGHTS[0], out=self._gray, dtype=np.uint16)
+        for rgb_channel in (1, 2):
+            np.multiply(self._rgb[:, :, rgb_channel], _GRAYSCALE_WEIGHTS[rgb_channel], out=self._gray_term,
+                        dtype=np.uint16)
+            np.add(self._gray, self._gray_term, out=self._gray)
+        np.right_shift(self._gray, 8, out=self._gray)
+        np.copyto(out, self._gray, casting='unsafe')
+
+    @property
+    def renderer(self) -> mujoco.Renderer:
+        if self._renderer is None:
+            self._renderer = acquire_renderer(self.mj_model, self.height, self.width, low_poly=self.low_poly)
+        return self._renderer
@@ -0,0 +1,98 @@
+import copy
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+import mujoco
+
+logger = logging.getLogger(__name__)
+
+MODEL_CACHE_DIR_ENV_VAR = 'FOOSBALL_RL_MODEL_CACHE_DIR'
+DEFAULT_MODEL_CACHE_DIR = Path.home() / '.cache' / 'foosball_rl' / 'models'
+
+_FILE_ATTRIBUTE_PATTERN = re.compile(rb'\bfile\s*=\s*"([^"]+)"')
+
+_models: Dict[str, mujoco.MjModel] = {}
+
+
+def load_model(xml_path: Path, copy_model: bool = False) -> mujoco.MjModel:
+    """
+    Loads a compiled ``MjModel`` for ``xml_path``, compiling the XML at most once per process and once per machine.
+
+    Models are cached in-process and on disk as ``.mjb`` files, keyed by the content hash of the XML (and the files
+    it references) and the MuJoCo version. The on-disk cache lives in ``$FOOSBALL_RL_MODEL_CACHE_DIR``, or
+    ``~/.cache/foosball_rl/models`` if unset; setting the variable to an empty string disables it.
+
+    :param xml_path: Path to the MJCF file
+    :param copy_model: Whether to return a private copy instead of the process-wide shared model. The shared model
+        must not be modified.
+    :return: The compiled model
+    """
+    key = _cache_key(xml_path)
+    model = _models.get(key)
+    if model is None:
+        model = _load_or_compile(xml_path, key)
+        _models[key] = model
+    return copy.copy(model) if copy_model else model
+
+
+def clear_model_cache() -> None:
+    """Clears the in-process model cache, the on-disk cache is kept."""
+    _models.clear()
+
+
+def _cache_key(xml_path: Path) -> str:
+    digest = hashlib.sha256(mujoco.__version__.encode())
+    xml_content = xml_path.read_bytes()
+    digest.update(xml_content)
+    for referenced_file in _FILE_ATTRIBUTE_PATTERN.findall(xml_content):
+        referenced_path = xml_path.parent / referenced_file.decode()
+        if referenced_path.is_file():
+            digest.update(referenced_path.read_bytes())
+    return digest.hexdigest()[:32]
+
+
+def _cache_dir() -> Optional[Path]:
+    cache_dir = os.environ.get(MODEL_CACHE_DIR_ENV_VAR)
+    if cache_dir is None:
+        return DEFAULT_MODEL_CACHE_DIR
+    return Path(cache_dir) if cache_dir else None
+
+
+def _load_or_compile(xml_path: Path, key: str) -> mujoco.MjModel:
+    cache_dir = _cache_dir()
+    mjb_path = cache_dir / f'{xml_path.stem}-{key}.mjb' if cache_dir is not None else None
+    if mjb_path is not None and mjb_path.is_file():
+        try:
+            model = mujoco.MjModel.from_binary_path(mjb_path.as_posix())
+            logger.debug("Loaded compiled model %s from %s", xml_path.name, mjb_path)
+            return model
+        except ValueError:
+            logger.warning("Could not load compiled model %s, recompiling %s", mjb_path, xml_path)
+
+    model = mujoco.MjModel.from_xml_path(xml_path.as_posix())
+    logger.debug("Compiled model %s", xml_path)
+    if mjb_path is not None:
+        _save_model(model, mjb_path)
+    return model
+
+
+def _save_model(model: mujoco.MjModel, mjb_path: Path) -> None:
+    tmp_path = None
+    try:
+        mjb_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first, so that concurrent processes never read a partially written model
+        fd, tmp_path = tempfile.mkstemp(dir=mjb_path.parent, suffix='.mjb.tmp')
+        os.close(fd)
+        mujoco.mj_saveModel(model, tmp_path, None)
+        os.replace(tmp_path, mjb_path)
+        tmp_path = None
+    except (OSError, ValueError) as e:
+        logger.warning("Could not write compiled model cache %s: %s", mjb_path, e)
+    finally:
+        if tmp_path is not None:
+            Path(tmp_path).unlink(missing_ok=True)
@@ -0,0 +1,144 @@
+"""
+Low-overhead per-phase timing of the training hot path.
+
+Every process accumulates nanosecond counters per phase in ``PERF_COUNTERS``. Phases nest: the time of a phase
+excludes the time of the phases started within it (``ns``), the time including them is kept as well (``total_ns``).
+The counters are enabled by default and can be disabled entirely with the environment variable
+``FOOSBALL_RL_PERF_COUNTERS=0``, in which case no method is instrumented and the explicit phases are no-ops.
+
+The step methods are timed on the classes of the instrumented envs and wrappers, the instances hold no timed methods
+and are pickled (e.g. a saved ``VecNormalize``) like uninstrumented ones.
+"""
+import functools
+import os
+from collections import defaultdict
+from time import perf_counter_ns
+from typing import Callable, Dict, List, TYPE_CHECKING
+
+import gymnasium as gym
+
+if TYPE_CHECKING:
+    # The environments import this module, which must not import stable-baselines3 (and thus torch)
+    from stable_baselines3.common.vec_env import VecEnv
+
+PERF_COUNTERS_ENV_VAR = 'FOOSBALL_RL_PERF_COUNTERS'
+PERF_COUNTERS_ENABLED = os.environ.get(PERF_COUNTERS_ENV_VAR, '1').lower() not in ('0', 'false', 'off', '')
+
+# phase -> [self nanoseconds, total nanoseconds, calls]
+PerfSnapshot = Dict[str, List[int]]
+
+
+class PerfCounters:
+
+    def __init__(self):
+        self._counters: PerfSnapshot = defaultdict(lambda: [0, 0, 0])
+        self._child_ns: List[int] = []
+
+    def start(self) -> int:
+        self._child_ns.append(0)
+        return perf_counter_ns()
+
+    def stop(self, phase: str, start: int) -> None:
+        elapsed = perf_counter_ns() - start
+        counter = self._counters[phase]
+        counter[0] += elapsed - self._child_ns.pop()
+        counter[1] += elapsed
+        counter[2] += 1
+        if self._child_ns:
+            self._child_ns[-1] += elapsed
+
+    def pop(self) -> PerfSnapshot:
+        """Returns the counters accumulated since the last call and resets them."""
+        snapshot = dict(self._counters)
+        self._counters.clear()
+        return snapshot
+
+
+class NullPerfCounters(PerfCounters):
+
+    def start(self) -> int:
+        return 0
+
+    def stop(self, phase: str, start: int) -> None:
+        pass
+
+
+PERF_COUNTERS: PerfCounters = PerfCounters() if PERF_COUNTERS_ENABLED else NullPerfCounters()
+
+
+def merge_perf_snapshots(snapshots: List[PerfSnapshot]) -> PerfSnapshot:
+    merged: PerfSnapshot = defaultdict(lambda: [0, 0, 0])
+    for snapshot in snapshots:
+        for phase, counter in snapshot.items():
+            merged_counter = merged[phase]
+            for i, value in enumerate(counter):
+                merged_counter[i] += value
+    return dict(merged)
+
+
+def _timed(cls: type, function: Callable, phase: str) -> Callable:
+    """Method of ``cls`` timing every call on instances of exactly ``cls`` as ``phase``."""
+
+    @functools.wraps(function)
+    def timed(self, *args, **kwargs):
+        if type(self) is not cls:
+            # Inherited by a subclass or called via super(), which is timed as the phase of the subclass, if any
+            return function(self, *args, **kwargs)
+        start = PERF_COUNTERS.start()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            PERF_COUNTERS.stop(phase, start)
+
+    timed.perf_phase = phase
+    return timed
+
+
+def _instrument(obj, method_name: str, phase: str) -> None:
+    cls = type(obj)
+    if not hasattr(cls.__dict__.get(method_name), 'perf_phase'):
+        # Replaces the method on the class once, instead of shadowing it with a timed bound method on the instance
+        setattr(cls, method_name, _timed(cls, getattr(cls, method_name), phase))
+
+
+def instrument_env(env: gym.Env) -> gym.Env:
+    """
+    Times the ``step`` of every gym wrapper of ``env`` as phase ``gym_wrapper/<wrapper>``, and the remainder of the
+    unwrapped ``step`` (not covered by its explicit phases) as ``env/other``.
+    """
+    if PERF_COUNTERS_ENABLED:
+        env_tmp = env
+        while isinstance(env_tmp, gym.Wrapper):
+            _instrument(env_tmp, 'step', f'gym_wrapper/{env_tmp.__class__.__name__}')
+            env_tmp = env_tmp.env
+        _instrument(env_tmp, 'step', 'env/other')
+    return env
+
+
+def instrument_vec_env(venv: 'VecEnv') -> 'VecEnv':
+    """
+    Times the ``step_wait`` of every vec env wrapper of ``venv`` as phase ``vec_wrapper/<wrapper>``, of the
+    vectorized environment as ``vec_env/<vec env>``, and the whole ``step`` as ``vec_env/step``.
+    """
+    from stable_baselines3.common.vec_env import VecEnvWrapper
+
+    if PERF_COUNTERS_ENABLED:
+        _instrument(venv, 'step', 'vec_env/step')
+        venv_tmp = venv
+        while isinstance(venv_tmp, VecEnvWrapper):
+            _instrument(venv_tmp, 'step_wait', f'vec_wrapper/{venv_tmp.__class__.__name__}')
+            venv_tmp = venv_tmp.venv
+        _instrument(venv_tmp, 'step_wait', f'vec_env/{venv_tmp.__class__.__name__}')
+    return venv
+
+
+def collect_perf_counters(venv: 'VecEnv') -> PerfSnapshot:
+    """
+    Pops the counters of this process and, for vectorized environments running their environments in subprocesses,
+    of the worker processes.
+    """
+    snapshots = [PERF_COUNTERS.pop()]
+    if PERF_COUNTERS_ENABLED and not hasattr(venv.unwrapped, 'envs'):
+        # The first env of a worker returns the counters of the whole worker process, the others return empty ones
+        snapshots.extend(venv.env_method('pop_perf_counters'))
+    return merge_perf_snapshots(snapshots)
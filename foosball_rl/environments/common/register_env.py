@@ -3,7 +3,7 @@ from typing import Optional, Callable, Dict, Type, Union, Any
 
 import gymnasium as gym
 from stable_baselines3.common.monitor import Monitor
-from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv
+from stable_baselines3.common.vec_env import DummyVecEnv, VecEnv
 from stable_baselines3.common.vec_env.patch_gym import _patch_env
 
 
@@ -15,7 +15,7 @@ def make_vec_env(  # NOSONAR
     monitor_dir: Optional[str] = None,
     wrapper_class: Optional[Callable[[gym.Env], gym.Env]] = None,
     env_kwargs: Optional[Dict[str, Any]] = None,
-    vec_env_cls: Optional[Type[Union[DummyVecEnv, SubprocVecEnv]]] = None,
+    vec_env_cls: Optional[Type[VecEnv]] = None,
     vec_env_kwargs: Optional[Dict[str, Any]] = None,
     monitor_kwargs: Optional[Dict[str, Any]] = None,
     wrapper_kwargs: Optional[Dict[str, Any]] = None,
@@ -60,6 +60,8 @@ def make_vec_env(  # NOSONAR
             assert monitor_kwargs is not None
             assert wrapper_kwargs is not None
             assert env_kwargs is not None
+            # Registers the environments, the env fn may be called in a freshly started subprocess
+            import foosball_rl.environments  # noqa: F401
 
             if isinstance(env_id, str):
                 try:
@@ -0,0 +1,74 @@
+import copy
+import logging
+from typing import Dict, Tuple
+
+import mujoco
+
+logger = logging.getLogger(__name__)
+
+# Rendering features disabled for low-poly renderers
+LOW_POLY_DISABLED_RENDER_FLAGS = (mujoco.mjtRndFlag.mjRND_SHADOW, mujoco.mjtRndFlag.mjRND_REFLECTION,
+                                  mujoco.mjtRndFlag.mjRND_SKYBOX, mujoco.mjtRndFlag.mjRND_HAZE,
+                                  mujoco.mjtRndFlag.mjRND_FOG)
+LOW_POLY_NUM_SLICES = 8
+LOW_POLY_NUM_STACKS = 4
+
+# (id of the model, height, width, low poly) -> [renderer, number of envs using it]
+_renderers: Dict[Tuple[int, int, int, bool], list] = {}
+
+
+def acquire_renderer(model: mujoco.MjModel, height: int, width: int, low_poly: bool = False) -> mujoco.Renderer:
+    """
+    Returns the offscreen renderer of this process for ``model`` and the given resolution, creating it on first use.
+
+    All environments of a process that share a (compiled, see ``model_cache.py``) model share one renderer and thus
+    one GL context and framebuffer. This is safe as long as every ``render`` call updates the scene with the data of
+    the rendering environment first and copies the returned frame before the next render. Every acquired renderer
+    must be returned with ``release_renderer``.
+
+    :param model: The model to render, must not be modified while the renderer is in use
+    :param height: Image height in pixels
+    :param width: Image width in pixels
+    :param low_poly: Whether to render primitives with fewer polygons, without anti-aliasing, shadows, reflections,
+        skybox, haze and fog. Intended for small image observations, where these details are not visible anyway
+    :return: The shared renderer
+    """
+    key = (id(model), height, width, low_poly)
+    entry = _renderers.get(key)
+    if entry is None:
+        logger.debug("Creating %soffscreen renderer with resolution %sx%s", 'low-poly ' if low_poly else '', width,
+                     height)
+        entry = [_create_renderer(model, height, width, low_poly), 0]
+        _renderers[key] = entry
+    entry[1] += 1
+    return entry[0]
+
+
+def release_renderer(renderer: mujoco.Renderer) -> None:
+    """Releases a renderer acquired with ``acquire_renderer``, closing it when no environment uses it anymore."""
+    for key, entry in _renderers.items():
+        if entry[0] is renderer:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _renderers[key]
+                renderer.close()
+            return
+    raise ValueError("The renderer was not acquired from the renderer pool")
+
+
+def _create_renderer(model: mujoco.MjModel, height: int, width: int, low_poly: bool) -> mujoco.Renderer:
+    if not low_poly:
+        # The renderer references the model, so the id of the model is not reused while the renderer is pooled
+        return mujoco.Renderer(model, height=height, width=width)
+    # The tessellation and multisampling are read from the model when the render context is created, the copy is
+    # only used for rendering, the scene is still updated with the data of the shared model
+    render_model = copy.copy(model)
+    render_model.vis.quality.numslices = LOW_POLY_NUM_SLICES
+    render_model.vis.quality.numstacks = LOW_POLY_NUM_STACKS
+    render_model.vis.quality.offsamples = 0
+    renderer = mujoco.Renderer(render_model, height=height, width=width)
+    # Keeps the shared model alive, so that its id is not reused while the renderer is pooled
+    renderer.source_model = model
+    for flag in LOW_POLY_DISABLED_RENDER_FLAGS:
+        renderer.scene.flags[flag] = False
+    return renderer
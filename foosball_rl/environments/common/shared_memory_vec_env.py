@@ -0,0 +1,263 @@
+import os
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+import gymnasium as gym
+import numpy as np
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper, VecEnv, VecEnvIndices, VecEnvObs, \
+    VecEnvStepReturn
+from stable_baselines3.common.vec_env.patch_gym import _patch_env
+from stable_baselines3.common.vec_env.util import dict_to_obs, obs_space_info
+
+from foosball_rl.environments.common.worker_context import get_worker_context
+
+# name -> (shared memory name, shape, dtype)
+BufferSpecs = Dict[str, Tuple[str, Tuple[int, ...], str]]
+
+
+def _attach_buffers(buffer_specs: BufferSpecs) -> Tuple[List[shared_memory.SharedMemory], Dict[str, np.ndarray]]:
+    segments, arrays = [], {}
+    for key, (shm_name, shape, dtype) in buffer_specs.items():
+        # Child processes share the resource tracker of the parent, which owns and unlinks the segments
+        segment = shared_memory.SharedMemory(name=shm_name)
+        segments.append(segment)
+        arrays[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+    return segments, arrays
+
+
+def _write_obs(buffers: Dict[str, np.ndarray], prefix: str, keys: List[Optional[str]], env_idx: int, obs) -> None:
+    for key in keys:
+        buffers[f"{prefix}{key}"][env_idx] = obs if key is None else obs[key]
+
+
+def _worker(remote, parent_remote, env_fn_wrappers: List[CloudpickleWrapper], env_indices: List[int]) -> None:
+    # Import here to avoid a circular import, and to register the environments in spawned processes
+    import foosball_rl.environments  # noqa: F401
+    from stable_baselines3.common.env_util import is_wrapped
+
+    parent_remote.close()
+    envs = [_patch_env(env_fn_wrapper.var()) for env_fn_wrapper in env_fn_wrappers]
+    segments: List[shared_memory.SharedMemory] = []
+    buffers: Dict[str, np.ndarray] = {}
+    keys: List[Optional[str]] = []
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                actions = buffers["actions"]
+                infos = []
+                for env_idx, env in zip(env_indices, envs):
+                    observation, reward, terminated, truncated, info = env.step(actions[env_idx])
+                    done = terminated or truncated
+                    info["TimeLimit.truncated"] = truncated and not terminated
+                    reset_info = None
+                    if done:
+                        # The terminal observation is passed through shared memory as well
+                        _write_obs(buffers, "terminal_obs_", keys, env_idx, observation)
+                        observation, reset_info = env.reset()
+                    _write_obs(buffers, "obs_", keys, env_idx, observation)
+                    buffers["rewards"][env_idx] = reward
+                    buffers["dones"][env_idx] = done
+                    infos.append((info, reset_info))
+                remote.send(infos)
+            elif cmd == "reset":
+                reset_infos = []
+                for env_idx, env, seed, options in zip(env_indices, envs, data[0], data[1]):
+                    maybe_options = {"options": options} if options else {}
+                    observation, reset_info = env.reset(seed=seed, **maybe_options)
+                    _write_obs(buffers, "obs_", keys, env_idx, observation)
+                    reset_infos.append(reset_info)
+                remote.send(reset_infos)
+            elif cmd == "attach":
+                buffer_specs, keys = data
+                segments, buffers = _attach_buffers(buffer_specs)
+                remote.send(None)
+            elif cmd == "render":
+                remote.send([envs[local_idx].render() for local_idx in data])
+            elif cmd == "close":
+                for env in envs:
+                    env.close()
+                for segment in segments:
+                    segment.close()
+                remote.close()
+                break
+            elif cmd == "get_spaces":
+                remote.send((envs[0].observation_space, envs[0].action_space))
+            elif cmd == "env_method":
+                local_indices, method_name, method_args, method_kwargs = data
+                remote.send([envs[i].get_wrapper_attr(method_name)(*method_args, **method_kwargs)
+                             for i in local_indices])
+            elif cmd == "get_attr":
+                local_indices, attr_name = data
+                remote.send([envs[i].get_wrapper_attr(attr_name) for i in local_indices])
+            elif cmd == "set_attr":
+                local_indices, attr_name, value = data
+                for i in local_indices:
+                    setattr(envs[i], attr_name, value)
+                remote.send(None)
+            elif cmd == "is_wrapped":
+                local_indices, wrapper_class = data
+                remote.send([is_wrapped(envs[i], wrapper_class) for i in local_indices])
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except EOFError:
+            break
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    Process-parallel vectorized environment exchanging observations, rewards, dones and actions through preallocated
+    shared-memory numpy arrays instead of pickling them through pipes, analogously to SB3's ``SubprocVecEnv``.
+
+    The environments are split into contiguous groups, one per worker process. Only the info dicts (and the results
+    of ``get_attr``/``env_method``/``render``) are still sent through pipes, so large (e.g. image) observations cost
+    no serialization at all.
+
+    The returned observations are copies of the shared buffers, they stay valid after the next step.
+
+    :param env_fns: Environments to run in subprocesses
+    :param n_workers: Number of worker processes, defaults to ``min(n_envs, os.cpu_count())``
+    :param start_method: method used to start the subprocesses, defaults to 'forkserver' on available platforms,
+        and 'spawn' otherwise. Like with ``SubprocVecEnv``, the code must be wrapped in an
+        ``if __name__ == "__main__":`` block.
+    """
+
+    def __init__(self,
+                 env_fns: List[Callable[[], gym.Env]],
+                 n_workers: Optional[int] = None,
+                 start_method: Optional[str] = None):
+        self.waiting = False
+        self.closed = False
+        n_envs = len(env_fns)
+        n_workers = min(n_envs, n_workers if n_workers is not None else os.cpu_count())
+
+        ctx = get_worker_context(start_method)
+
+        self.worker_env_indices = [indices.tolist() for indices in np.array_split(np.arange(n_envs), n_workers)]
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_workers)])
+        self.processes = []
+        for work_remote, remote, env_indices in zip(self.work_remotes, self.remotes, self.worker_env_indices):
+            args = (work_remote, remote, [CloudpickleWrapper(env_fns[i]) for i in env_indices], env_indices)
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_worker, args=args, daemon=True)  # type: ignore[attr-defined]
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+
+        self.keys, shapes, dtypes = obs_space_info(observation_space)
+        self._segments: List[shared_memory.SharedMemory] = []
+        buffer_specs: BufferSpecs = {}
+        for key in self.keys:
+            for prefix in ("obs_", "terminal_obs_"):
+                buffer_specs[f"{prefix}{key}"] = self._allocate((n_envs, *shapes[key]), dtypes[key])
+        buffer_specs["rewards"] = self._allocate((n_envs,), np.float32)
+        buffer_specs["dones"] = self._allocate((n_envs,), np.bool_)
+        buffer_specs["actions"] = self._allocate((n_envs, *action_space.shape), action_space.dtype)
+        self._buffers: Dict[str, np.ndarray] = {
+            key: np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+            for (key, (_, shape, dtype)), segment in zip(buffer_specs.items(), self._segments)}
+        for remote in self.remotes:
+            remote.send(("attach", (buffer_specs, self.keys)))
+        for remote in self.remotes:
+            remote.recv()
+
+        super().__init__(n_envs, observation_space, action_space)
+
+    def _allocate(self, shape: Tuple[int, ...], dtype) -> Tuple[str, Tuple[int, ...], str]:
+        dtype = np.dtype(dtype)
+        segment = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self._segments.append(segment)
+        return segment.name, tuple(int(dim) for dim in shape), dtype.str
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._buffers["actions"][:] = np.asarray(actions).reshape(self._buffers["actions"].shape)
+        for remote in self.remotes:
+            remote.send(("step", None))
+        self.waiting = True
+
+    def step_wait(self) -> VecEnvStepReturn:
+        infos: List[Dict[str, Any]] = []
+        for remote, env_indices in zip(self.remotes, self.worker_env_indices):
+            for env_idx, (info, reset_info) in zip(env_indices, remote.recv()):
+                if reset_info is not None:
+                    info["terminal_observation"] = self._terminal_obs(env_idx)
+                    self.reset_infos[env_idx] = reset_info
+                infos.append(info)
+        self.waiting = False
+        return self._obs_from_buf(), self._buffers["rewards"].copy(), self._buffers["dones"].copy(), infos
+
+    def reset(self) -> VecEnvObs:
+        for remote, env_indices in zip(self.remotes, self.worker_env_indices):
+            remote.send(("reset", ([self._seeds[i] for i in env_indices], [self._options[i] for i in env_indices])))
+        for remote, env_indices in zip(self.remotes, self.worker_env_indices):
+            for env_idx, reset_info in zip(env_indices, remote.recv()):
+                self.reset_infos[env_idx] = reset_info
+        # Seeds and options are only used once
+        self._reset_seeds()
+        self._reset_options()
+        return self._obs_from_buf()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+        for segment in self._segments:
+            segment.close()
+            segment.unlink()
+        self.closed = True
+
+    def _obs_from_buf(self) -> VecEnvObs:
+        return dict_to_obs(self.observation_space,
+                           OrderedDict((key, self._buffers[f"obs_{key}"].copy()) for key in self.keys))
+
+    def _terminal_obs(self, env_idx: int):
+        if self.keys == [None]:
+            return self._buffers["terminal_obs_None"][env_idx].copy()
+        return OrderedDict((key, self._buffers[f"terminal_obs_{key}"][env_idx].copy()) for key in self.keys)
+
+    def _dispatch(self, indices: VecEnvIndices, cmd: str, *args) -> List[Any]:
+        """Sends ``cmd`` to the workers owning ``indices`` and returns the results in the order of ``indices``."""
+        indices = list(self._get_indices(indices))
+        requests = []
+        for worker_idx, env_indices in enumerate(self.worker_env_indices):
+            local_indices = [env_indices.index(i) for i in indices if i in env_indices]
+            if local_indices:
+                self.remotes[worker_idx].send((cmd, (local_indices, *args)))
+                requests.append((worker_idx, local_indices))
+        results = {}
+        for worker_idx, local_indices in requests:
+            for local_idx, result in zip(local_indices, self.remotes[worker_idx].recv()):
+                results[self.worker_env_indices[worker_idx][local_idx]] = result
+        return [results[i] for i in indices]
+
+    def get_images(self) -> Sequence[Optional[np.ndarray]]:
+        if self.render_mode != "rgb_array":
+            return [None for _ in range(self.num_envs)]
+        for remote, env_indices in zip(self.remotes, self.worker_env_indices):
+            remote.send(("render", list(range(len(env_indices)))))
+        images = []
+        for remote in self.remotes:
+            images.extend(remote.recv())
+        return images
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        return self._dispatch(indices, "get_attr", attr_name)
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        self._dispatch(indices, "set_attr", attr_name, value)
+
+    def env_method(self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs) -> List[Any]:
+        return self._dispatch(indices, "env_method", method_name, method_args, method_kwargs)
+
+    def env_is_wrapped(self, wrapper_class: Type[gym.Wrapper], indices: VecEnvIndices = None) -> List[bool]:
+        return self._dispatch(indices, "is_wrapped", wrapper_class)
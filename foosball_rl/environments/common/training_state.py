@@ -0,0 +1,48 @@
+"""
+The state of a training that is not part of the saved model, the ``VecNormalize`` statistics or the replay buffer:
+the global random number generators (torch, numpy, random), the one of the action space of the model (sampled
+for the random actions of off-policy algorithms) and the ones of the environments (``get_rng_state`` of the raw
+environments). It is saved with every checkpoint of the ``AsyncCheckpointCallback`` and restored when resuming a
+training, so that the resumed training draws the same random numbers and episodes as an uninterrupted one.
+"""
+import random
+from typing import Any, Dict
+
+import numpy as np
+import torch as th
+from stable_baselines3.common.base_class import BaseAlgorithm
+
+
+def capture_training_state(model: BaseAlgorithm) -> Dict[str, Any]:
+    return {
+        'torch': th.get_rng_state(),
+        'cuda': th.cuda.get_rng_state_all() if th.cuda.is_available() else None,
+        'numpy': np.random.get_state(),
+        'random': random.getstate(),
+        'action_space': model.action_space.np_random.bit_generator.state,
+        'envs': model.get_env().env_method('get_rng_state'),
+    }
+
+
+def restore_training_state(model: BaseAlgorithm, state: Dict[str, Any]) -> None:
+    """
+    Restores ``state`` of a checkpoint after the model of the checkpoint has been loaded (loading seeds the global
+    random number generators). The environments of the model are reset at the start of the next ``learn`` call with
+    the restored random number generators, the episodes running at the time of the checkpoint are not continued.
+    """
+    venv = model.get_env()
+    if len(state['envs']) != venv.num_envs:
+        raise ValueError(f"The checkpoint was saved with {len(state['envs'])} envs, but the training uses "
+                         f"{venv.num_envs} envs")
+    for env_idx, env_state in enumerate(state['envs']):
+        venv.env_method('set_rng_state', env_state, indices=[env_idx])
+    # The seeds passed to the first reset of new envs would reseed the restored generators
+    venv.unwrapped._reset_seeds()
+    model._last_obs = None
+
+    th.set_rng_state(state['torch'])
+    if state['cuda'] is not None and th.cuda.is_available():
+        th.cuda.set_rng_state_all(state['cuda'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    model.action_space.np_random.bit_generator.state = state['action_space']
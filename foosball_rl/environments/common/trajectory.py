@@ -0,0 +1,138 @@
+"""
+Compact state trajectories, recorded during training and rendered offline (see the ``render`` execution mode).
+
+A trajectory file ``<name>.bin`` holds the recorded episodes of one environment as consecutive float32 rows
+``[time, qpos, qvel, ctrl]``, one row for the initial state of an episode and one per step. The metadata file
+``<name>.json`` holds the environment id, the model dimensions, the control timestep and the row ranges of the
+episodes. Rows are buffered in chunks and appended to the file, the file is read as a memory map.
+"""
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import mujoco
+import numpy as np
+
+TRAJECTORY_SUFFIX = '.bin'
+METADATA_SUFFIX = '.json'
+
+
+class TrajectoryWriter:
+    """
+    Appends the episodes of one environment to a trajectory file.
+
+    :param path: Path of the trajectory file without suffix, the file must not exist yet
+    :param mj_model: The model of the recorded environment
+    :param env_id: The id of the recorded environment, used to rebuild the model when rendering
+    :param dt: The time between two recorded steps in seconds
+    :param chunk_size: Number of rows buffered before they are written to the file
+    """
+
+    def __init__(self, path: Path, mj_model: mujoco.MjModel, env_id: Optional[str], dt: float, chunk_size: int = 256):
+        self.path = path
+        self.nq, self.nv, self.nu = mj_model.nq, mj_model.nv, mj_model.nu
+        self.metadata = {'env_id': env_id, 'nq': self.nq, 'nv': self.nv, 'nu': self.nu, 'dt': dt, 'episodes': []}
+        self._chunk = np.zeros((chunk_size, 1 + self.nq + self.nv + self.nu), dtype=np.float32)
+        self._chunk_rows = 0
+        self._written_rows = 0
+        self._episode_start: Optional[int] = None
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Fails instead of truncating the trajectories of another writer
+        self._file = open(path.with_suffix(TRAJECTORY_SUFFIX), 'xb')
+
+    def begin_episode(self, mj_data: mujoco.MjData) -> None:
+        if self._episode_start is not None:
+            self.end_episode()
+        self._episode_start = self._written_rows + self._chunk_rows
+        self.record(mj_data)
+
+    def record(self, mj_data: mujoco.MjData) -> None:
+        row = self._chunk[self._chunk_rows]
+        row[0] = mj_data.time
+        qvel_start = 1 + self.nq
+        ctrl_start = qvel_start + self.nv
+        row[1:qvel_start] = mj_data.qpos
+        row[qvel_start:ctrl_start] = mj_data.qvel
+        row[ctrl_start:] = mj_data.ctrl
+        self._chunk_rows += 1
+        if self._chunk_rows == len(self._chunk):
+            self._flush_chunk()
+
+    def end_episode(self) -> None:
+        """Writes the buffered rows and the metadata, so that the file is complete up to the finished episode."""
+        if self._episode_start is None:
+            return
+        self._flush_chunk()
+        self._file.flush()
+        self.metadata['episodes'].append([self._episode_start, self._written_rows - self._episode_start])
+        self._episode_start = None
+        tmp_path = self.path.with_suffix(METADATA_SUFFIX + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.metadata, f)
+        os.replace(tmp_path, self.path.with_suffix(METADATA_SUFFIX))
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.end_episode()
+            self._file.close()
+
+    def _flush_chunk(self) -> None:
+        self._chunk[:self._chunk_rows].tofile(self._file)
+        self._written_rows += self._chunk_rows
+        self._chunk_rows = 0
+
+
+@dataclass
+class TrajectoryEpisode:
+    time: np.ndarray
+    qpos: np.ndarray
+    qvel: np.ndarray
+    ctrl: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def set_state(self, mj_model: mujoco.MjModel, mj_data: mujoco.MjData, step: int) -> None:
+        """Restores the recorded state of ``step`` and recomputes the derived quantities (e.g. for rendering)."""
+        mj_data.time = self.time[step]
+        mj_data.qpos[:] = self.qpos[step]
+        mj_data.qvel[:] = self.qvel[step]
+        mj_data.ctrl[:] = self.ctrl[step]
+        mujoco.mj_forward(mj_model, mj_data)
+
+
+def load_trajectory(path: Path) -> Tuple[dict, List[TrajectoryEpisode]]:
+    """
+    Memory maps a trajectory file.
+
+    :param path: Path of the trajectory file, with or without suffix
+    :return: The metadata and the recorded episodes, whose arrays are views of the memory map
+    """
+    with open(path.with_suffix(METADATA_SUFFIX)) as f:
+        metadata = json.load(f)
+    nq, nv, nu = metadata['nq'], metadata['nv'], metadata['nu']
+    if not metadata['episodes']:
+        return metadata, []
+    trajectory_path = path.with_suffix(TRAJECTORY_SUFFIX)
+    row_size = 1 + nq + nv + nu
+    # The file may still be written to, only complete rows are mapped
+    n_rows = trajectory_path.stat().st_size // (row_size * np.dtype(np.float32).itemsize)
+    rows = np.memmap(trajectory_path, dtype=np.float32, mode='r', shape=(n_rows, row_size))
+    episodes = []
+    for start, length in metadata['episodes']:
+        episode_rows = rows[start:start + length]
+        episodes.append(TrajectoryEpisode(time=episode_rows[:, 0],
+                                          qpos=episode_rows[:, 1:1 + nq],
+                                          qvel=episode_rows[:, 1 + nq:1 + nq + nv],
+                                          ctrl=episode_rows[:, 1 + nq + nv:]))
+    return metadata, episodes
+
+
+def find_trajectories(path: Path) -> List[Path]:
+    """Returns the trajectory files in ``path`` (searched recursively) or ``path`` itself if it is a file."""
+    if path.is_file():
+        return [path]
+    return sorted(trajectory_path for trajectory_path in path.rglob(f'*{TRAJECTORY_SUFFIX}')
+                  if trajectory_path.with_suffix(METADATA_SUFFIX).is_file())
@@ -0,0 +1,38 @@
+"""
+Start contexts for the worker processes (env workers, evaluation and training workers).
+
+Freshly started worker processes import torch and stable-baselines3 (through the ``Monitor`` and the vec env base
+classes), which takes seconds per worker. With the 'forkserver' start method, the fork server imports the
+``WORKER_PRELOAD_MODULES`` once and every worker is forked from it with these modules already imported.
+"""
+import multiprocessing as mp
+from multiprocessing.context import BaseContext
+from typing import Optional
+
+WORKER_PRELOAD_MODULES = ['foosball_rl.environments',
+                          'foosball_rl.environments.common.shared_memory_vec_env',
+                          'foosball_rl.wrappers.wrapper_configuration']
+
+
+def default_start_method() -> str:
+    return "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+
+
+def configure_forkserver_preload() -> None:
+    """
+    Sets the modules preloaded by the fork server, shared by all 'forkserver' contexts of the process (also the one of
+    SB3's ``SubprocVecEnv``). Only effective until the fork server has been started.
+    """
+    if "forkserver" in mp.get_all_start_methods():
+        mp.set_forkserver_preload(WORKER_PRELOAD_MODULES)
+
+
+def get_worker_context(start_method: Optional[str] = None) -> BaseContext:
+    """
+    :param start_method: The start method, defaults to 'forkserver' on available platforms, and 'spawn' otherwise
+    :return: The multiprocessing context to start worker processes with
+    """
+    start_method = start_method if start_method is not None else default_start_method()
+    if start_method == "forkserver":
+        configure_forkserver_preload()
+    return mp.get_context(start_method)
@@ -1,83 +1,65 @@
+"""
+Lookup tables of the discrete action spaces, used by the ``VecDiscreteActionWrapper`` and
+``VecMultiDiscreteActionWrapper`` (see ``custom_vec_wrappers.py``), the only action space wrappers: the actions are
+discretized on the vectorized environment, not per environment.
+"""
 import logging
-from typing import Any
+from typing import Any, List, Tuple
 
 import gymnasium as gym
 import numpy as np
-from gymnasium import ActionWrapper
-from gymnasium.core import WrapperActType, ActType
 
 logger = logging.getLogger(__name__)
 
+ACTION_SPACES = ('continuous', 'discrete', 'multi_discrete')
 
-def get_action_space_wrapper(env: gym.Env, action_space_wrapper_conf: dict[str, Any]) -> gym.Env:
+
+def check_action_space(action_space_wrapper_conf: dict[str, Any]) -> str:
     action_space = action_space_wrapper_conf['action_space']
-    if action_space == 'continuous':
-        logging.info("Env already has a continuous action space, won't wrap with any action space wrapper")
-        return env
-    elif action_space == 'discrete':
-        return DiscreteActionWrapper(env=env, lateral_bins=action_space_wrapper_conf['lateral_bins'],
-                                     angular_bins=action_space_wrapper_conf['angular_bins'])
-    elif action_space == 'multi-discrete':
-        return MultiDiscreteActionWrapper(env=env, lateral_bins=action_space_wrapper_conf['lateral_bins'],
-                                          angular_bins=action_space_wrapper_conf['angular_bins'])
-    else:
-        logger.error("Only \'continuous\', \'discrete\' and \'multi-discrete\' action spaces are supported"
-                     "when using create_env.action_space_wrapper")
+    if action_space not in ACTION_SPACES:
+        logger.error("Only \'continuous\', \'discrete\' and \'multi_discrete\' action spaces are supported "
+                     "when using the action space wrapper")
         raise ValueError(f"Unknown action space wrapper {action_space}")
+    return action_space
 
 
-class DiscreteActionWrapper(ActionWrapper):
+def discretize_actuators(action_space: gym.spaces.Box, lateral_bins: int, angular_bins: int) -> List[np.ndarray]:
     """
-    Assumptions:
-    - env has a 2D continuous action space (gym.spaces.Box)
+    Evenly spaced control values of every actuator, from its lower to its upper bound. The actuators of a rod are
+    ordered lateral, angular (see the environment docs), so the actuators alternate between ``lateral_bins`` and
+    ``angular_bins`` values, e.g. 2 actuators for the goalkeeper and 16 for the foosball teams.
     """
+    if not isinstance(action_space, gym.spaces.Box) or len(action_space.shape) != 1 or action_space.shape[0] % 2:
+        raise ValueError(f"Expected a continuous action space of lateral and angular actuator pairs, "
+                         f"got {action_space}")
+    if lateral_bins < 2 or angular_bins < 2:
+        raise ValueError("At least 2 lateral and 2 angular bins are needed to cover the range of the actuators")
+    return [np.linspace(low, high, lateral_bins if actuator % 2 == 0 else angular_bins, dtype=action_space.dtype)
+            for actuator, (low, high) in enumerate(zip(action_space.low, action_space.high))]
 
-    def __init__(self, env: gym.Env, seed: int = 1, lateral_bins: int = 3, angular_bins: int = 3):
-        super().__init__(env)
-        self.lateral_bins = lateral_bins
-        self.angular_bins = angular_bins
-        self.env_action_space: gym.spaces.Box = env.action_space
-        self.env_action_range = np.abs(self.env_action_space.low) + np.abs(self.env_action_space.high)
-        self.lateral_increment = self.env_action_range[0] / (lateral_bins - 1)
-        self.angular_increment = self.env_action_range[1] / (angular_bins - 1)
-        self.action_space = gym.spaces.Discrete(lateral_bins + angular_bins, seed=seed)
-        self.last_action = np.array([0, 0])
-
-    def action(self, action: WrapperActType) -> ActType:
-        current_action = self._unwrap_discrete_action(action)
-        self.last_action = current_action
-        return current_action
-
-    def _unwrap_discrete_action(self, action: WrapperActType) -> ActType:
-        if action < self.lateral_bins:
-            return np.array([
-                self.env_action_space.low[0] + (action * self.lateral_increment),
-                self.last_action[1]]  # Keep the last angular action
-            )
-        action -= self.lateral_bins
-        return np.array([
-            self.last_action[0],  # Keep the last lateral action
-            self.env_action_space.low[1] + (action * self.angular_increment)]
-        )
 
+def discrete_action_table(action_space: gym.spaces.Box, lateral_bins: int,
+                          angular_bins: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lookup tables of the discrete action space, in which an action sets the control of a single actuator. Per rod, the
+    first ``lateral_bins`` actions move the rod laterally, the next ``angular_bins`` actions rotate it.
 
-class MultiDiscreteActionWrapper(ActionWrapper):
+    :return: The actuator and its control value per discrete action
+    """
+    actuator_values = discretize_actuators(action_space, lateral_bins, angular_bins)
+    actuators = np.concatenate([np.full(len(values), actuator) for actuator, values in enumerate(actuator_values)])
+    return actuators, np.concatenate(actuator_values)
 
-    def __init__(self, env: gym.Env, seed: int = 1, lateral_bins: int = 3, angular_bins: int = 3):
-        super().__init__(env)
-        self.lateral_bins = lateral_bins
-        self.angular_bins = angular_bins
-        self.env_action_space: gym.spaces.Box = env.action_space
-        self.env_action_range = np.abs(self.env_action_space.low) + np.abs(self.env_action_space.high)
-        self.lateral_increment = np.sum(self.env_action_range, axis=0) / (lateral_bins - 1)
-        self.angular_increment = np.sum(self.env_action_range, axis=1) / (angular_bins - 1)
-        self.action_space = gym.spaces.MultiDiscrete([self.lateral_bins, self.angular_bins], seed=seed)
 
-    def action(self, action: WrapperActType) -> ActType:
-        return self._unwrap_multi_discrete_action(action)
+def multi_discrete_action_table(action_space: gym.spaces.Box, lateral_bins: int, angular_bins: int) -> np.ndarray:
+    """
+    Lookup table of the multi-discrete action space, in which an action holds one bin per actuator.
 
-    def _unwrap_multi_discrete_action(self, action: WrapperActType) -> ActType:
-        return np.array([
-            self.env_action_space.low[0] + (action[0] * self.lateral_increment),
-            self.env_action_space.low[1] + (action[1] * self.angular_increment)
-        ])
+    :return: The control values, indexed by actuator and bin. Actuators with fewer bins are padded with their upper
+        bound
+    """
+    actuator_values = discretize_actuators(action_space, lateral_bins, angular_bins)
+    table = np.tile(action_space.high[:, None], (1, max(lateral_bins, angular_bins)))
+    for actuator, values in enumerate(actuator_values):
+        table[actuator, :len(values)] = values
+    return table
@@ -1,9 +1,17 @@
-from typing import Callable, Dict
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Optional
 
+import gymnasium as gym
 import numpy as np
-from stable_baselines3.common.vec_env import VecEnv, VecEnvWrapper
+from stable_baselines3.common.vec_env import VecEnv, VecEnvWrapper, VecVideoRecorder
 from stable_baselines3.common.vec_env.base_vec_env import VecEnvStepReturn, VecEnvObs
 from foosball_rl.environments.common.constants import WHITE_GOAL_X_POSITION
+from foosball_rl.environments.common.wrappers.action_space_wrappers import check_action_space, \
+    discrete_action_table, multi_discrete_action_table
+
+logger = logging.getLogger(__name__)
 
 WHITE_GOAL_X_Y_COORDINATES = np.array([WHITE_GOAL_X_POSITION, 0])
 
@@ -56,5 +64,234 @@ class VecPBRSWrapper(VecEnvWrapper):
         current_potentials = self.potential(obs) if not isinstance(obs, Dict) else self.potential(obs['observation'])
         potential_differences = self.gamma * current_potentials - self.last_potentials
         self.last_potentials = current_potentials
-        rewards += potential_differences
+        # Backends stacking the rewards of the envs (e.g. SubprocVecEnv) return the integer rewards of the RawEnvs
+        rewards = (rewards + potential_differences).astype(np.float32)
+        return obs, rewards, dones, infos
+
+
+class VecAddActionToObservationsWrapper(VecEnvWrapper):
+    """
+    Vectorized counterpart of ``AddActionToObservationsWrapper`` for vectorized environments that do not apply gym
+    wrappers to their sub-environments (e.g. ``MujocoBatchedVecEnv``). Appends the last performed actions to the
+    observations, environments that were reset in the current step get zeros instead.
+    """
+    def __init__(self, venv: VecEnv):
+        original_observation_space = venv.observation_space
+        self.action_dim = int(np.sum(venv.action_space.shape)) if venv.action_space.shape != () else 1
+        low = np.concatenate((original_observation_space.low, -np.inf * np.ones(self.action_dim)),
+                             dtype=original_observation_space.dtype)
+        high = np.concatenate((original_observation_space.high, np.inf * np.ones(self.action_dim)),
+                              dtype=original_observation_space.dtype)
+        observation_space = gym.spaces.Box(low=low, high=high, dtype=original_observation_space.dtype)
+        VecEnvWrapper.__init__(self, venv, observation_space, venv.action_space)
+        self.actions = np.zeros((self.num_envs, self.action_dim), dtype=observation_space.dtype)
+
+    def reset(self) -> VecEnvObs:
+        obs = self.venv.reset()
+        return np.concatenate([obs, np.zeros((self.num_envs, self.action_dim), dtype=obs.dtype)], axis=1)
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self.actions = np.asarray(actions).reshape(self.num_envs, self.action_dim)
+        self.venv.step_async(actions)
+
+    def step_wait(self) -> VecEnvStepReturn:
+        obs, rewards, dones, infos = self.venv.step_wait()
+        actions = self.actions.astype(obs.dtype)
+        for env_idx in np.flatnonzero(dones):
+            infos[env_idx]["terminal_observation"] = np.concatenate([infos[env_idx]["terminal_observation"],
+                                                                     actions[env_idx]])
+        actions[dones] = 0
+        return np.concatenate([obs, actions], axis=1), rewards, dones, infos
+
+
+def get_vec_action_space_wrapper(venv: VecEnv, action_space_wrapper_conf: Dict[str, Any]) -> VecEnv:
+    """Wraps ``venv`` with the configured action space wrapper, discretizing the actions of all environments at once."""
+    action_space = check_action_space(action_space_wrapper_conf)
+    if action_space == 'continuous':
+        logger.info("Env already has a continuous action space, won't wrap with any action space wrapper")
+        return venv
+    wrapper_cls = VecDiscreteActionWrapper if action_space == 'discrete' else VecMultiDiscreteActionWrapper
+    return wrapper_cls(venv=venv, lateral_bins=action_space_wrapper_conf['lateral_bins'],
+                       angular_bins=action_space_wrapper_conf['angular_bins'])
+
+
+class VecDiscreteActionWrapper(VecEnvWrapper):
+    """
+    Discretizes the continuous action space of the environments, see ``discrete_action_table``: an action sets the
+    control of a single actuator, the other actuators keep their last control. The ``(n_envs,)`` discrete actions are
+    converted to the continuous controls of all environments with one lookup in the precomputed tables, the last
+    controls of the environments are kept in one array, whose rows are reset to zero when the environments are reset.
+    """
+    def __init__(self, venv: VecEnv, lateral_bins: int = 3, angular_bins: int = 3):
+        self._actuators, self._values = discrete_action_table(venv.action_space, lateral_bins, angular_bins)
+        VecEnvWrapper.__init__(self, venv, action_space=gym.spaces.Discrete(len(self._values)))
+        self._env_indices = np.arange(self.num_envs)
+        self.last_actions = np.zeros((self.num_envs, *venv.action_space.shape), dtype=venv.action_space.dtype)
+
+    def reset(self) -> VecEnvObs:
+        self.last_actions[:] = 0
+        return self.venv.reset()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        actions = np.asarray(actions).reshape(self.num_envs)
+        self.last_actions[self._env_indices, self._actuators[actions]] = self._values[actions]
+        # The vec env may keep the actions until step_wait, in which the rows of reset environments are cleared
+        self.venv.step_async(self.last_actions.copy())
+
+    def step_wait(self) -> VecEnvStepReturn:
+        obs, rewards, dones, infos = self.venv.step_wait()
+        self.last_actions[dones] = 0
+        return obs, rewards, dones, infos
+
+
+class VecMultiDiscreteActionWrapper(VecEnvWrapper):
+    """
+    Discretizes every actuator of the continuous action space of the environments, see
+    ``multi_discrete_action_table``. The ``(n_envs, n_actuators)`` bins are converted to the continuous controls of all
+    environments with one lookup in the precomputed table.
+    """
+    def __init__(self, venv: VecEnv, lateral_bins: int = 3, angular_bins: int = 3):
+        self._table = multi_discrete_action_table(venv.action_space, lateral_bins, angular_bins)
+        self._actuators = np.arange(len(self._table))
+        action_space = gym.spaces.MultiDiscrete([lateral_bins, angular_bins] * (len(self._table) // 2))
+        VecEnvWrapper.__init__(self, venv, action_space=action_space)
+
+    def reset(self) -> VecEnvObs:
+        return self.venv.reset()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        actions = np.asarray(actions).reshape(self.num_envs, len(self._actuators))
+        self.venv.step_async(self._table[self._actuators, actions])
+
+    def step_wait(self) -> VecEnvStepReturn:
+        return self.venv.step_wait()
+
+
+class AsyncVecVideoRecorder(VecVideoRecorder):
+    """
+    ``VecVideoRecorder`` that encodes the videos in a background thread instead of in ``step_wait``.
+
+    Only the encoding is moved off the training thread. While a video is recorded, every ``step_wait`` still renders
+    a frame synchronously (``venv.render``, which needs the current simulation state), and this rendering cost stays
+    on the hot path. The rendered frames are handed to a queue, from which the encoder thread streams them to ffmpeg
+    (which encodes in its own process). At most ``max_queued_frames`` frames are queued, frames captured while the
+    queue is full are dropped instead of stalling the rollout collection. Dropped frames still count towards
+    ``video_length``, so that every video covers the same number of steps. To take the rendering off the hot path as
+    well, record trajectories with the ``TrajectoryRecorderWrapper`` and render them after training.
+
+    :param venv: The vectorized environment, its ``render_mode`` must be ``rgb_array``
+    :param video_folder: Where to save the videos
+    :param record_video_trigger: Function of the current step, returning whether to start recording
+    :param video_length: Length of the recorded videos in steps
+    :param name_prefix: Prefix of the video names
+    :param max_queued_frames: Maximum number of frames waiting to be encoded
+    """
+
+    # Queue messages besides the video paths and frames
+    _END_OF_VIDEO = object()
+    _SHUTDOWN = object()
+
+    def __init__(self,
+                 venv: VecEnv,
+                 video_folder: str,
+                 record_video_trigger: Callable[[int], bool],
+                 video_length: int = 200,
+                 name_prefix: str = "rl-video",
+                 max_queued_frames: int = 256):
+        super().__init__(venv, video_folder, record_video_trigger, video_length, name_prefix)
+        self.max_queued_frames = max_queued_frames
+        self.n_video_frames = 0
+        self.n_dropped_frames = 0
+        # Control messages are never dropped, only frames are limited by the semaphore
+        self._queue: queue.Queue = queue.Queue()
+        self._frame_slots = threading.BoundedSemaphore(max_queued_frames)
+        self._encoder = threading.Thread(target=self._encode, name='VideoEncoder', daemon=True)
+        self._encoder.start()
+
+    def step_wait(self) -> VecEnvStepReturn:
+        obs, rewards, dones, infos = self.venv.step_wait()
+
+        self.step_id += 1
+        if self.recording:
+            self._capture_frame()
+            if self.n_video_frames > self.video_length:
+                self._stop_recording()
+        elif self._video_enabled():
+            self._start_video_recorder()
+
         return obs, rewards, dones, infos
+
+    def _start_recording(self) -> None:
+        super()._start_recording()
+        self.n_video_frames = 0
+        self.n_dropped_frames = 0
+        self._queue.put(self.video_path)
+
+    def _capture_frame(self) -> None:
+        assert self.recording, "Cannot capture a frame, recording wasn't started."
+
+        frame = self.env.render()
+        if not isinstance(frame, np.ndarray):
+            self._stop_recording()
+            logger.warning("Recording stopped: expected type of frame returned by render to be a numpy array, got "
+                           "instead %s.", type(frame))
+            return
+        self.n_video_frames += 1
+        # The rendered frame is a new array, it is handed over without a copy
+        if self._frame_slots.acquire(blocking=False):
+            self._queue.put(frame)
+        else:
+            self.n_dropped_frames += 1
+
+    def _stop_recording(self) -> None:
+        assert self.recording, "_stop_recording was called, but no recording was started"
+        self._queue.put(self._END_OF_VIDEO)
+        if self.n_dropped_frames > 0:
+            logger.warning("Dropped %s of %s frames of %s, the video encoder could not keep up",
+                           self.n_dropped_frames, self.n_video_frames, self.video_path)
+        self.recording = False
+
+    def close(self) -> None:
+        """Closes the wrapper, then waits until the queued frames are encoded."""
+        super().close()
+        self._queue.put(self._SHUTDOWN)
+        self._encoder.join()
+
+    def _encode(self) -> None:
+        from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+        video_path: Optional[str] = None
+        writer: Optional[FFMPEG_VideoWriter] = None
+        while True:
+            item = self._queue.get()
+            if isinstance(item, np.ndarray):
+                try:
+                    if writer is None and video_path is not None:
+                        height, width = item.shape[:2]
+                        writer = FFMPEG_VideoWriter(video_path, (width, height), fps=self.frames_per_sec)
+                    if writer is not None:
+                        writer.write_frame(item)
+                except OSError:
+                    logger.exception("Could not encode frame of %s, skipping the rest of the video", video_path)
+                    self._close_writer(writer)
+                    video_path, writer = None, None
+                finally:
+                    self._frame_slots.release()
+            elif item is self._END_OF_VIDEO or item is self._SHUTDOWN:
+                if writer is not None:
+                    self._close_writer(writer)
+                    logger.info("Saved video to %s", video_path)
+                video_path, writer = None, None
+                if item is self._SHUTDOWN:
+                    return
+            else:
+                video_path = item
+
+    @staticmethod
+    def _close_writer(writer) -> None:
+        if writer is None:
+            return
+        try:
+            writer.close()
+        except OSError:
+            logger.exception("Could not finish video")
@@ -1,6 +1,10 @@
+import itertools
 import logging
+import os
+import time
 from collections import OrderedDict
-from typing import Any, Optional, Dict
+from pathlib import Path
+from typing import Any, Optional, Dict, Sequence
 
 import gymnasium as gym
 import numpy as np
@@ -8,52 +12,80 @@ from gymnasium import spaces
 from gymnasium.core import WrapperActType, WrapperObsType
 
 from foosball_rl.environments.common.constants import WHITE_GOAL_X_POSITION
+from foosball_rl.environments.common.trajectory import TrajectoryWriter
 
 
-def compute_reward(achieved_goal: int | np.ndarray, desired_goal: int | np.ndarray,
-                   _info: Optional[Dict[str, Any]]) -> np.float32:
-    # As we are using a vectorized version, we need to keep track of the `batch_size`
-    if isinstance(achieved_goal, int):
-        batch_size = 1
-    else:
-        batch_size = achieved_goal.shape[0] if len(achieved_goal.shape) > 1 else 1
+def compute_reward(achieved_goal: np.ndarray, desired_goal: np.ndarray, _info: Any) -> np.ndarray:
+    """
+    The negative euclidean distance between the achieved and the desired goal features, e.g. the ball position and
+    the center of the white goal.
 
-    reshaped_achieved_goal = np.array(achieved_goal).reshape(batch_size, -1)
-    reshaped_desired_goal = np.array(desired_goal).reshape(batch_size, -1)
-    achieved_ball_pos = reshaped_achieved_goal[:, 0:2]
-    desired_ball_pos = reshaped_desired_goal[:, 0:2]
-
-    return -np.linalg.norm(achieved_ball_pos - desired_ball_pos, axis=-1)
+    Vectorized over any leading batch dimensions: goals of shape (n_goal_features,) give a scalar, goals of shape
+    (batch_size, n_goal_features) (e.g. when relabeling a batch of transitions with Hindsight Experience Replay) give
+    an array of shape (batch_size,). The infos are not used.
+    """
+    difference = np.subtract(achieved_goal, desired_goal)
+    return -np.sqrt(np.einsum('...i,...i->...', difference, difference))
 
 
 class GoalEnvWrapper(gym.Wrapper):
+    """
+    Turns the observations into the dictionaries of the ``GoalEnv`` interface for Hindsight Experience Replay
+    (``HerReplayBuffer``). The goals only hold the goal features of the observation, ``goal_indices``, by default the
+    x and y position of the ball (the first two features of the goalkeeper and foosball observations). The desired goal
+    defaults to the center of the white goal, where the ball should ideally be from the perspective of the black team.
+
+    The observation of the wrapped environment is passed on without copying it, the achieved goal is a copy of the
+    goal features and the desired goal is a read-only array shared by all steps.
 
-    def __init__(self, env: gym.Env):
+    :param env: The environment to wrap
+    :param goal_indices: The indices of the goal features in the observation
+    :param desired_goal: The desired values of the goal features, required if ``goal_indices`` are not the ball
+        position
+    """
+
+    def __init__(self,
+                 env: gym.Env,
+                 goal_indices: Sequence[int] = (0, 1),
+                 desired_goal: Optional[Sequence[float]] = None):
         super().__init__(env)
         self.logger = logging.getLogger(self.__class__.__name__)
         self.original_observation_space = env.observation_space
+        self.goal_indices = np.asarray(goal_indices, dtype=np.intp)
+        if desired_goal is None:
+            if tuple(goal_indices) != (0, 1):
+                raise ValueError(f"A desired goal is required for the goal features {list(goal_indices)}")
+            desired_goal = [WHITE_GOAL_X_POSITION, 0.0]
+        self.desired_goal = np.asarray(desired_goal, dtype=self.original_observation_space.dtype)
+        if self.desired_goal.shape != self.goal_indices.shape:
+            raise ValueError(f"The desired goal {list(desired_goal)} does not match the goal features "
+                             f"{list(goal_indices)}")
+        self.desired_goal.flags.writeable = False
         self.observation_space = self._make_observation_space()
-        self.desired_goal = np.zeros(self.original_observation_space.shape[0])
-        self.desired_goal[0:2] = np.array(
-            [WHITE_GOAL_X_POSITION, 0.0])  # Where the ball should ideally be from the perspective of the black team.
-        # The other dimensions are irrelevant as they are not used for the reward calculation
 
     def _make_observation_space(self) -> gym.Space:
+        goal_space = spaces.Box(low=self.original_observation_space.low[self.goal_indices],
+                                high=self.original_observation_space.high[self.goal_indices],
+                                dtype=self.original_observation_space.dtype)
         return spaces.Dict({
             "observation": self.original_observation_space,
-            "achieved_goal": self.original_observation_space,
-            "desired_goal": self.original_observation_space,
+            "achieved_goal": goal_space,
+            "desired_goal": goal_space,
         })
 
     def _get_obs(self, obs: WrapperObsType):
         return OrderedDict(
             [
-                ("observation", obs.copy()),
-                ("achieved_goal", obs.copy()),
-                ("desired_goal", self.desired_goal.copy()),
+                ("observation", obs),
+                ("achieved_goal", obs[self.goal_indices]),
+                ("desired_goal", self.desired_goal),
             ]
         )
 
+    def compute_reward(self, achieved_goal: np.ndarray, desired_goal: np.ndarray, info: Any) -> np.ndarray:
+        """Called by the ``HerReplayBuffer`` to compute the rewards of relabeled transitions, see ``compute_reward``."""
+        return compute_reward(achieved_goal, desired_goal, info)
+
     def reset(self, *, seed: int = None, options: dict[str, Any] = None) -> tuple[WrapperObsType, dict[str, Any]]:
         obs, info = self.env.reset(seed=seed, options=options)
         return self._get_obs(obs), info
@@ -61,6 +93,67 @@ class GoalEnvWrapper(gym.Wrapper):
     def step(self, action: WrapperActType):
         obs, reward, terminated, truncated, info = self.env.step(action)
         obs = self._get_obs(obs)
-        reward += float(compute_reward(obs["achieved_goal"], obs["desired_goal"], info).item())
+        reward += float(compute_reward(obs["achieved_goal"], self.desired_goal, info))
+        return obs, reward, terminated, truncated, info
+
+
+class TrajectoryRecorderWrapper(gym.Wrapper):
+    """
+    Records the state (time, qpos, qvel, ctrl) of every ``episode_interval``-th episode to a trajectory file in
+    ``trajectory_dir`` (see ``trajectory.py``), from which videos are rendered after training with the ``render``
+    execution mode. Recording a step copies a few hundred bytes into a buffer, instead of rendering a frame.
+
+    The file is named ``<name_prefix>-trajectory-seed-<seed>-<creation ms>`` after the seed of the first reset (the
+    vectorized environments seed their i-th env with ``seed + i``), or after the process and a counter instead of the
+    seed if it has no seed. Existing files are never overwritten, a name collision raises a ``FileExistsError``.
+
+    :param name_prefix: Role of the recorded environment, e.g. ``train`` or ``eval``
+    """
+    _instance_counter = itertools.count()
+
+    def __init__(self, env: gym.Env, trajectory_dir: Path, episode_interval: int = 100, chunk_size: int = 256,
+                 name_prefix: str = 'train'):
+        super().__init__(env)
+        self.trajectory_dir = trajectory_dir
+        self.episode_interval = episode_interval
+        self.chunk_size = chunk_size
+        self.name_prefix = name_prefix
+        self._instance_id = next(self._instance_counter)
+        # Separates the files of runs writing to the same directory, e.g. of a resumed training
+        self._created_ms = round(time.time() * 1000)
+        self._raw_env = env.unwrapped
+        self._writer: Optional[TrajectoryWriter] = None
+        self._file_name: Optional[str] = None
+        self._episode = -1
+        self._recording = False
+
+    def reset(self, *, seed: Optional[int] = None, options: Optional[Dict[str, Any]] = None):
+        if self._recording:
+            self._writer.end_episode()
+        obs, info = self.env.reset(seed=seed, options=options)
+        if self._file_name is None:
+            env_name = f'seed-{seed}' if seed is not None else f'{os.getpid()}-{self._instance_id}'
+            self._file_name = f'{self.name_prefix}-trajectory-{env_name}-{self._created_ms}'
+        self._episode += 1
+        self._recording = self._episode % self.episode_interval == 0
+        if self._recording:
+            if self._writer is None:
+                self._writer = TrajectoryWriter(self.trajectory_dir / self._file_name, self._raw_env.mj_model,
+                                                env_id=self.spec.id if self.spec is not None else None,
+                                                dt=self._raw_env.dt, chunk_size=self.chunk_size)
+            self._writer.begin_episode(self._raw_env.mj_data)
+        return obs, info
+
+    def step(self, action: WrapperActType):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        if self._recording:
+            self._writer.record(self._raw_env.mj_data)
+            if terminated or truncated:
+                self._writer.end_episode()
+                self._recording = False
         return obs, reward, terminated, truncated, info
 
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        super().close()
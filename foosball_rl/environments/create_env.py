@@ -1,32 +1,62 @@
+from functools import partial
 from pathlib import Path
 from typing import Optional
 
 from stable_baselines3.common.type_aliases import GymEnv
-from stable_baselines3.common.vec_env import unwrap_vec_wrapper
+from stable_baselines3.common.vec_env import unwrap_vec_wrapper, VecMonitor, SubprocVecEnv
 from stable_baselines3.common.vec_env.vec_normalize import VecNormalize
 
 import logging
+from foosball_rl.environments.common.batched_vec_env import make_batched_vec_env
+from foosball_rl.environments.common.perf_counters import instrument_vec_env
 from foosball_rl.environments.common.register_env import make_vec_env
+from foosball_rl.environments.common.shared_memory_vec_env import SharedMemoryVecEnv
+from foosball_rl.environments.common.worker_context import configure_forkserver_preload
 from foosball_rl.wrappers.wrapper_configuration import apply_vec_env_wrappers, apply_env_wrappers, \
-    get_applied_vecenv_wrappers, get_applied_gym_wrappers
+    get_applied_vecenv_wrappers, get_applied_gym_wrappers, apply_batched_env_wrappers, get_trajectory_path
 
 logger = logging.getLogger(__name__)
 
 
-def create_envs(env_id: str, n_envs: int, seed: int, video_logging_path: Optional[Path], vec_normalize_path: str) -> GymEnv:
-    venv = make_vec_env(env_id, n_envs, seed, wrapper_class=apply_env_wrappers)
+def create_envs(env_id: str, n_envs: int, seed: int, video_logging_path: Optional[Path], vec_normalize_path: str,
+                vec_env_backend: str = 'dummy', n_env_workers: Optional[int] = None,
+                env_role: str = 'train') -> GymEnv:
+    """
+    :param n_env_workers: Number of worker processes (``shared_memory``) or threads (``batched``) stepping the
+        environments, defaults to one per core. The ``dummy`` and ``subproc`` backends ignore it
+    :param env_role: ``train`` or ``eval``, part of the names of the recorded trajectories
+    """
+    env_wrappers = partial(apply_env_wrappers, trajectory_path=get_trajectory_path(seed, video_logging_path),
+                           env_role=env_role)
+    if vec_env_backend == 'dummy':
+        venv = make_vec_env(env_id, n_envs, seed, wrapper_class=env_wrappers)
+    elif vec_env_backend == 'subproc':
+        configure_forkserver_preload()
+        venv = make_vec_env(env_id, n_envs, seed, wrapper_class=env_wrappers, vec_env_cls=SubprocVecEnv)
+    elif vec_env_backend == 'shared_memory':
+        venv = make_vec_env(env_id, n_envs, seed, wrapper_class=env_wrappers, vec_env_cls=SharedMemoryVecEnv,
+                            vec_env_kwargs={'n_workers': n_env_workers})
+    elif vec_env_backend == 'batched':
+        venv = make_batched_vec_env(env_id, n_envs, seed, n_threads=n_env_workers)
+        venv = VecMonitor(venv)
+        venv = apply_batched_env_wrappers(venv)
+    else:
+        raise ValueError(f"Unknown vec env backend: {vec_env_backend}")
     venv = apply_vec_env_wrappers(venv, seed, vec_normalize_path, video_logging_path)
+    venv = instrument_vec_env(venv)
 
-    logger.info("Used Gym Wrappers: %s", get_applied_gym_wrappers(venv.unwrapped.envs[0]))
+    logger.info("Used Gym Wrappers: %s", get_applied_gym_wrappers(venv))
     logger.info("Used VecEnv Wrappers: %s", get_applied_vecenv_wrappers(venv))
 
     venv.seed(seed)
     return venv
 
 
-def create_eval_envs(env_id: str, n_eval_envs: int, seed: int, video_logging_path: Optional[Path], vec_normalize_path: str = None) -> GymEnv:
+def create_eval_envs(env_id: str, n_eval_envs: int, seed: int, video_logging_path: Optional[Path], vec_normalize_path: str = None,
+                     vec_env_backend: str = 'dummy') -> GymEnv:
     logging.info("Eval envs: Creating %s %s eval envs with seed %s", n_eval_envs, env_id, seed)
-    venv = create_envs(env_id, n_eval_envs, seed, video_logging_path, vec_normalize_path)
+    venv = create_envs(env_id, n_eval_envs, seed, video_logging_path, vec_normalize_path, vec_env_backend,
+                       env_role='eval')
     vec_normalize = unwrap_vec_wrapper(venv, VecNormalize)
     vec_normalize.training = False
     vec_normalize.norm_reward = False
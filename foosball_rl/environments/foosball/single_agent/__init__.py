@@ -9,7 +9,7 @@ with open(Path(__file__).parent / 'foosball-config.yml') as f:
     env_cfg = yaml.safe_load(f)
 
 episode_definition_cfg = env_cfg['EpisodeDefinition']
-episode_definition = FoosballEpisodeDefinition()
+episode_definition_factory = FoosballEpisodeDefinition
 
 foosball_id = 'Foosball-v0'
 
@@ -19,8 +19,12 @@ gym.register(
     max_episode_steps=env_cfg['Environment']['horizon'],
     kwargs={
         'step_frequency': env_cfg['Environment']['step_frequency'],
+        'action_repeat_mode': env_cfg['Environment']['action_repeat_mode'],
+        'reuse_step_buffers': env_cfg['Environment']['reuse_step_buffers'],
         'render_mode': env_cfg['Environment']['render_mode'],
-        'episode_definition': episode_definition,
+        'use_image_obs': env_cfg['Environment']['use_image_obs'],
+        'image_observation_config': env_cfg['ImageObservation'],
+        'episode_definition_factory': episode_definition_factory,
         'env_config': env_cfg
     }
 )
@@ -3,7 +3,7 @@ import numpy as np
 from foosball_rl.environments.common.base_episode_definition import EpisodeDefinition
 from foosball_rl.environments.common.constants import FIELD_HEIGHT
 from foosball_rl.environments.common.constraints import ball_outside_table, ball_in_black_goal_bounds, \
-    ball_in_white_goal_bounds
+    ball_in_white_goal_bounds, batch_ball_outside_table
 
 
 class FoosballEpisodeDefinition(EpisodeDefinition):
@@ -30,9 +30,14 @@ class FoosballEpisodeDefinition(EpisodeDefinition):
         self.mj_data.qvel[:] = qvel
 
     def is_truncated(self) -> bool:
-        return ball_outside_table(self.mj_data.qpos[0:3].copy())
+        return ball_outside_table(self.ball_pos)
 
     def is_terminated(self) -> bool:
-        ball_pos = self.mj_data.qpos[0:3].copy()
-        return (self.mj_data.sensordata[0].copy() > 0 or ball_in_black_goal_bounds(ball_pos)) or (
-                    self.mj_data.sensordata[1].copy() > 0 or ball_in_white_goal_bounds(ball_pos))
+        return (self.sensordata[0] > 0 or ball_in_black_goal_bounds(self.ball_pos)) or (
+                    self.sensordata[1] > 0 or ball_in_white_goal_bounds(self.ball_pos))
+
+    def batch_is_truncated(self, ball_pos: np.ndarray, ball_vel: np.ndarray, sim_time: np.ndarray) -> np.ndarray:
+        return batch_ball_outside_table(ball_pos)
+
+    def batch_is_terminated(self, black_conceded: np.ndarray, white_conceded: np.ndarray) -> np.ndarray:
+        return black_conceded | white_conceded
@@ -60,13 +60,18 @@ Meaning of qvel (velocities):
 """
 import logging
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Callable
 
 import gymnasium as gym
 import mujoco
 import numpy as np
 
+from foosball_rl.environments.common.action_repeat import ActionRepeatSimulator
+from foosball_rl.environments.common.image_observation import ImageObservation
+from foosball_rl.environments.common.model_cache import load_model
 from foosball_rl.environments.common.mujoco_viewer import MujocoViewer
+from foosball_rl.environments.common.perf_counters import PERF_COUNTERS, PerfSnapshot
+from foosball_rl.environments.common.renderer_pool import acquire_renderer, release_renderer
 from foosball_rl.environments.common.constraints import ball_in_black_goal_bounds, \
     ball_in_white_goal_bounds
 from foosball_rl.environments.foosball.single_agent.episode_definition import EpisodeDefinition, \
@@ -82,35 +87,66 @@ class RawEnv(gym.Env):
     }
     reward_range = (-1, 1)
     camera_id = "table_view"
+    render_height = 480
+    render_width = 640
+    observation_qpos_indices = slice(0, 3)  # Ball position
+    observation_sensor_indices = slice(2, 38)  # All sensors except the goal sensors
 
     def __init__(self,
                  step_frequency: int = 16,
                  render_mode: str = None,
                  use_image_obs: bool = False,
-                 episode_definition: EpisodeDefinition = None,
-                 env_config: Dict[str, Any] = None):
+                 episode_definition_factory: Callable[[], EpisodeDefinition] = None,
+                 env_config: Dict[str, Any] = None,
+                 mj_model: Optional[mujoco.MjModel] = None,
+                 action_repeat_mode: str = 'native',
+                 reuse_step_buffers: bool = False,
+                 image_observation_config: Optional[Dict[str, Any]] = None):
         super().__init__()
         self.logger = logging.getLogger(self.__class__.__name__)
         self._env_config = env_config
         self.render_mode = render_mode
         self.use_image_obs = use_image_obs
-        if self.use_image_obs:
-            assert self.render_mode == "rgb_array", "Image observations are only supported with render_mode='rgb_array'"
-        self.episode_definition = episode_definition if episode_definition is not None else FoosballEpisodeDefinition()
-
-        xml_path = (Path(__file__).parent.parent / 'foosball.xml').as_posix()
-        self._mj_model: mujoco.MjModel = mujoco.MjModel.from_xml_path(xml_path)
+        # Observations and infos are written into buffers reused across steps, they are only valid until the next step
+        self.reuse_step_buffers = reuse_step_buffers
+        # Every env builds its own episode definition, so that no state (mj_data, rng) is shared between envs
+        if episode_definition_factory is None:
+            episode_definition_factory = FoosballEpisodeDefinition
+        self.episode_definition: EpisodeDefinition = episode_definition_factory()
+
+        if mj_model is None:
+            mj_model = load_model(Path(__file__).parent.parent / 'foosball.xml')
+        self._mj_model: mujoco.MjModel = mj_model
         self._mj_data: mujoco.MjData = mujoco.MjData(self.mj_model)
         self.episode_definition.mj_data = self.mj_data
 
         self.nr_substeps = 1
         self.nr_intermediate_steps = step_frequency
         self.dt = self.mj_model.opt.timestep * self.nr_substeps * self.nr_intermediate_steps
-
-        self.renderer = self._initialize_renderer()
+        self.simulator = ActionRepeatSimulator(self.mj_model, self.mj_data,
+                                               nr_steps=self.nr_substeps * self.nr_intermediate_steps,
+                                               mode=action_repeat_mode)
+        self.episode_definition.sensor_samples = self.simulator.sensor_samples
+
+        # Created on the first render, so that envs that are never rendered do not create a GL context
+        self._renderer = None
+        # Image observations are rendered with their own renderer, independent of the render mode
+        self.image_observation: Optional[ImageObservation] = None
+        if self.use_image_obs:
+            self.image_observation = ImageObservation(self.mj_model, **(image_observation_config or {}))
+        self._obs_buffers: Optional[list[np.ndarray]] = None
+        self._info: Dict[str, Any] = {}
 
         self.action_space = self._initialize_action_space()
         self.observation_space = self._initialize_observation_space()
+        if self.reuse_step_buffers and not self.use_image_obs:
+            # Double buffered, every reset switches the buffer, so that the terminal observation of an episode is not
+            # overwritten by the observation of the following reset
+            self._obs_buffers = [np.zeros(self.observation_space.shape, dtype=np.float32) for _ in range(2)]
+            n_obs_qpos = len(range(self.mj_model.nq)[self.observation_qpos_indices])
+            self._obs_buffer_parts = [(buffer[:n_obs_qpos], buffer[n_obs_qpos:]) for buffer in self._obs_buffers]
+            self._active_obs_buffer = 0
+            self._cache_obs_views()
 
         self._log_initialization()
 
@@ -123,7 +159,7 @@ class RawEnv(gym.Env):
         if self.render_mode == "human":
             return MujocoViewer(self.mj_model, self.mj_data, self.dt)
         elif self.render_mode == "rgb_array":
-            return mujoco.Renderer(self.mj_model, height=480, width=640)
+            return acquire_renderer(self.mj_model, height=self.render_height, width=self.render_width)
 
     def _initialize_action_space(self, seed=None):
         action_bounds = self.mj_model.actuator_ctrlrange.copy().astype(np.float32)
@@ -132,39 +168,51 @@ class RawEnv(gym.Env):
 
     def _initialize_observation_space(self):
         if self.use_image_obs:
-            return gym.spaces.Box(low=0, high=255, shape=self.render().shape, dtype=np.uint8)
+            return self.image_observation.observation_space
         else:
             return gym.spaces.Box(low=-np.inf, high=np.inf, shape=self._feature_vector_obs().shape, dtype=np.float32)
 
     def reset(self, seed=None, options=None):
         if seed is not None:
             self.logger.info("Setting seed to %s", seed)
-            self._initialize_action_space(seed=seed)
-            self.episode_definition.seed(seed=seed)
+            # Independent streams for the episode definition and the action space, derived from one SeedSequence
+            episode_seed_sequence, action_space_seed_sequence = np.random.SeedSequence(seed).spawn(2)
+            self.episode_definition.seed(seed=episode_seed_sequence)
+            self.action_space.seed(int(action_space_seed_sequence.generate_state(1)[0]))
             super().reset(seed=seed)
+        if options is not None and options.get('reset_simulation', False):
+            # Starts from the initial state of the model instead of the state the last episode ended in
+            mujoco.mj_resetData(self.mj_model, self.mj_data)
 
         self.episode_definition.initialize_episode()
+        if self._obs_buffers is not None:
+            self._active_obs_buffer ^= 1
 
         mujoco.mj_forward(self.mj_model, self.mj_data)
 
         if self.render_mode == "human":
             self.render()
 
+        if self.use_image_obs:
+            return self.image_observation.reset(self.mj_data), {}
         return self.get_observation(), {}
 
     def step(self, actions) -> tuple[gym.core.ObsType, float, bool, bool, dict[str, Any]]:
-        mj_ctrl = np.concatenate([np.array(a) for a in actions.values()]).reshape(16)
-        for _ in range(self.nr_intermediate_steps):
-            self.mj_data.ctrl = mj_ctrl
-            mujoco.mj_step(self.mj_model, self.mj_data, self.nr_substeps)
+        if isinstance(actions, dict):
+            actions = np.concatenate([np.asarray(a) for a in actions.values()])
+        perf_start = PERF_COUNTERS.start()
+        self.simulator.step(actions)
+        PERF_COUNTERS.stop('env/physics', perf_start)
 
+        perf_start = PERF_COUNTERS.start()
         next_state = self.get_observation()
-        reward, reward_info = self._get_reward()
+        PERF_COUNTERS.stop('env/observation', perf_start)
 
+        perf_start = PERF_COUNTERS.start()
+        reward, info = self._get_reward()
         terminated = self.episode_definition.is_terminated()
         truncated = self.episode_definition.is_truncated()
-
-        info = {**reward_info}
+        PERF_COUNTERS.stop('env/reward_and_termination', perf_start)
 
         if terminated or truncated:
             info["terminal_observation"] = next_state
@@ -176,15 +224,15 @@ class RawEnv(gym.Env):
 
     def get_observation(self):
         if self.use_image_obs:
-            return self.render()
+            return self.image_observation.observe(self.mj_data)
         else:
             return self._feature_vector_obs()
 
     def _get_reward(self):
-        ball_pos = self.mj_data.qpos[0:3].copy()
+        ball_pos = self.episode_definition.ball_pos
 
-        black_conceded = self.mj_data.sensordata[0].copy() > 0 or ball_in_black_goal_bounds(ball_pos)
-        white_conceded = self.mj_data.sensordata[1].copy() > 0 or ball_in_white_goal_bounds(ball_pos)
+        black_conceded = bool(self.episode_definition.sensordata[0] > 0 or ball_in_black_goal_bounds(ball_pos))
+        white_conceded = bool(self.episode_definition.sensordata[1] > 0 or ball_in_white_goal_bounds(ball_pos))
 
         assert not (black_conceded and white_conceded)
 
@@ -195,10 +243,14 @@ class RawEnv(gym.Env):
         elif white_conceded:
             reward = 1
 
-        info = {
-            "black_conceded": black_conceded,
-            "white_conceded": white_conceded
-        }
+        if self.reuse_step_buffers:
+            info = self._info
+            # Drop the keys added by wrappers or vec envs on the previous step, keeping the fixed layout
+            info.clear()
+        else:
+            info = {}
+        info["black_conceded"] = black_conceded
+        info["white_conceded"] = white_conceded
 
         return reward, info
 
@@ -211,16 +263,56 @@ class RawEnv(gym.Env):
             return self.renderer.render().copy()
 
     def _feature_vector_obs(self):
-        sensors_wo_goals = self.mj_data.sensordata[2:38]
-
-        return np.concatenate([
-            self.mj_data.qpos[0:3].copy(),
-            sensors_wo_goals.copy()
-        ]).astype(np.float32)
+        if self._obs_buffers is None:
+            sensors_wo_goals = self.mj_data.sensordata[self.observation_sensor_indices]
+            return np.concatenate([
+                self.mj_data.qpos[self.observation_qpos_indices],
+                sensors_wo_goals
+            ], dtype=np.float32)
+        qpos_part, sensor_part = self._obs_buffer_parts[self._active_obs_buffer]
+        np.copyto(qpos_part, self._obs_qpos_view, casting='same_kind')
+        np.copyto(sensor_part, self._obs_sensor_view, casting='same_kind')
+        return self._obs_buffers[self._active_obs_buffer]
+
+    def _cache_obs_views(self):
+        self._obs_qpos_view = self.mj_data.qpos[self.observation_qpos_indices]
+        self._obs_sensor_view = self.mj_data.sensordata[self.observation_sensor_indices]
+
+    def pop_perf_counters(self) -> PerfSnapshot:
+        """Returns and resets the perf counters of the process the environment runs in."""
+        return PERF_COUNTERS.pop()
+
+    def get_rng_state(self) -> Dict[str, Any]:
+        """
+        Returns the states of the random number generators of the environment, its action space and its episode
+        definition, e.g. to continue the same sequence of episodes when resuming a training.
+        """
+        return {'env': self.np_random.bit_generator.state,
+                'action_space': self.action_space.np_random.bit_generator.state,
+                'episode_definition': self.episode_definition.np_random.bit_generator.state}
+
+    def set_rng_state(self, state: Dict[str, Any]) -> None:
+        """Restores the random number generator states returned by ``get_rng_state``."""
+        self.np_random.bit_generator.state = state['env']
+        self.action_space.np_random.bit_generator.state = state['action_space']
+        self.episode_definition.np_random.bit_generator.state = state['episode_definition']
 
     def close(self):
-        if self.renderer is not None:
-            self.renderer.close()
+        self.simulator.close()
+        if self.image_observation is not None:
+            self.image_observation.close()
+        if self._renderer is not None:
+            if self.render_mode == "rgb_array":
+                release_renderer(self._renderer)
+            else:
+                self._renderer.close()
+            self._renderer = None
+
+    @property
+    def renderer(self):
+        if self._renderer is None:
+            self._renderer = self._initialize_renderer()
+        return self._renderer
 
     @property
     def mj_model(self) -> mujoco.MjModel:
@@ -233,6 +325,8 @@ class RawEnv(gym.Env):
     @mj_data.setter
     def mj_data(self, value) -> None:
         self._mj_data = value
+        if self._obs_buffers is not None:
+            self._cache_obs_views()
 
     @property
     def env_config(self) -> Dict[str, Any]:
@@ -1,3 +1,4 @@
+from functools import partial
 from pathlib import Path
 
 import gymnasium as gym
@@ -9,10 +10,13 @@ with open(Path(__file__).parent / 'goalkeeper-config.yml') as f:
     env_cfg = yaml.safe_load(f)
 
 episode_definition_cfg = env_cfg['EpisodeDefinition']
-episode_definition = GoalkeeperEpisodeDefinition(
+episode_definition_factory = partial(
+    GoalkeeperEpisodeDefinition,
     reset_goalie_position_on_episode_start=episode_definition_cfg['reset_goalie_position_on_episode_start'],
     end_episode_on_struck_goal=episode_definition_cfg['end_episode_on_struck_goal'],
-    end_episode_on_conceded_goal=episode_definition_cfg['end_episode_on_conceded_goal'])
+    end_episode_on_conceded_goal=episode_definition_cfg['end_episode_on_conceded_goal'],
+    end_episode_on_ball_stopped=episode_definition_cfg['end_episode_on_ball_stopped'],
+    ball_stopped_time_threshold_in_s=episode_definition_cfg['ball_stopped_time_threshold_in_s'])
 
 goalkeeper_id = 'Goalkeeper-v0'
 
@@ -22,9 +26,12 @@ gym.register(
     max_episode_steps=env_cfg['Environment']['horizon'],
     kwargs={
         'step_frequency': env_cfg['Environment']['step_frequency'],
+        'action_repeat_mode': env_cfg['Environment']['action_repeat_mode'],
+        'reuse_step_buffers': env_cfg['Environment']['reuse_step_buffers'],
         'render_mode': env_cfg['Environment']['render_mode'],
         'use_image_obs': env_cfg['Environment']['use_image_obs'],
-        'episode_definition': episode_definition,
+        'image_observation_config': env_cfg['ImageObservation'],
+        'episode_definition_factory': episode_definition_factory,
         'env_config': env_cfg
     }
 )
@@ -1,13 +1,14 @@
-import time
 from typing import Optional
 
 import numpy as np
 
+from foosball_rl.environments.common.ball_stopped_tracker import BallStoppedTracker
 from foosball_rl.environments.common.base_episode_definition import EpisodeDefinition
 from foosball_rl.environments.common.constants import PLAYER_BALL_DISTANCE_INCREMENT, WHITE_STRIKER_X_POSITION, \
     BLACK_GOAL_X_POSITION, FIELD_HEIGHT, ABS_GOAL_Y_SYMMETRIC_BOUND
 from foosball_rl.environments.common.constraints import ball_outside_table, ball_stopped, \
-    ball_outside_player_space, ball_in_black_goal_bounds, ball_in_white_goal_bounds
+    ball_outside_player_space, ball_in_black_goal_bounds, ball_in_white_goal_bounds, batch_ball_outside_table, \
+    batch_ball_stopped, batch_ball_outside_player_space
 
 
 class GoalkeeperEpisodeDefinition(EpisodeDefinition):
@@ -17,16 +18,18 @@ class GoalkeeperEpisodeDefinition(EpisodeDefinition):
                  end_episode_on_conceded_goal: bool = True,
                  reset_goalie_position_on_episode_start: bool = True,
                  end_episode_on_ball_stopped: bool = True,
-                 ball_stopped_time_threshold_in_s: float = 5):
+                 ball_stopped_time_threshold_in_s: Optional[float] = 5):
         super().__init__()
         self.end_episode_on_struck_goal: bool = end_episode_on_struck_goal
         self.end_episode_on_conceded_goal: bool = end_episode_on_conceded_goal
         self.reset_goalie_position_on_episode_start: bool = reset_goalie_position_on_episode_start
         self.end_episode_on_ball_stopped: bool = end_episode_on_ball_stopped
-        self.ball_stopped_time_threshold_in_s: float = ball_stopped_time_threshold_in_s
-        self._ball_stopped_since: Optional[float] = None
+        self.ball_stopped_time_threshold_in_s: Optional[float] = ball_stopped_time_threshold_in_s
+        self._ball_stopped_tracker = BallStoppedTracker()
+        self._batch_ball_stopped_tracker: Optional[BallStoppedTracker] = None
 
     def initialize_episode(self):
+        self._ball_stopped_tracker.reset()
         if self.reset_goalie_position_on_episode_start:
             qpos = np.zeros(self.mj_data.qpos.shape)
             qvel = np.zeros(self.mj_data.qvel.shape)
@@ -53,26 +56,48 @@ class GoalkeeperEpisodeDefinition(EpisodeDefinition):
         self.mj_data.qvel[:] = qvel
 
     def is_truncated(self) -> bool:
-        ball_position = self.mj_data.qpos[0:2].copy()
-        if ball_outside_table(ball_position):
+        if ball_outside_table(self.ball_pos):
             return True
-        ball_velocity = self.mj_data.qvel[0:2].copy()
-        self._ball_stopped_since = time.time() if ball_stopped(ball_velocity) else None
-        return self._ball_stopped_since is not None and ball_outside_player_space(ball_position, "b_g") or \
-                self.ball_stopped_exceeded_threshold()
+        is_stopped = ball_stopped(self.ball_planar_vel)
+        stopped_duration = self._ball_stopped_tracker.update_env(0, is_stopped, self.mj_data.time)
+        return bool(self.end_episode_on_ball_stopped and is_stopped and (
+                ball_outside_player_space(self.ball_pos, "b_g") or self._threshold_exceeded(stopped_duration)))
 
     def is_terminated(self) -> bool:
-        ball_pos = self.mj_data.qpos[0:3].copy()
         return ((self.end_episode_on_conceded_goal and
-                 (self.mj_data.sensordata[0].copy() > 0 or ball_in_black_goal_bounds(ball_pos)))
+                 (self.sensordata[0] > 0 or ball_in_black_goal_bounds(self.ball_pos)))
                 or
                 (self.end_episode_on_struck_goal and
-                 (self.mj_data.sensordata[1].copy() > 0 or ball_in_white_goal_bounds(ball_pos))))
+                 (self.sensordata[1] > 0 or ball_in_white_goal_bounds(self.ball_pos))))
+
+    def batch_is_truncated(self, ball_pos: np.ndarray, ball_vel: np.ndarray, sim_time: np.ndarray) -> np.ndarray:
+        outside_table = batch_ball_outside_table(ball_pos)
+        stopped = batch_ball_stopped(ball_vel)
+        if self._batch_ball_stopped_tracker is None:
+            self._batch_ball_stopped_tracker = BallStoppedTracker(len(stopped))
+        stopped_duration = self._batch_ball_stopped_tracker.update(stopped, sim_time)
+        return outside_table | (self.end_episode_on_ball_stopped & stopped &
+                                (batch_ball_outside_player_space(ball_pos, "b_g") |
+                                 self._threshold_exceeded(stopped_duration)))
+
+    def batch_reset(self, env_mask: np.ndarray) -> None:
+        if self._batch_ball_stopped_tracker is not None:
+            self._batch_ball_stopped_tracker.reset(env_mask)
+
+    def batch_is_terminated(self, black_conceded: np.ndarray, white_conceded: np.ndarray) -> np.ndarray:
+        return ((self.end_episode_on_conceded_goal & black_conceded) |
+                (self.end_episode_on_struck_goal & white_conceded))
 
     def ball_stopped_exceeded_threshold(self) -> bool:
-        return (self.end_episode_on_ball_stopped and
-                self._ball_stopped_since is not None and
-                time.time() - self._ball_stopped_since > self.ball_stopped_time_threshold_in_s)
+        stopped_since = self._ball_stopped_tracker.stopped_since[0]
+        return bool(self.end_episode_on_ball_stopped and
+                    not np.isnan(stopped_since) and
+                    self._threshold_exceeded(self.mj_data.time - stopped_since))
+
+    def _threshold_exceeded(self, stopped_duration):
+        if self.ball_stopped_time_threshold_in_s is None:
+            return np.zeros_like(stopped_duration, dtype=bool)
+        return stopped_duration > self.ball_stopped_time_threshold_in_s
 
     def _calculate_axis_velocities(self, x_start, y_start, x_target, y_target_range, velocity):
         """
@@ -1,10 +1,11 @@
 import logging
-from glob import glob
+import os
 from pathlib import Path
 from typing import Dict, Any
 
-import tensorboard_reducer as tbr
 from stable_baselines3.common.type_aliases import GymEnv
+from tensorboard.backend.event_processing.event_file_loader import LegacyEventFileLoader
+from tensorboard.summary.writer.record_writer import RecordWriter
 
 from foosball_rl import EXPERIMENT_NAME, EXECUTION_MODE, ENV_ID, RL_ALGORITHM
 from foosball_rl.callbacks.callback_configurator import CALLBACK_CONFIG
@@ -14,18 +15,23 @@ from foosball_rl.wrappers.wrapper_configuration import get_applied_gym_wrappers,
 logger = logging.getLogger(__name__)
 
 
-def aggregate_results(training_path) -> None:
-    tensorboard_path = training_path / 'tensorboard'
-    reduce_ops = ("mean", "min", "max", "median", "std", "var")
-    events_dict = tbr.load_tb_events(sorted(glob(tensorboard_path.__str__() + '/*')))
-    n_scalars = len(events_dict)
-    n_steps, n_events = list(events_dict.values())[0].shape
-    logger.info("Loaded %s TensorBoard runs with %s scalars and %s steps each", n_events, n_scalars, n_steps)
-    reduced_events = tbr.reduce_events(events_dict, reduce_ops)
-    output_path = tensorboard_path / "aggregates" / "operation"
-    for op in reduce_ops:
-        logger.debug("Writing \'%s\' reduction to \'%s-%s\'", op, output_path, op)
-    tbr.write_tb_events(reduced_events, output_path.__str__(), overwrite=False)
+def truncate_tensorboard_run(run_path: Path, max_step: int) -> None:
+    """
+    Removes the events after ``max_step`` from the event files of a TensorBoard run, e.g. the events logged after the
+    checkpoint a training is resumed from, which would otherwise be logged twice.
+    """
+    for event_file in sorted(run_path.glob('events.out.tfevents.*')):
+        events = list(LegacyEventFileLoader(str(event_file)).Load())
+        kept_events = [event for event in events if event.step <= max_step]
+        if len(kept_events) == len(events):
+            continue
+        tmp_path = event_file.with_name(f'.{event_file.name}.tmp')
+        with open(tmp_path, 'wb') as f:
+            writer = RecordWriter(f)
+            for event in kept_events:
+                writer.write(event.SerializeToString())
+        os.replace(tmp_path, event_file)
+        logger.info("Removed %s events after step %s from %s", len(events) - len(kept_events), max_step, event_file)
 
 
 def log_training_config(env: GymEnv, seed: int, save_path: Path, hyperparameter: Dict[str, Any]) -> None:
@@ -46,11 +52,11 @@ def log_training_config(env: GymEnv, seed: int, save_path: Path, hyperparameter:
             f.write(f'{k}: {v}\n')
         f.write('-' * 100 + '\n')
         f.write('Applied wrappers\n')
-        f.write(f'Gym Wrappers: {get_applied_gym_wrappers(env.unwrapped.envs[0])}\n')
+        f.write(f'Gym Wrappers: {get_applied_gym_wrappers(env)}\n')
         f.write(f'VecEnv Wrappers: {get_applied_vecenv_wrappers(env)}\n')
         f.write('-' * 100 + '\n')
         f.write('Environment Arguments\n')
-        env_cfg = env.unwrapped.envs[0].env_config
+        env_cfg = env.get_attr('env_config', indices=0)[0]
         for k, v in env_cfg.items():
             f.write(f'{k}: {v}\n')
         f.write('-' * 100 + '\n')
@@ -0,0 +1,141 @@
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from tensorboard.backend.event_processing.event_file_loader import LegacyEventFileLoader
+from torch.utils.tensorboard import SummaryWriter
+
+logger = logging.getLogger(__name__)
+
+AGGREGATES_DIR = 'aggregates'
+REDUCE_OPS = ('mean', 'min', 'max', 'std', 'var')
+
+
+class _RunningStatistics:
+    """Welford's online mean and variance, together with the minimum and maximum."""
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def reduce(self, op: str) -> float:
+        if op == 'var':
+            return self.m2 / self.count
+        if op == 'std':
+            return (self.m2 / self.count) ** 0.5
+        return getattr(self, op)
+
+
+class StreamingTensorboardAggregator:
+    """
+    Aggregates the scalars of the TensorBoard runs in ``tensorboard_path`` (e.g. the runs of the different seeds)
+    into one run per reduce op, ``<tensorboard_path>/aggregates/operation-<op>``.
+
+    The event files are read incrementally, every ``update`` only reads the events written since the last one, so the
+    aggregator can run while the training is still in progress. Only the statistics of the steps that are not yet
+    complete are kept in memory: a step of a scalar is written as soon as every run has logged it or has already
+    logged a later step of the scalar. ``close`` writes the remaining steps, which not all runs have reached.
+
+    The steps of a run are not necessarily monotonic, e.g. the ``AsyncEvalCallback`` dumps its results (and the values
+    recorded since the last dump) at the older timesteps of the evaluated snapshot. Late events of steps that are
+    still pending are merged into their statistics. Late events of steps that have already been written are dropped
+    (counted in ``n_dropped_events``), so that every step is written at most once per scalar.
+
+    :param tensorboard_path: The directory of the TensorBoard runs
+    :param n_runs: The number of runs to aggregate, runs that have not been started yet hold the aggregation back
+    :param reduce_ops: The statistics to write, a subset of ``REDUCE_OPS``
+    """
+
+    def __init__(self, tensorboard_path: Path, n_runs: int, reduce_ops: tuple = REDUCE_OPS):
+        self.tensorboard_path = tensorboard_path
+        self.n_runs = n_runs
+        self.reduce_ops = reduce_ops
+        self._loaders: Dict[Path, LegacyEventFileLoader] = {}
+        # run directory -> tag -> last logged step
+        self._last_steps: Dict[Path, Dict[str, int]] = defaultdict(dict)
+        # tag -> step -> statistics over the runs
+        self._pending: Dict[str, Dict[int, _RunningStatistics]] = defaultdict(dict)
+        # tag -> last written step
+        self._written_until: Dict[str, int] = {}
+        self._writers: Optional[Dict[str, SummaryWriter]] = None
+        self.n_written_steps = 0
+        self.n_dropped_events = 0
+
+    def update(self) -> None:
+        """Reads the new events of all runs and writes the steps that are complete now."""
+        for event_file in self._find_event_files():
+            if event_file not in self._loaders:
+                self._loaders[event_file] = LegacyEventFileLoader(str(event_file))
+            last_steps = self._last_steps[event_file.parent]
+            for event in self._loaders[event_file].Load():
+                for value in event.summary.value:
+                    if value.WhichOneof('value') != 'simple_value':
+                        continue
+                    if event.step <= self._written_until.get(value.tag, -1):
+                        self.n_dropped_events += 1
+                        continue
+                    statistics = self._pending[value.tag].get(event.step)
+                    if statistics is None:
+                        statistics = self._pending[value.tag][event.step] = _RunningStatistics()
+                    statistics.add(value.simple_value)
+                    last_steps[value.tag] = max(last_steps.get(value.tag, event.step), event.step)
+        self._write_complete_steps()
+
+    def close(self) -> None:
+        """Reads the remaining events and writes all steps, including the ones that not all runs have reached."""
+        self.update()
+        for tag, pending_steps in self._pending.items():
+            self._write_steps(tag, sorted(pending_steps), pending_steps)
+        self._pending.clear()
+        if self._writers is not None:
+            for writer in self._writers.values():
+                writer.close()
+        logger.info("Wrote %s aggregated steps of %s runs to %s", self.n_written_steps, len(self._last_steps),
+                    self.tensorboard_path / AGGREGATES_DIR)
+        if self.n_dropped_events > 0:
+            logger.info("Dropped %s events logged after their step had been written", self.n_dropped_events)
+
+    def _find_event_files(self) -> List[Path]:
+        return sorted(event_file for event_file in self.tensorboard_path.glob('*/events.out.tfevents.*')
+                      if event_file.parent.name != AGGREGATES_DIR)
+
+    def _write_complete_steps(self) -> None:
+        if len(self._last_steps) < self.n_runs:
+            return
+        for tag, pending_steps in self._pending.items():
+            last_steps = [run_last_steps.get(tag) for run_last_steps in self._last_steps.values()]
+            if None in last_steps:
+                continue
+            complete_until = min(last_steps)
+            complete_steps = sorted(step for step in pending_steps if step <= complete_until)
+            self._write_steps(tag, complete_steps, pending_steps)
+            for step in complete_steps:
+                del pending_steps[step]
+
+    def _write_steps(self, tag: str, steps: List[int], pending_steps: Dict[int, _RunningStatistics]) -> None:
+        if not steps:
+            return
+        if self._writers is None:
+            self._writers = {op: SummaryWriter(str(self.tensorboard_path / AGGREGATES_DIR / f'operation-{op}'))
+                             for op in self.reduce_ops}
+        for step in steps:
+            statistics = pending_steps[step]
+            for op, writer in self._writers.items():
+                writer.add_scalar(tag, statistics.reduce(op), step)
+        for writer in self._writers.values():
+            writer.flush()
+        self._written_until[tag] = max(self._written_until.get(tag, -1), steps[-1])
+        self.n_written_steps += len(steps)
@@ -1,59 +1,165 @@
+import glob
+import json
 import logging
+import os
+import pickle
+import re
 import time
 from collections import defaultdict
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
+import torch as th
 import yaml
-from stable_baselines3.common.evaluation import evaluate_policy
+from stable_baselines3.common.vec_env import unwrap_vec_normalize
 
 from foosball_rl import EXPERIMENT_NAME
 from foosball_rl.algorithms.model_loader import ALGOS
+from foosball_rl.environments.common.worker_context import get_worker_context
 from foosball_rl.environments.create_env import create_eval_envs
 
 logger = logging.getLogger(__name__)
 
-logged_callback_values = defaultdict(list)
+# The evaluation environments and the last loaded model of the current (worker) process, see _init_worker
+_worker: Dict[str, Any] = {}
+
+# (model path, VecNormalize statistics path or None to keep the loaded ones, index of the first episode)
+EvaluationTask = Tuple[str, Optional[str], int]
 
 
 def evaluate_model(env_id: str, algo: str, eval_path: Path) -> None:
-    config_path = Path(__file__).parent / 'execution_mode_config.yml'
-    with open(config_path) as f:
-        eval_config = yaml.safe_load(f)['Evaluation']
+    """
+    Evaluates a model on ``n_eval_episodes`` episodes, which are split into batches of ``n_eval_envs`` episodes and
+    distributed over ``n_eval_workers`` processes. Episode ``i`` is always seeded with ``eval_seed + i``, so the
+    results do not depend on the number of workers (the number of environments sets the batch size of the policy,
+    whose rounding differences can make single episodes diverge). The result of every episode is appended to a
+    JSON lines file as soon as its batch is finished, only the summary statistics are kept in memory.
+    """
+    eval_config = _load_config('Evaluation')
 
     model_path = eval_config['model_path']
     eval_seed = eval_config['eval_seed']
     n_eval_episodes = eval_config['n_eval_episodes']
+    n_eval_envs = min(eval_config['n_eval_envs'], n_eval_episodes)
+    tasks = [(model_path, None, batch_start) for batch_start in range(0, n_eval_episodes, n_eval_envs)]
+    n_eval_workers = min(eval_config['n_eval_workers'] or os.cpu_count(), len(tasks))
 
-    logger.info("Evaluating Alg: %s loaded from %s on %s environment", algo, model_path, env_id)
-
-    model = ALGOS[algo].load(model_path)
+    logger.info("Evaluating Alg: %s loaded from %s on %s environment with %s episodes, %s envs and %s workers",
+                algo, model_path, env_id, n_eval_episodes, n_eval_envs, n_eval_workers)
 
-    venv = create_eval_envs(env_id, n_eval_envs=n_eval_episodes, seed=eval_seed, video_logging_path=eval_path,
-                            vec_normalize_path=eval_config['vec_normalize_load_path'])
-
-    episode_rewards, episode_lengths = evaluate_policy(model=model, env=venv, n_eval_episodes=n_eval_episodes,
-                                                       callback=_log_callback)
+    eval_path.mkdir(parents=True, exist_ok=True)
+    results_path = eval_path / f'{_result_file_prefix(Path(model_path).name)}.jsonl'
+    worker_args = (env_id, algo, eval_seed, n_eval_envs, n_eval_episodes, eval_path, eval_config)
+    statistics = _EvaluationStatistics()
+    with open(results_path, 'w') as results_file:
+        for episode_results in _run_tasks(tasks, n_eval_workers, worker_args):
+            _write_episode_results(results_file, episode_results)
+            statistics.add(episode_results)
+            logger.info("Evaluated %s episodes", statistics.n_episodes)
 
     save_results(eval_path=eval_path,
                  eval_seed=eval_seed,
                  n_eval_episodes=n_eval_episodes,
                  model_path=model_path,
-                 episode_rewards=episode_rewards,
-                 episode_lengths=episode_lengths,
-                 callback_values=logged_callback_values)
+                 episode_rewards=statistics.mean_std('reward'),
+                 episode_lengths=statistics.mean_std('length'),
+                 callback_values=statistics.callback_means())
+
+    logger.info("Mean reward: %.2f +/- %.2f, Mean episode length: %.2f +/- %.2f",
+                *statistics.mean_std('reward'), *statistics.mean_std('length'))
+    logger.info("Saved the results of the single episodes to %s", results_path)
 
-    logger.info("Mean reward: %s, Mean episode length: %s", episode_rewards, episode_lengths)
+
+def run_tournament(env_id: str, algo: str, tournament_path: Path) -> None:
+    """
+    Evaluates every checkpoint matched by ``checkpoint_paths`` on the same ``n_eval_episodes`` episodes and ranks
+    them by their mean reward. As in ``evaluate_model``, episode ``i`` is seeded with ``eval_seed + i`` and starts
+    from the initial state of the model, so all checkpoints face identical episode starts (common random numbers)
+    and the differences between them are not blurred by different ball trajectories. The episodes of all checkpoints
+    are distributed over one pool of workers, which build their environments once and swap only the model and its
+    ``VecNormalize`` statistics.
+    """
+    tournament_config = _load_config('Tournament')
+
+    checkpoint_paths = find_checkpoints(tournament_config['checkpoint_paths'])
+    if not checkpoint_paths:
+        raise ValueError(f"No checkpoints found in {tournament_config['checkpoint_paths']}")
+    eval_seed = tournament_config['eval_seed']
+    n_eval_episodes = tournament_config['n_eval_episodes']
+    n_eval_envs = min(tournament_config['n_eval_envs'], n_eval_episodes)
+    tasks = [(str(checkpoint_path), find_vec_normalize_path(checkpoint_path, tournament_config['vec_normalize_load_path']),
+              batch_start)
+             for checkpoint_path in checkpoint_paths for batch_start in range(0, n_eval_episodes, n_eval_envs)]
+    n_eval_workers = min(tournament_config['n_eval_workers'] or os.cpu_count(), len(tasks))
+
+    logger.info("Tournament of %s %s checkpoints on %s environment with %s episodes each, %s envs and %s workers",
+                len(checkpoint_paths), algo, env_id, n_eval_episodes, n_eval_envs, n_eval_workers)
+
+    tournament_path.mkdir(parents=True, exist_ok=True)
+    results_path = tournament_path / f'{_result_file_prefix("tournament")}.jsonl'
+    worker_args = (env_id, algo, eval_seed, n_eval_envs, n_eval_episodes, tournament_path, tournament_config)
+    statistics = {str(checkpoint_path): _EvaluationStatistics() for checkpoint_path in checkpoint_paths}
+    n_finished_tasks = 0
+    with open(results_path, 'w') as results_file:
+        for episode_results in _run_tasks(tasks, n_eval_workers, worker_args):
+            _write_episode_results(results_file, episode_results)
+            statistics[episode_results[0]['model_path']].add(episode_results)
+            n_finished_tasks += 1
+            logger.info("Evaluated %s of %s episode batches", n_finished_tasks, len(tasks))
+
+    ranking = sorted(statistics.items(), key=lambda item: item[1].mean_std('reward')[0], reverse=True)
+    table = _ranking_table(ranking)
+    with open(results_path.with_suffix('.txt'), 'w') as f:
+        f.write(f"Experiment name: {EXPERIMENT_NAME}\n")
+        f.write("-" * 50 + "\n")
+        f.write(f"Evaluation seed: {eval_seed}\n")
+        f.write(f"Number of evaluation episodes per checkpoint: {n_eval_episodes}\n")
+        f.write("-" * 50 + "\n")
+        f.write(table + "\n")
+    logger.info("Tournament ranking:\n%s", table)
+    logger.info("Saved the results of the single episodes to %s", results_path)
+
+
+def find_checkpoints(checkpoint_paths: Union[str, List[str]]) -> List[Path]:
+    """
+    Resolves directories (all ``.zip`` files directly inside), glob patterns and files to a list of checkpoints,
+    ordered by directory and training steps.
+    """
+    if isinstance(checkpoint_paths, str):
+        checkpoint_paths = [checkpoint_paths]
+    found = set()
+    for checkpoint_path in checkpoint_paths:
+        if os.path.isdir(checkpoint_path):
+            found.update(Path(checkpoint_path).glob('*.zip'))
+        else:
+            found.update(Path(path) for path in glob.glob(checkpoint_path, recursive=True))
+    return sorted(found, key=lambda path: (str(path.parent), _checkpoint_steps(path), path.name))
+
+
+def find_vec_normalize_path(checkpoint_path: Path, default_path: Optional[str]) -> Optional[str]:
+    """
+    Returns the ``VecNormalize`` statistics saved with a checkpoint: ``<prefix>_vecnormalize_<steps>_steps.pkl`` of
+    the ``CheckpointCallback`` or ``vecnormalize.pkl`` next to the best model of the ``EvalCallback``. Falls back to
+    ``default_path``.
+    """
+    match = re.fullmatch(r'(.*)_(\d+)_steps', checkpoint_path.stem)
+    candidates = [checkpoint_path.with_name(f'{match[1]}_vecnormalize_{match[2]}_steps.pkl')] if match else []
+    candidates.append(checkpoint_path.with_name('vecnormalize.pkl'))
+    for candidate in candidates:
+        if candidate.is_file():
+            return str(candidate)
+    return default_path
 
 
 def save_results(eval_path: Path,
                  model_path: str,
                  eval_seed: int,
                  n_eval_episodes: int,
-                 episode_rewards: float,
-                 episode_lengths: float,
+                 episode_rewards: Tuple[float, float],
+                 episode_lengths: Tuple[float, float],
                  callback_values: Dict[str, Any] = None) -> None:
-    eval_file_name = f'evaluation_result_{EXPERIMENT_NAME}_{model_path[model_path.rindex("/") + 1:]}_{round(time.time() * 1000)}.txt'
+    eval_file_name = f'{_result_file_prefix(Path(model_path).name)}.txt'
     with open(eval_path / eval_file_name, 'w') as f:
         f.write(f"Experiment name: {EXPERIMENT_NAME}\n")
         f.write("-" * 50 + "\n")
@@ -61,17 +167,194 @@ def save_results(eval_path: Path,
         f.write(f"Model path: {model_path}\n")
         f.write(f"Number of evaluation episodes: {n_eval_episodes}\n")
         f.write("-" * 50 + "\n")
-        f.write(f"Mean reward: {episode_rewards}\n")
-        f.write(f"Mean episode length: {episode_lengths}\n")
+        f.write(f"Mean reward: {episode_rewards[0]} +/- {episode_rewards[1]}\n")
+        f.write(f"Mean episode length: {episode_lengths[0]} +/- {episode_lengths[1]}\n")
         f.write("-" * 50 + "\n")
-        f.write("Callback values:\n")
+        f.write("Callback values (mean over all steps):\n")
         for k, v in callback_values.items():
             f.write(f"{k}: {v}\n")
         f.write("-" * 50 + "\n")
 
 
+def _load_config(section: str) -> Dict[str, Any]:
+    config_path = Path(__file__).parent / 'execution_mode_config.yml'
+    with open(config_path) as f:
+        return yaml.safe_load(f)[section]
+
+
+def _result_file_prefix(name: str) -> str:
+    return f'evaluation_result_{EXPERIMENT_NAME}_{name}_{round(time.time() * 1000)}'
+
+
+def _checkpoint_steps(checkpoint_path: Path) -> int:
+    match = re.fullmatch(r'.*_(\d+)_steps', checkpoint_path.stem)
+    return int(match[1]) if match else -1
+
+
+def _ranking_table(ranking: List[Tuple[str, '_EvaluationStatistics']]) -> str:
+    rows = [("Rank", "Checkpoint", "Mean reward", "Std reward", "Mean length")]
+    for rank, (checkpoint_path, statistics) in enumerate(ranking, start=1):
+        mean_reward, std_reward = statistics.mean_std('reward')
+        rows.append((str(rank), checkpoint_path, f'{mean_reward:.3f}', f'{std_reward:.3f}',
+                     f"{statistics.mean_std('length')[0]:.1f}"))
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join(" | ".join(value.ljust(width) for value, width in zip(row, widths)) for row in rows)
+
+
+def _write_episode_results(results_file, episode_results: List[Dict[str, Any]]) -> None:
+    for episode_result in episode_results:
+        results_file.write(json.dumps(episode_result) + '\n')
+    results_file.flush()
+
+
+class _EvaluationStatistics:
+    """Keeps running sums of the episode results instead of the results themselves."""
+
+    def __init__(self):
+        self.n_episodes = 0
+        self._sums = defaultdict(float)
+        self._squared_sums = defaultdict(float)
+        self._callback_sums = defaultdict(float)
+        self._callback_counts = defaultdict(int)
+
+    def add(self, episode_results: List[Dict[str, Any]]) -> None:
+        for episode_result in episode_results:
+            self.n_episodes += 1
+            for key in ('reward', 'length'):
+                self._sums[key] += episode_result[key]
+                self._squared_sums[key] += episode_result[key] ** 2
+            for key, values in episode_result['callback_values'].items():
+                self._callback_sums[key] += float(np.sum(values))
+                self._callback_counts[key] += len(values)
+
+    def mean_std(self, key: str) -> Tuple[float, float]:
+        mean = self._sums[key] / self.n_episodes
+        return mean, float(np.sqrt(max(self._squared_sums[key] / self.n_episodes - mean ** 2, 0.)))
+
+    def callback_means(self) -> Dict[str, float]:
+        return {key: self._callback_sums[key] / self._callback_counts[key] for key in self._callback_sums}
+
+
+def _run_tasks(tasks: List[EvaluationTask], n_workers: int, worker_args: tuple) -> Iterator[List[Dict[str, Any]]]:
+    """Yields the episode results of every task as soon as it is finished, in the main process for one worker."""
+    if n_workers == 1:
+        _init_worker(*worker_args, worker_idx=None)
+        try:
+            for task in tasks:
+                yield _evaluate_task(task)
+        finally:
+            _close_worker()
+    else:
+        ctx = get_worker_context()
+        worker_counter = ctx.Value('i', 0)
+        with ctx.Pool(n_workers, initializer=_init_pool_worker, initargs=(*worker_args, worker_counter)) as pool:
+            yield from pool.imap_unordered(_evaluate_task, tasks)
+
+
+def _init_pool_worker(*args) -> None:
+    *worker_args, worker_counter = args
+    with worker_counter.get_lock():
+        worker_idx = worker_counter.value
+        worker_counter.value += 1
+    # The workers already use all cores
+    th.set_num_threads(1)
+    _init_worker(*worker_args, worker_idx=worker_idx)
+
+
+def _init_worker(env_id: str, algo: str, eval_seed: int, n_eval_envs: int, n_eval_episodes: int, eval_path: Path,
+                 eval_config: Dict[str, Any], worker_idx: Optional[int]) -> None:
+    # Every worker records its videos and trajectories into its own directory
+    logging_path = eval_path if worker_idx is None else eval_path / f'worker-{worker_idx}'
+    _worker['venv'] = create_eval_envs(env_id, n_eval_envs=n_eval_envs, seed=eval_seed,
+                                       video_logging_path=logging_path,
+                                       vec_normalize_path=eval_config['vec_normalize_load_path'],
+                                       vec_env_backend=eval_config['vec_env_backend'])
+    vec_normalize = unwrap_vec_normalize(_worker['venv'])
+    # The statistics of vec_normalize_load_path (or fresh ones) for the checkpoints without statistics of their own
+    _worker['initial_rms'] = (vec_normalize.obs_rms, vec_normalize.ret_rms) if vec_normalize is not None else None
+    _worker['algo'] = algo
+    _worker['eval_seed'] = eval_seed
+    _worker['n_eval_episodes'] = n_eval_episodes
+    _worker['model_path'] = None
+
+
+def _close_worker() -> None:
+    _worker.pop('venv').close()
+    _worker.clear()
+
+
+def _evaluate_task(task: EvaluationTask) -> List[Dict[str, Any]]:
+    model_path, vec_normalize_path, batch_start = task
+    if _worker['model_path'] != model_path:
+        _worker['model'] = ALGOS[_worker['algo']].load(model_path, device='cpu')
+        _worker['model_path'] = model_path
+        vec_normalize = unwrap_vec_normalize(_worker['venv'])
+        if vec_normalize is not None:
+            # The tasks reach the workers in no fixed order, so the statistics of the previous checkpoint of this
+            # worker must never be kept
+            if vec_normalize_path is not None:
+                with open(vec_normalize_path, 'rb') as f:
+                    saved_vec_normalize = pickle.load(f)
+                vec_normalize.obs_rms = saved_vec_normalize.obs_rms
+                vec_normalize.ret_rms = saved_vec_normalize.ret_rms
+            else:
+                vec_normalize.obs_rms, vec_normalize.ret_rms = _worker['initial_rms']
+    episode_results = _evaluate_batch(batch_start)
+    for episode_result in episode_results:
+        episode_result['model_path'] = model_path
+    return episode_results
+
+
+def _evaluate_batch(batch_start: int) -> List[Dict[str, Any]]:
+    """
+    Runs the episodes ``batch_start, batch_start + 1, ...``, one per environment, each seeded with
+    ``eval_seed + episode``. Environments that finished their episode keep stepping until the batch is done, but are
+    not counted any more.
+    """
+    model, venv = _worker['model'], _worker['venv']
+    n_envs = venv.num_envs
+    batch_size = min(n_envs, _worker['n_eval_episodes'] - batch_start)
+    episode_seed = _worker['eval_seed'] + batch_start
+    venv.seed(episode_seed)
+    # Every episode starts from the initial state of the model, independent of the episodes evaluated before
+    venv.set_options({'reset_simulation': True})
+    observations = venv.reset()
+
+    active = np.arange(n_envs) < batch_size
+    current_rewards = np.zeros(n_envs)
+    current_lengths = np.zeros(n_envs, dtype=int)
+    states = None
+    episode_starts = np.ones(n_envs, dtype=bool)
+    callback_values = [defaultdict(list) for _ in range(n_envs)]
+    episode_results = []
+    while active.any():
+        actions, states = model.predict(observations, state=states, episode_start=episode_starts,
+                                        deterministic=True)
+        observations, rewards, dones, infos = venv.step(actions)
+        current_rewards += rewards
+        current_lengths += 1
+        for i in np.flatnonzero(active):
+            info = infos[i]
+            episode_values = callback_values[i]
+            _log_callback(locals(), globals())
+            if dones[i]:
+                active[i] = False
+                # The Monitor wrapper holds the unnormalized episode statistics
+                episode_info = info.get('episode', {'r': current_rewards[i], 'l': current_lengths[i]})
+                episode_results.append({'episode': batch_start + int(i),
+                                        'seed': episode_seed + int(i),
+                                        'reward': float(episode_info['r']),
+                                        'length': int(episode_info['l']),
+                                        'callback_values': dict(episode_values)})
+        episode_starts = dones
+    return episode_results
+
+
 def _log_callback(locals_: Dict[str, Any], globals_: Dict[str, Any]) -> None:
     """
+    Called after every step for every environment whose episode is evaluated. Values appended to
+    ``locals_["episode_values"]`` are saved with the result of the episode.
+
     :param locals_:
     :param globals_:
     """
@@ -79,7 +362,8 @@ def _log_callback(locals_: Dict[str, Any], globals_: Dict[str, Any]) -> None:
     # <<ExtensionPoint>>: You can add custom callback logging here
     ##############################
     # info = locals_["info"]
+    # episode_values = locals_["episode_values"]
     # ball_position = info["ball_position"]
-    # logged_callback_values["custom/ball_position_x"].append(ball_position[0])
-    # logged_callback_values["custom/ball_position_y"].append(ball_position[1])
-    # logged_callback_values["custom/ball_position_z"].append(ball_position[2])
+    # episode_values["custom/ball_position_x"].append(float(ball_position[0]))
+    # episode_values["custom/ball_position_y"].append(float(ball_position[1]))
+    # episode_values["custom/ball_position_z"].append(float(ball_position[2]))
@@ -0,0 +1,81 @@
+import copy
+import logging
+from pathlib import Path
+
+import gymnasium as gym
+import mujoco
+import yaml
+
+from foosball_rl.environments.common.trajectory import find_trajectories, load_trajectory, TrajectoryEpisode
+
+logger = logging.getLogger(__name__)
+
+
+def render_trajectories(env_id: str, render_path: Path) -> None:
+    """
+    Renders the trajectories recorded with the ``TrajectoryRecorderWrapper`` to videos or plays them back in the
+    ``MujocoViewer``. The environment id stored with a trajectory takes precedence over ``env_id``.
+    """
+    config_path = Path(__file__).parent / 'execution_mode_config.yml'
+    with open(config_path) as f:
+        render_config = yaml.safe_load(f)['Render']
+
+    trajectory_paths = find_trajectories(Path(render_config['trajectory_path']))
+    logger.info("Rendering %s trajectory files from %s as %s", len(trajectory_paths),
+                render_config['trajectory_path'], render_config['output'])
+
+    for trajectory_path in trajectory_paths:
+        metadata, episodes = load_trajectory(trajectory_path)
+        mj_model = _load_render_model(metadata['env_id'] or env_id, render_config['height'], render_config['width'])
+        mj_data = mujoco.MjData(mj_model)
+        episode_indices = render_config['episodes'] if render_config['episodes'] is not None else range(len(episodes))
+        for episode_idx in episode_indices:
+            episode = episodes[episode_idx]
+            if render_config['output'] == 'video':
+                video_path = render_path / f'{trajectory_path.stem}-episode-{episode_idx}.mp4'
+                render_video(mj_model, mj_data, episode, video_path, camera=render_config['camera'],
+                             height=render_config['height'], width=render_config['width'], fps=1 / metadata['dt'])
+            elif render_config['output'] == 'viewer':
+                play_back(mj_model, mj_data, episode, dt=metadata['dt'])
+            else:
+                raise ValueError(f"Unknown render output: {render_config['output']}")
+
+
+def render_video(mj_model: mujoco.MjModel, mj_data: mujoco.MjData, episode: TrajectoryEpisode, video_path: Path,
+                 camera: str, height: int, width: int, fps: float) -> None:
+    from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+    video_path.parent.mkdir(parents=True, exist_ok=True)
+    renderer = mujoco.Renderer(mj_model, height=height, width=width)
+    writer = FFMPEG_VideoWriter(str(video_path), (width, height), fps=fps)
+    try:
+        for step in range(len(episode)):
+            episode.set_state(mj_model, mj_data, step)
+            renderer.update_scene(mj_data, camera)
+            writer.write_frame(renderer.render())
+    finally:
+        writer.close()
+        renderer.close()
+    logger.info("Saved video of %s steps to %s", len(episode), video_path)
+
+
+def play_back(mj_model: mujoco.MjModel, mj_data: mujoco.MjData, episode: TrajectoryEpisode, dt: float) -> None:
+    from foosball_rl.environments.common.mujoco_viewer import MujocoViewer
+
+    viewer = MujocoViewer(mj_model, mj_data, dt)
+    try:
+        for step in range(len(episode)):
+            episode.set_state(mj_model, mj_data, step)
+            viewer.render()
+    finally:
+        viewer.stop()
+
+
+def _load_render_model(env_id: str, height: int, width: int) -> mujoco.MjModel:
+    env = gym.make(env_id, render_mode=None)
+    # A private copy, whose offscreen framebuffer is enlarged to allow rendering at any resolution
+    mj_model = copy.copy(env.unwrapped.mj_model)
+    env.close()
+    mj_model.vis.global_.offwidth = max(mj_model.vis.global_.offwidth, width)
+    mj_model.vis.global_.offheight = max(mj_model.vis.global_.offheight, height)
+    return mj_model
@@ -1,36 +1,151 @@
 import logging
+import logging.config
+import os
+import pickle
+import shutil
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
+from typing import Dict, Optional
 
+import torch as th
 import yaml
 from stable_baselines3 import HerReplayBuffer  # noqa: F401
 from stable_baselines3.common.type_aliases import GymEnv
+from stable_baselines3.common.utils import get_latest_run_id
 
-from foosball_rl.algorithms.model_loader import get_model
-from foosball_rl.callbacks.callback_configurator import get_callbacks
+from foosball_rl.algorithms.model_loader import get_model, load_model
+from foosball_rl.callbacks.callback_configurator import get_callbacks, restore_callback_progress, callback_conf, \
+    CALLBACK_CONFIG
+from foosball_rl.environments.common.checkpoint_writer import find_latest_checkpoint
+from foosball_rl.environments.common.training_state import restore_training_state
+from foosball_rl.environments.common.worker_context import get_worker_context
 from foosball_rl.environments.create_env import create_envs
-from foosball_rl.logging.logging_utils import aggregate_results, log_training_config
+from foosball_rl.logging.logging_utils import log_training_config, truncate_tensorboard_run
+from foosball_rl.logging.tensorboard_aggregator import StreamingTensorboardAggregator, AGGREGATES_DIR
 
 logger = logging.getLogger(__name__)
 
 
-def train_loop(env_id: str, algo: str, training_path: Path) -> None:
+def train_loop(env_id: str, algo: str, training_path: Path, resume: bool = False) -> None:
+    """
+    Trains all seeds of the training config. With ``resume``, every seed continues from the latest checkpoint in
+    ``training_path`` (see ``train_seed``) and the aggregates of the TensorBoard runs are rebuilt.
+    """
     config_path = Path(__file__).parent / 'execution_mode_config.yml'
     with open(config_path) as f:
         training_config = yaml.safe_load(f)['Training']
 
-    for seed in training_config['seeds']:
-        logging.info("Creating %s %s envs with seed %s", training_config['n_envs'], env_id, seed)
-        env = create_envs(env_id=env_id, n_envs=training_config['n_envs'], seed=seed, video_logging_path=training_path,
-                          vec_normalize_path=training_config['vec_normalize_load_path'])
-        train(algo=algo, env=env, seed=seed, experiment_path=training_path, training_config=training_config)
-    aggregate_results(training_path)
+    seeds = training_config['seeds']
+    n_parallel_seeds = min(training_config['n_parallel_seeds'], len(seeds))
+    cpu_budget = training_config['cpu_budget']
+    if n_parallel_seeds > 1 and cpu_budget is None:
+        cpu_budget = os.cpu_count()
+    # The rollout collection and the gradient updates of a run alternate, so both may use the whole budget of the run
+    run_cpu_budget = max(1, cpu_budget // n_parallel_seeds) if cpu_budget is not None else None
 
+    if resume:
+        if not (CALLBACK_CONFIG['use_checkpoint_callback'] and callback_conf['CheckpointCallback']['asynchronous']):
+            raise ValueError("Resuming requires the checkpoints of the AsyncCheckpointCallback, enable "
+                             "use_checkpoint_callback and CheckpointCallback.asynchronous in callback_config.yml")
+        # The aggregates are derived from the runs, whose events after the checkpoints are removed when resuming
+        shutil.rmtree(training_path / 'tensorboard' / AGGREGATES_DIR, ignore_errors=True)
+    aggregator = StreamingTensorboardAggregator(training_path / 'tensorboard', n_runs=len(seeds))
+    if n_parallel_seeds == 1:
+        for seed in seeds:
+            train_seed(env_id=env_id, algo=algo, seed=seed, training_path=training_path,
+                       training_config=training_config, cpu_budget=run_cpu_budget, resume=resume)
+            aggregator.update()
+    else:
+        logger.info("Training %s seeds, %s at a time with %s cores each", len(seeds), n_parallel_seeds, run_cpu_budget)
+        # The pool processes are not daemonic, so they may start the worker processes of their envs and callbacks
+        with ProcessPoolExecutor(max_workers=n_parallel_seeds, mp_context=get_worker_context(),
+                                 initializer=_init_seed_process) as executor:
+            futures = {executor.submit(train_seed, env_id=env_id, algo=algo, seed=seed, training_path=training_path,
+                                       training_config=training_config, cpu_budget=run_cpu_budget,
+                                       resume=resume): seed
+                       for seed in seeds}
+            running = set(futures)
+            while running:
+                # The aggregates are updated while the runs are in progress
+                finished, running = wait(running, timeout=training_config['aggregation_interval_s'],
+                                         return_when=FIRST_COMPLETED)
+                for future in finished:
+                    # Re-raises the exception of a failed run
+                    future.result()
+                    logger.info("Finished training run with seed %s", futures[future])
+                aggregator.update()
+    aggregator.close()
 
-def train(algo: str, env: GymEnv, seed: int, experiment_path: Path, training_config) -> None:
-    model, used_hyperparameter = get_model(algo=algo, env=env, seed=seed, experiment_path=experiment_path)
-    log_training_config(env=env, seed=seed, save_path=experiment_path, hyperparameter=used_hyperparameter)
+
+def train_seed(env_id: str, algo: str, seed: int, training_path: Path, training_config,
+               cpu_budget: Optional[int] = None, resume: bool = False) -> None:
+    """
+    Trains one seed. ``cpu_budget`` limits the torch threads and the env worker processes or threads of the run,
+    ``None`` keeps the defaults.
+
+    With ``resume``, the training continues from the latest checkpoint of the ``AsyncCheckpointCallback`` of the seed
+    or starts from scratch in a new TensorBoard run if there is none. A seed whose checkpoint has reached
+    ``total_timesteps`` is skipped.
+    """
+    checkpoint = None
+    if resume:
+        checkpoint = find_latest_checkpoint(training_path / f'seed-{seed}' / 'checkpoints',
+                                            callback_conf['CheckpointCallback']['name_prefix'])
+        if checkpoint is None:
+            logger.info("No checkpoint of seed %s found, training it from scratch", seed)
+        elif checkpoint[0] >= training_config['total_timesteps']:
+            logger.info("Seed %s has already been trained for %s timesteps", seed, checkpoint[0])
+            return
+    if cpu_budget is not None:
+        th.set_num_threads(cpu_budget)
+    vec_normalize_path = training_config['vec_normalize_load_path']
+    if checkpoint is not None and 'vecnormalize' in checkpoint[1]:
+        vec_normalize_path = str(checkpoint[1]['vecnormalize'])
+    logging.info("Creating %s %s envs with seed %s", training_config['n_envs'], env_id, seed)
+    env = create_envs(env_id=env_id, n_envs=training_config['n_envs'], seed=seed, video_logging_path=training_path,
+                      vec_normalize_path=vec_normalize_path,
+                      vec_env_backend=training_config['vec_env_backend'], n_env_workers=cpu_budget)
+    train(algo=algo, env=env, seed=seed, experiment_path=training_path, training_config=training_config,
+          checkpoint_files=checkpoint[1] if checkpoint is not None else None)
+
+
+def train(algo: str, env: GymEnv, seed: int, experiment_path: Path, training_config,
+          checkpoint_files: Optional[Dict[str, Path]] = None) -> None:
+    """
+    :param checkpoint_files: The files of the checkpoint to continue the training from, by kind
+        (see ``checkpoint_writer.py``), which also continues the latest TensorBoard run of the seed. Without, a new
+        model is trained in a new TensorBoard run
+    """
+    if checkpoint_files is None:
+        model, used_hyperparameter = get_model(algo=algo, env=env, seed=seed, experiment_path=experiment_path)
+        log_training_config(env=env, seed=seed, save_path=experiment_path, hyperparameter=used_hyperparameter)
+    else:
+        model = load_model(algo=algo, env=env, model_path=checkpoint_files['model'], experiment_path=experiment_path)
+        if 'replay_buffer' in checkpoint_files:
+            model.load_replay_buffer(checkpoint_files['replay_buffer'])
+        with open(checkpoint_files['training_state'], 'rb') as f:
+            restore_training_state(model, pickle.load(f))
+        logger.info("Resuming training of seed %s at %s timesteps", seed, model.num_timesteps)
 
     tb_log_name = training_config['tb_log_name'] + f'_seed_{seed}'
-    model.learn(total_timesteps=training_config['total_timesteps'], tb_log_name=tb_log_name,
-                callback=get_callbacks(env, seed, experiment_path))
+    callback = get_callbacks(env, seed, experiment_path)
+    if checkpoint_files is not None:
+        restore_callback_progress(callback, n_calls=model.num_timesteps // env.num_envs,
+                                  num_timesteps=model.num_timesteps)
+    # Continues the latest TensorBoard run of the seed, from which the events after the checkpoint are removed. Without a
+    # checkpoint, the runs of the seed are left untouched
+    run_id = get_latest_run_id(model.tensorboard_log, tb_log_name) if checkpoint_files is not None else 0
+    if run_id > 0:
+        truncate_tensorboard_run(Path(model.tensorboard_log) / f'{tb_log_name}_{run_id}', model.num_timesteps)
+    # Without resetting, learn keeps the timesteps of the model, adds them to total_timesteps and logs to the latest run
+    model.learn(total_timesteps=int(training_config['total_timesteps']) - model.num_timesteps, tb_log_name=tb_log_name,
+                callback=callback, reset_num_timesteps=checkpoint_files is None and run_id == 0)
     env.close()
+
+
+def _init_seed_process() -> None:
+    # Freshly started processes do not inherit the logging configuration of the main process
+    with open(Path(__file__).parent.parent / 'logging' / 'logging_config.yml') as f:
+        log_cfg = yaml.safe_load(f)
+    log_cfg['disable_existing_loggers'] = False
+    logging.config.dictConfig(log_cfg)
@@ -4,12 +4,15 @@ from typing import Optional
 
 import gymnasium as gym
 import yaml
-from stable_baselines3.common.vec_env import VecEnv, VecCheckNan, VecNormalize, VecVideoRecorder, VecEnvWrapper
+from gymnasium.wrappers import OrderEnforcing, PassiveEnvChecker, TimeLimit
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import VecEnv, VecCheckNan, VecNormalize, VecEnvWrapper
 
 from foosball_rl import EXPERIMENT_NAME
-from foosball_rl.environments.common.wrappers.action_space_wrappers import get_action_space_wrapper
-from foosball_rl.environments.common.wrappers.custom_vec_wrappers import VecPBRSWrapper
-from foosball_rl.environments.common.wrappers.custom_wrappers import GoalEnvWrapper
+from foosball_rl.environments.common.perf_counters import instrument_env
+from foosball_rl.environments.common.wrappers.custom_vec_wrappers import VecPBRSWrapper, \
+    VecAddActionToObservationsWrapper, AsyncVecVideoRecorder, get_vec_action_space_wrapper
+from foosball_rl.environments.common.wrappers.custom_wrappers import GoalEnvWrapper, TrajectoryRecorderWrapper
 from foosball_rl.environments.common.wrappers.observation_space_wrappers import AddActionToObservationsWrapper
 
 logger = logging.getLogger(__name__)
@@ -22,21 +25,46 @@ with open(wrapper_config_path) as f:
 ENV_WRAPPERS = wrapper_conf['EnvWrapper']
 VEC_ENV_WRAPPERS = wrapper_conf['VecEnvWrapper']
 
+# The gym wrappers applied to the envs (by gym.make, make_vec_env and apply_env_wrappers), outermost first. The action
+# space wrappers are vec env wrappers (see apply_vec_env_wrappers) and are reported by get_applied_vecenv_wrappers
+GYM_WRAPPER_CLASSES = (GoalEnvWrapper, AddActionToObservationsWrapper, TrajectoryRecorderWrapper, Monitor, TimeLimit,
+                       OrderEnforcing, PassiveEnvChecker)
 
-def apply_env_wrappers(env: gym.Env | gym.Wrapper) -> gym.Env | gym.Wrapper:
+
+def apply_env_wrappers(env: gym.Env | gym.Wrapper, trajectory_path: Optional[Path] = None,
+                       env_role: str = 'train') -> gym.Env | gym.Wrapper:
+    if ENV_WRAPPERS['use_trajectory_recorder_wrapper'] and trajectory_path is not None:
+        env = add_trajectory_recorder_wrapper(env, trajectory_path, env_role)
     if ENV_WRAPPERS['use_add_actions_to_observation_wrapper']:
         env = AddActionToObservationsWrapper(env)
     if ENV_WRAPPERS['use_goal_env_wrapper']:
-        env = GoalEnvWrapper(env)  # When using HER
-    if ENV_WRAPPERS['use_action_space_wrapper']:
-        env = get_action_space_wrapper(env, ENV_WRAPPERS['ActionSpaceWrapper'])
+        env = GoalEnvWrapper(env, **ENV_WRAPPERS['GoalEnvWrapper'])  # When using HER
+    # The action space wrapper is applied to the vectorized environment, see apply_vec_env_wrappers
     ############################################
     # <<ExtensionPoint>>: Add more env wrapper here if needed
     ############################################
-    return env
+    return instrument_env(env)
+
+
+def apply_batched_env_wrappers(venv: VecEnv) -> VecEnv:
+    """
+    Applies the vectorized counterparts of the configured env wrappers, for vectorized environments that do not
+    step gym environments (i.e. the ``batched`` backend).
+    """
+    if ENV_WRAPPERS['use_add_actions_to_observation_wrapper']:
+        venv = VecAddActionToObservationsWrapper(venv)
+    if ENV_WRAPPERS['use_goal_env_wrapper'] or ENV_WRAPPERS['use_trajectory_recorder_wrapper']:
+        logger.error("The goal env wrapper and the trajectory recorder wrapper are not supported by the batched "
+                     "backend")
+        raise ValueError("Unsupported env wrapper for the batched vec env backend")
+    return venv
 
 
 def apply_vec_env_wrappers(venv: VecEnv, seed: int, vec_normalize_path: str = None, video_logging_path: str = None) -> VecEnv:
+    if ENV_WRAPPERS['use_action_space_wrapper']:
+        # Discretizes the actions of all environments at once, outside of the env wrappers (which see the continuous
+        # actions, e.g. the actions added to the observations)
+        venv = get_vec_action_space_wrapper(venv, ENV_WRAPPERS['ActionSpaceWrapper'])
     if VEC_ENV_WRAPPERS['use_vec_pbrs_wrapper']:
         venv = VecPBRSWrapper(venv)
     if VEC_ENV_WRAPPERS['use_vec_normalize_wrapper']:
@@ -58,7 +86,7 @@ def add_vec_normalize_wrapper(venv: VecEnv, vec_normalize_path: str) -> VecNorma
     return VecNormalize(venv=venv, **VEC_ENV_WRAPPERS['VecNormalizeWrapper'])
 
 
-def add_video_recording_wrapper(venv: VecEnv, seed: int, video_logging_path: Optional[Path]) -> VecVideoRecorder:
+def add_video_recording_wrapper(venv: VecEnv, seed: int, video_logging_path: Optional[Path]) -> AsyncVecVideoRecorder:
     video_conf = VEC_ENV_WRAPPERS['VecVideoRecorderWrapper']
     if video_logging_path is None:
         video_logging_path = Path(__file__).parent / EXPERIMENT_NAME
@@ -67,16 +95,38 @@ def add_video_recording_wrapper(venv: VecEnv, seed: int, video_logging_path: Opt
     video_log_path = video_logging_path / f"seed-{seed}" / video_conf['video_log_path_suffix']
     logger.info("VecVideoRecordingWrapper: Recording video of length %s every %s steps, saving to %s",
                 video_length, video_interval, video_log_path)
-    env = VecVideoRecorder(venv=venv,
-                           name_prefix="rl-run-video",
-                           record_video_trigger=lambda x: x % video_interval == 0,
-                           video_length=video_length,
-                           video_folder=video_log_path.__str__())
+    env = AsyncVecVideoRecorder(venv=venv,
+                                name_prefix="rl-run-video",
+                                record_video_trigger=lambda x: x % video_interval == 0,
+                                video_length=video_length,
+                                video_folder=video_log_path.__str__(),
+                                max_queued_frames=video_conf['max_queued_frames'])
     return env
 
 
-def get_applied_gym_wrappers(env: gym.Env):
-    env_tmp = env
+def get_trajectory_path(seed: int, logging_path: Optional[Path]) -> Path:
+    if logging_path is None:
+        logging_path = Path(__file__).parent / EXPERIMENT_NAME
+    return logging_path / f"seed-{seed}" / ENV_WRAPPERS['TrajectoryRecorderWrapper']['trajectory_log_path_suffix']
+
+
+def add_trajectory_recorder_wrapper(env: gym.Env, trajectory_path: Path,
+                                    env_role: str = 'train') -> TrajectoryRecorderWrapper:
+    trajectory_conf = ENV_WRAPPERS['TrajectoryRecorderWrapper']
+    return TrajectoryRecorderWrapper(env=env,
+                                     trajectory_dir=trajectory_path,
+                                     name_prefix=env_role,
+                                     episode_interval=trajectory_conf['episode_interval'],
+                                     chunk_size=trajectory_conf['chunk_size'])
+
+
+def get_applied_gym_wrappers(venv: VecEnv):
+    inner_envs = getattr(venv.unwrapped, 'envs', None)
+    if inner_envs is None:
+        # The envs live in subprocesses, which can only check whether their env is wrapped with a given class
+        return [wrapper_class.__name__ for wrapper_class in GYM_WRAPPER_CLASSES
+                if venv.env_is_wrapped(wrapper_class, indices=0)[0]]
+    env_tmp = inner_envs[0]
     wrappers = []
     while isinstance(env_tmp, gym.Wrapper):
         wrappers.append(env_tmp.__class__.__name__)
@@ -0,0 +1,29 @@
+import pytest
+
+from foosball_rl.bench.import_time import SCENARIOS, check_scenario, measure_import_time
+
+
+def test_package_import_time_is_within_budget():
+    scenario = SCENARIOS['package']
+    assert scenario.code == "import foosball_rl"
+    total_ms, imports, forbidden = check_scenario(scenario)
+
+    assert 'foosball_rl' in {module for module, _, _, _ in imports}
+    assert not forbidden
+    assert total_ms <= scenario.budget_ms
+
+
+@pytest.mark.parametrize('name', ['environments', 'env_worker'])
+def test_environments_import_time_is_within_budget(name):
+    scenario = SCENARIOS[name]
+    total_ms, _, forbidden = check_scenario(scenario)
+
+    assert not forbidden
+    assert total_ms <= scenario.budget_ms
+
+
+def test_measure_import_time_reports_nested_modules():
+    imports = measure_import_time("import foosball_rl")
+    for module, self_us, cumulative_us, level in imports:
+        assert isinstance(module, str) and 0 <= self_us <= cumulative_us and level >= 0
+    assert any(level > 0 for _, _, _, level in imports)
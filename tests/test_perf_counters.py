@@ -0,0 +1,32 @@
+import pickle
+
+import gymnasium as gym
+import numpy as np
+import pytest
+from stable_baselines3.common.vec_env import DummyVecEnv, VecNormalize
+
+from foosball_rl.environments import goalkeeper_id
+from foosball_rl.environments.common.perf_counters import PERF_COUNTERS_ENABLED, collect_perf_counters, \
+    instrument_env, instrument_vec_env
+
+
+@pytest.mark.skipif(not PERF_COUNTERS_ENABLED, reason="The perf counters are disabled")
+def test_instrumented_wrappers_are_timed_and_pickled_without_timed_methods():
+    venv = instrument_vec_env(VecNormalize(DummyVecEnv(
+        [lambda: instrument_env(gym.make(goalkeeper_id, render_mode=None))])))
+    venv.reset()
+    collect_perf_counters(venv)
+    for _ in range(5):
+        venv.step(np.zeros((1, *venv.action_space.shape), dtype=venv.action_space.dtype))
+
+    counters = collect_perf_counters(venv)
+    for phase in ('vec_env/step', 'vec_wrapper/VecNormalize', 'vec_env/DummyVecEnv', 'gym_wrapper/TimeLimit',
+                  'env/other', 'env/physics'):
+        assert counters[phase][2] == 5
+
+    env = venv.unwrapped.envs[0]
+    for instrumented in (venv, env, env.unwrapped):
+        assert not {'step', 'step_wait'} & vars(instrumented).keys()
+    unpickled = pickle.loads(pickle.dumps(venv))
+    assert not {'step', 'step_wait'} & vars(unpickled).keys()
+    venv.close()
@@ -0,0 +1,18 @@
+import pytest
+
+from foosball_rl.bench.allocations import measure_step_allocations
+from foosball_rl.environments import foosball_id, goalkeeper_id
+
+N_STEPS = 300
+MAX_MEAN_PEAK_BYTES = 300
+MAX_RETAINED_BYTES = 1024
+
+
+@pytest.mark.parametrize('env_id', [goalkeeper_id, foosball_id])
+def test_reused_step_buffers_allocate_less_than_the_allocating_path(env_id):
+    reusing = measure_step_allocations(env_id, N_STEPS, reuse_step_buffers=True)
+    allocating = measure_step_allocations(env_id, N_STEPS, reuse_step_buffers=False)
+
+    assert reusing['mean_peak_bytes'] < MAX_MEAN_PEAK_BYTES < allocating['mean_peak_bytes']
+    assert reusing['max_peak_bytes'] < allocating['mean_peak_bytes']
+    assert reusing['retained_bytes'] < MAX_RETAINED_BYTES
@@ -0,0 +1,47 @@
+from collections import defaultdict
+
+from tensorboard.backend.event_processing.event_file_loader import LegacyEventFileLoader
+from torch.utils.tensorboard import SummaryWriter
+
+from foosball_rl.logging.tensorboard_aggregator import StreamingTensorboardAggregator, AGGREGATES_DIR
+
+
+def _read_aggregate(tensorboard_path, op):
+    values = defaultdict(list)
+    for event_file in (tensorboard_path / AGGREGATES_DIR / f'operation-{op}').glob('events.out.tfevents.*'):
+        for event in LegacyEventFileLoader(str(event_file)).Load():
+            for value in event.summary.value:
+                values[value.tag].append((event.step, value.simple_value))
+    return values
+
+
+def _log(writer, step, value):
+    writer.add_scalar('eval/mean_reward', value, step)
+    writer.flush()
+
+
+def test_out_of_order_steps_are_written_once(tmp_path):
+    writers = [SummaryWriter(str(tmp_path / f'run-{run}')) for run in range(2)]
+    aggregator = StreamingTensorboardAggregator(tmp_path, n_runs=2, reduce_ops=('mean', 'min'))
+
+    for writer in writers:
+        _log(writer, 0, 1.)
+        _log(writer, 10, 2.)
+    aggregator.update()
+
+    # Late event of an already written step
+    _log(writers[0], 5, 100.)
+    # Late event of a pending step, both runs log step 30
+    _log(writers[0], 40, 4.)
+    _log(writers[0], 30, 3.)
+    _log(writers[1], 30, 5.)
+    _log(writers[1], 40, 6.)
+    aggregator.update()
+    for writer in writers:
+        writer.close()
+    aggregator.close()
+
+    means = _read_aggregate(tmp_path, 'mean')['eval/mean_reward']
+    assert means == [(0, 1.), (10, 2.), (30, 4.), (40, 5.)]
+    assert [step for step, _ in _read_aggregate(tmp_path, 'min')['eval/mean_reward']] == [0, 10, 30, 40]
+    assert aggregator.n_dropped_events == 1
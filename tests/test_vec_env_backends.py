@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from foosball_rl.environments import goalkeeper_id
+from foosball_rl.environments.create_env import create_envs
+from foosball_rl.wrappers.wrapper_configuration import ENV_WRAPPERS, VEC_ENV_WRAPPERS
+
+
+@pytest.fixture(params=['continuous', 'discrete', 'multi_discrete'])
+def vec_env_wrappers(request, monkeypatch):
+    # The action space wrapper is applied to the vectorized environment as well
+    monkeypatch.setitem(ENV_WRAPPERS, 'use_action_space_wrapper', True)
+    monkeypatch.setitem(ENV_WRAPPERS, 'ActionSpaceWrapper', {**ENV_WRAPPERS['ActionSpaceWrapper'],
+                                                             'action_space': request.param})
+    monkeypatch.setitem(VEC_ENV_WRAPPERS, 'use_vec_pbrs_wrapper', True)
+    monkeypatch.setitem(VEC_ENV_WRAPPERS, 'use_vec_normalize_wrapper', True)
+    # Recording needs moviepy and an OpenGL context, which are not part of the tested vec env backends
+    monkeypatch.setitem(VEC_ENV_WRAPPERS, 'use_video_recording_wrapper', False)
+
+
+@pytest.mark.parametrize('vec_env_backend', ['dummy', 'subproc', 'shared_memory', 'batched'])
+def test_backends_step_with_vec_env_wrappers(vec_env_wrappers, vec_env_backend, tmp_path):
+    venv = create_envs(goalkeeper_id, n_envs=2, seed=0, video_logging_path=tmp_path, vec_normalize_path=None,
+                       vec_env_backend=vec_env_backend, n_env_workers=2)
+    try:
+        venv.reset()
+        for _ in range(50):
+            actions = np.stack([venv.action_space.sample() for _ in range(venv.num_envs)])
+            obs, rewards, dones, infos = venv.step(actions)
+            assert obs.shape == (venv.num_envs, *venv.observation_space.shape)
+            assert rewards.shape == (venv.num_envs,) and np.issubdtype(rewards.dtype, np.floating)
+            assert np.all(np.isfinite(rewards))
+    finally:
+        venv.close()